@@ -0,0 +1,61 @@
+"""
+一括採点エンジンのベンチマーク
+1件ずつの採点（grade_answer）と grade_answers の配列採点を比較し、
+problem_attempts に入れた合成データの再採点スループットも計測する
+
+    python benchmarks/bench_grading.py [--answers 200000] [--rows 100000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    parser = argparse.ArgumentParser(description="一括採点のベンチマーク")
+    parser.add_argument("--answers", type=int, default=200000, help="配列採点する回答数")
+    parser.add_argument("--rows", type=int, default=100000, help="再採点する解答記録の行数")
+    parser.add_argument("--batch-size", type=int, default=5000, help="再採点のバッチサイズ")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="bench_grading_"))
+    from models.data_models import Problem
+    from utils import database, grading
+
+    rng = random.Random(0)
+    pool = [f"{rng.uniform(60, 70):.2f}" for _ in range(2000)] + ["66.67", "66.7", "６６．７", "約67", "1,000"]
+    answers = [rng.choice(pool) for _ in range(args.answers)]
+    problem = Problem(id="bench", category="数で考える力", question="?", hints=[], follow_up=[], tags=[],
+                      answer_type="numeric", correct_answer="66.67")
+
+    started = time.perf_counter()
+    single = [grading.grade_answer(problem, a) for a in answers]
+    single_time = time.perf_counter() - started
+    started = time.perf_counter()
+    batch = grading.grade_answers(problem, answers)
+    batch_time = time.perf_counter() - started
+    assert batch.tolist() == single
+    print(f"{'impl':<10}{'answers/s':>14}")
+    print(f"{'single':<10}{args.answers / single_time:>14,.0f}")
+    print(f"{'batch':<10}{args.answers / batch_time:>14,.0f}")
+
+    database.init_database()
+    now = time.time()
+    rows = [(f"{i:09d}", f"u{i % 500}", "bench", "数で考える力", now, 30.0, 1, 0, 0, rng.choice(pool))
+            for i in range(args.rows)]
+    database.run_write(lambda conn: conn.executemany(
+        "INSERT INTO problem_attempts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows))
+    database.rebuild_user_stats()
+
+    started = time.perf_counter()
+    result = grading.regrade_problem(problem, args.batch_size)
+    elapsed = time.perf_counter() - started
+    print(f"regrade: {result['scanned']:,} rows ({result['changed']:,} changed) in {elapsed:.2f}s "
+          f"= {result['scanned'] / elapsed:,.0f} rows/s")
+    database.get_writer().stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+チャット履歴・思考ログの差分保存のベンチマーク
+履歴が数千件に伸びても1クリックあたりの保存コストが一定であることを、
+全件置換モード（append_only=False）と比較して表示する
+
+    python benchmarks/bench_incremental_logs.py [--messages 5000] [--sample 50]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    parser = argparse.ArgumentParser(description="差分保存のベンチマーク")
+    parser.add_argument("--messages", type=int, default=5000, help="最終的な履歴の件数")
+    parser.add_argument("--sample", type=int, default=50, help="計測点ごとに平均を取るクリック数")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="bench_logs_"))
+    from utils import database
+    database.init_database()
+
+    checkpoints = sorted({c for c in (100, 500, 1000, 2000, 5000, args.messages) if c <= args.messages})
+    results = {}
+    for mode in (True, False):
+        session_id = f"bench-{mode}"
+        messages = []
+        timings = {}
+        for checkpoint in checkpoints:
+            # 計測点の手前までは計測せずに履歴を伸ばす
+            while len(messages) < checkpoint - args.sample:
+                messages.append({"role": "user", "text": f"メッセージ{len(messages)}", "timestamp": time.time()})
+                database.save_chat_messages(session_id, "p1", messages, append_only=mode)
+            started = time.perf_counter()
+            clicks = 0
+            while len(messages) < checkpoint:
+                messages.append({"role": "user", "text": f"メッセージ{len(messages)}", "timestamp": time.time()})
+                database.save_chat_messages(session_id, "p1", messages, append_only=mode)
+                clicks += 1
+            timings[checkpoint] = (time.perf_counter() - started) / max(clicks, 1) * 1000
+        results[mode] = timings
+
+    print(f"{'history':>8}{'append(ms)':>14}{'rewrite(ms)':>14}")
+    for checkpoint in checkpoints:
+        print(f"{checkpoint:>8}{results[True][checkpoint]:>14.3f}{results[False][checkpoint]:>14.3f}")
+    print(f"writer: {database.get_writer_stats()}")
+    database.get_writer().stop()
+
+if __name__ == "__main__":
+    main()
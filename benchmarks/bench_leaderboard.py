@@ -0,0 +1,96 @@
+"""
+ランキングのベンチマーク
+多数のユーザーのスコアを一括で読み込み、XPの加算・順位の問い合わせ・上位K人の取得・
+上位のスコアが下がったときの選び直し・データベースからのスナップショット集計を計測する
+比較用に、問い合わせのたびにスコアを並べ替える従来の方式（ORDER BY xp_points 相当）も計測する
+
+    python benchmarks/bench_leaderboard.py [--users 1000000] [--updates 200000] [--queries 10000]
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.leaderboard import Leaderboard, RankingBoard
+
+def main():
+    parser = argparse.ArgumentParser(description="ランキングのベンチマーク")
+    parser.add_argument("--users", type=int, default=1000000, help="ユーザー数")
+    parser.add_argument("--updates", type=int, default=200000, help="XP加算の回数")
+    parser.add_argument("--queries", type=int, default=10000, help="順位の問い合わせ回数")
+    parser.add_argument("--top-k", type=int, default=100, help="保持する上位人数")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    user_ids = [f"user-{i}" for i in range(args.users)]
+    scores = rng.zipf(1.5, size=args.users).clip(max=200000)
+
+    started = time.perf_counter()
+    board = RankingBoard(args.top_k)
+    board.load(user_ids, scores)
+    load_time = time.perf_counter() - started
+
+    targets = rng.integers(0, args.users, size=args.updates).tolist()
+    deltas = rng.integers(-20, 120, size=args.updates).tolist()
+    started = time.perf_counter()
+    for target, delta in zip(targets, deltas):
+        user_id = user_ids[target]
+        board.set(user_id, max(board.scores[user_id] + delta, 0))
+    update_time = time.perf_counter() - started
+
+    probes = [user_ids[i] for i in rng.integers(0, args.users, size=args.queries).tolist()]
+    started = time.perf_counter()
+    for user_id in probes:
+        board.rank(user_id)
+    rank_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(100):
+        top = board.top()
+    top_time = (time.perf_counter() - started) / 100
+
+    # 従来の方式：問い合わせのたびに全ユーザーのスコアを並べ替える
+    current = np.fromiter(board.scores.values(), dtype=np.int64, count=len(board.scores))
+    started = time.perf_counter()
+    order = np.argsort(-current, kind="stable")
+    sort_time = time.perf_counter() - started
+    assert top[0]["score"] == current[order[0]]
+    probe_scores = np.array([board.scores[user_id] for user_id in probes[:100]])
+    assert [int((current > s).sum()) + 1 for s in probe_scores] == [board.rank(u) for u in probes[:100]]
+
+    # 上位のユーザーのスコアが下がったときの選び直し
+    leaders = [entry["user_id"] for entry in board.top(10)]
+    started = time.perf_counter()
+    for user_id in leaders:
+        board.set(user_id, 0)
+        board.top()
+    refresh_time = (time.perf_counter() - started) / len(leaders)
+
+    # スナップショット（総合ボードの上位K人を users のインデックスから集計）
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE users (user_id TEXT PRIMARY KEY, xp_points INTEGER)")
+    conn.execute("CREATE TABLE xp_events (user_id TEXT, delta INTEGER, category TEXT, created_at FLOAT)")
+    conn.executemany("INSERT INTO users VALUES (?, ?)", board.scores.items())
+    conn.execute("CREATE INDEX idx_users_xp ON users (xp_points DESC, user_id)")
+    leaderboard = Leaderboard(args.top_k, snapshot_interval=0)
+    started = time.perf_counter()
+    rows = leaderboard.snapshot_rows(conn)
+    snapshot_time = time.perf_counter() - started
+    assert [row[3] for row in rows] == [entry["user_id"] for entry in board.top()]
+
+    print(f"users: {args.users:,}  updates: {args.updates:,}  queries: {args.queries:,}  top-k: {args.top_k}")
+    print(f"{'bulk load':<22}{load_time:>12.2f} s")
+    print(f"{'updates':<22}{args.updates / update_time:>12,.0f} /s")
+    print(f"{'rank':<22}{rank_time / args.queries * 1e6:>12.1f} us")
+    print(f"{'top-k':<22}{top_time * 1e6:>12.1f} us")
+    print(f"{'top-k refresh':<22}{refresh_time * 1e3:>12.2f} ms")
+    print(f"{'full sort (legacy)':<22}{sort_time * 1e3:>12.1f} ms")
+    print(f"{'snapshot':<22}{snapshot_time * 1e3:>12.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+レベル計算のベンチマーク
+ランキング表示のように多数のユーザーのXPをレベルに変換する場面を想定し、
+従来の実装（呼び出しごとに USER_LEVELS をソート）、LevelCurve.level（bisect）、
+LevelCurve.levels_for（numpy.searchsorted）を比較する
+
+    python benchmarks/bench_level_curve.py [--users 100000] [--max-level 6]
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.helpers import LevelCurve, USER_LEVELS
+
+# 従来の実装（比較用）
+def legacy_level(levels, xp_points):
+    for level, info in sorted(levels.items(), key=lambda x: x[0], reverse=True):
+        if xp_points >= info["req"]:
+            return level
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="レベル計算のベンチマーク")
+    parser.add_argument("--users", type=int, default=100000, help="変換するユーザー数")
+    parser.add_argument("--max-level", type=int, default=6, help="最大レベル（6より大きければ曲線を延長）")
+    args = parser.parse_args()
+
+    curve = LevelCurve(USER_LEVELS).extended(args.max_level)
+    levels = {level: curve.info(level) for level in curve.levels}
+    xp = np.random.default_rng(0).integers(0, curve.thresholds[-1] * 2, size=args.users)
+    xp_list = xp.tolist()
+
+    timings = []
+    started = time.perf_counter()
+    legacy = [legacy_level(levels, x) for x in xp_list]
+    timings.append(("legacy", time.perf_counter() - started))
+    started = time.perf_counter()
+    bisected = [curve.level(x) for x in xp_list]
+    timings.append(("bisect", time.perf_counter() - started))
+    started = time.perf_counter()
+    batch = curve.levels_for(xp)
+    curve.progress_for(xp)
+    timings.append(("searchsorted", time.perf_counter() - started))
+    assert legacy == bisected == batch.tolist()
+
+    print(f"levels: {len(curve)}  users: {args.users:,}")
+    print(f"{'impl':<14}{'users/s':>16}")
+    for name, elapsed in timings:
+        print(f"{name:<14}{args.users / elapsed:>16,.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+LLMリクエストのバッチ化のベンチマーク
+ローカルのモックエンドポイントに対して、同時に届いた回答のフィードバック生成を
+個別送信とバッチ送信で比較し、レイテンシとスループットを表示する
+
+    python benchmarks/bench_llm_batching.py [--students 40] [--latency 0.2] [--capacity 4]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# モックLLMエンドポイント
+class MockHandler(BaseHTTPRequestHandler):
+    """1リクエストごとに固定の処理時間がかかり、同時処理数に上限があるエンドポイント"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with self.server.capacity:
+            time.sleep(self.server.latency)
+        if self.path == "/batch":
+            body = {"results": [{"text": f"feedback:{p['prompt'][:8]}"} for p in payload["batch"]]}
+        else:
+            body = {"text": f"feedback:{payload['prompt'][:8]}"}
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+# 1ラウンドの計測
+def run_round(students: int, generate) -> dict:
+    """students人が同時に回答を送信したときの各呼び出しのレイテンシを計測"""
+    barrier = threading.Barrier(students)
+
+    def _submit(i):
+        barrier.wait()
+        started = time.perf_counter()
+        generate({"question": "問題", "category": "math"}, f"回答{i}")
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=students) as pool:
+        latencies = sorted(pool.map(_submit, range(students)))
+    elapsed = time.perf_counter() - started
+    return {
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "max": latencies[-1],
+        "throughput": students / elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="LLMリクエストのバッチ化ベンチマーク")
+    parser.add_argument("--students", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.2, help="モックの1リクエストあたりの処理時間（秒）")
+    parser.add_argument("--capacity", type=int, default=4, help="モックの同時処理数")
+    parser.add_argument("--window", type=float, default=0.05, help="バッチの時間枠（秒）")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    server.daemon_threads = True
+    server.latency = args.latency
+    server.capacity = threading.Semaphore(args.capacity)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    os.environ["LLM_API_KEY"] = "bench"
+    os.environ["LLM_API_ENDPOINT"] = f"{base}/single"
+    os.environ["LLM_BATCH_WINDOW"] = str(args.window)
+    from utils import llm
+
+    results = {}
+    for mode in ("single", "batch"):
+        if mode == "batch":
+            os.environ["LLM_BATCH_ENDPOINT"] = f"{base}/batch"
+        else:
+            os.environ.pop("LLM_BATCH_ENDPOINT", None)
+        run_round(min(args.students, 4), llm.generate_problem_feedback)  # 接続のウォームアップ
+        results[mode] = run_round(args.students, llm.generate_problem_feedback)
+
+    print(f"students={args.students} latency={args.latency}s capacity={args.capacity} window={args.window}s")
+    print(f"{'mode':<8}{'p50(s)':>10}{'p95(s)':>10}{'max(s)':>10}{'req/s':>10}")
+    for mode, r in results.items():
+        print(f"{mode:<8}{r['p50']:>10.3f}{r['p95']:>10.3f}{r['max']:>10.3f}{r['throughput']:>10.1f}")
+    print(f"batcher: {llm.get_batcher().stats()}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
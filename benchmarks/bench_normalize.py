@@ -0,0 +1,74 @@
+"""
+normalize_text のスループット計測
+problems.json の文章と、全角・半角が混ざった典型的な回答から作ったコーパスで、
+従来の実装（毎回 str.maketrans と正規表現）と現在の実装を比較する
+
+    python benchmarks/bench_normalize.py [--calls 200000]
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils import helpers
+
+# 従来の実装（比較用）
+def legacy_normalize_text(text):
+    if not text:
+        return ""
+    text = re.sub(r'\s+', ' ', text).strip()
+    text = text.translate(str.maketrans({
+        '　': ' ', '，': ',', '．': '.', '！': '!', '？': '?', '：': ':', '；': ';', '（': '(', '）': ')',
+        '［': '[', '］': ']', '｛': '{', '｝': '}', '＋': '+', '－': '-', '＊': '*', '／': '/', '＝': '='
+    }))
+    return text.lower()
+
+# コーパスの作成
+def build_corpus():
+    """問題文・ヒントと、よくある回答の表記ゆれを集める"""
+    with open(os.path.join(ROOT, "problems.json"), encoding="utf-8") as f:
+        problems = json.load(f)
+    corpus = []
+    for problem in problems:
+        corpus.append(problem.get("question", ""))
+        corpus.extend(problem.get("hints", []))
+    corpus += ["66.7", "６６．７", "66.7ポンド", "６６．７　ポンド", "約67ﾎﾟﾝﾄﾞ", "1万円", "１００００÷１５０",
+               "333.3ポンド", "Ａ", "(b)", "  答えは 66.7 です  ", "2.5時間", "２．５ 時間", "800円"]
+    return corpus
+
+# 計測
+def measure(func, texts):
+    started = time.perf_counter()
+    for text in texts:
+        func(text)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="normalize_text のベンチマーク")
+    parser.add_argument("--calls", type=int, default=200000, help="正規化する回数")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    corpus = build_corpus()
+    texts = [rng.choice(corpus) for _ in range(args.calls)]
+
+    results = [
+        ("legacy", measure(legacy_normalize_text, texts)),
+        ("uncached", measure(helpers._normalize_uncached, texts)),
+    ]
+    helpers._normalize_cached.cache_clear()
+    results.append(("cached", measure(helpers.normalize_text, texts)))
+
+    print(f"{'impl':<10}{'texts/s':>14}{'us/call':>10}")
+    for name, elapsed in results:
+        print(f"{name:<10}{args.calls / elapsed:>14,.0f}{elapsed / args.calls * 1e6:>10.2f}")
+    print(f"cache: {helpers._normalize_cached.cache_info()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+数値回答パーサーのスループット計測
+単位・漢数字・式・範囲・「約」を含む回答のコーパスを、キャッシュなし（毎回解析）と
+キャッシュあり（同じ回答は再利用）で解析した速度を表示する
+
+    python benchmarks/bench_numeric_answers.py [--calls 200000] [--unique 2000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import grading
+
+# 回答の生成
+def make_answer(rng):
+    """よくある表記ゆれを含む数値回答を1つ作る"""
+    value = round(rng.uniform(1, 1000), rng.choice([0, 1, 2]))
+    forms = [
+        f"{value}", f"{value}ポンド", f"約{value}", f"{value}円くらい", f"{int(value)}万円",
+        f"{int(value)}〜{int(value) + 5}", f"{int(value) * 150}÷150", f"１{int(value)}．５",
+        f"{int(value)}億{int(value)}万", "三百二十", "わからない",
+    ]
+    return rng.choice(forms)
+
+# 計測
+def measure(func, answers):
+    started = time.perf_counter()
+    for answer in answers:
+        func(answer)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="数値回答パーサーのベンチマーク")
+    parser.add_argument("--calls", type=int, default=200000, help="解析する回答数")
+    parser.add_argument("--unique", type=int, default=2000, help="異なる回答の数")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    pool = [make_answer(rng) for _ in range(args.unique)]
+    answers = [rng.choice(pool) for _ in range(args.calls)]
+
+    uncached = grading._parse_numeric_cached.__wrapped__
+    results = [("uncached", measure(lambda a: uncached(grading.normalize_text(a)), answers))]
+    grading._parse_numeric_cached.cache_clear()
+    results.append(("cached", measure(grading.parse_numeric_answer, answers)))
+
+    parsed = sum(1 for a in pool if grading.parse_numeric_answer(a) is not None)
+    print(f"{'impl':<10}{'answers/s':>14}{'us/call':>10}")
+    for name, elapsed in results:
+        print(f"{name:<10}{args.calls / elapsed:>14,.0f}{elapsed / args.calls * 1e6:>10.2f}")
+    print(f"parsed: {parsed}/{len(pool)} unique answers  cache: {grading._parse_numeric_cached.cache_info()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+問題バンクの読み込みのベンチマーク
+合成した問題バンクを、JSONから読み込む場合とコンパイル済みバンクをmmapで読み込む場合とで
+起動時間と常駐メモリ（RSS）を別プロセスで計測して比較する（/procを読むためLinux専用）
+
+    python benchmarks/bench_problem_bank.py [--problems 50000] [--repeat 3]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 計測用の子プロセスで実行するスクリプト
+CHILD = """
+import sys, time
+sys.path.insert(0, {root!r})
+
+def rss_kb():
+    # ru_maxrssは親プロセスの最大値を引き継ぐため、現在のRSSを/procから読む
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+
+from utils.problem_bank import ProblemCatalog, CompiledProblemCatalog
+before = rss_kb()
+started = time.perf_counter()
+if {mode!r} == "json":
+    catalog = ProblemCatalog.from_json({json_path!r})
+else:
+    catalog = CompiledProblemCatalog({bin_path!r})
+loaded = time.perf_counter() - started
+for category in catalog.categories()[:3]:
+    catalog.get_by_index(category, 0)
+print(loaded, rss_kb() - before)
+"""
+
+# 合成問題バンクの作成
+def make_bank(path: str, count: int) -> None:
+    items = []
+    for i in range(count):
+        items.append({
+            "id": f"p{i:06d}",
+            "category": f"カテゴリ{i % 6}",
+            "title": f"問題{i}",
+            "context": "ロンドン旅行で1ポンド=150円、1日あたりの現地支出予算は10,000円とする。" * 2,
+            "question": f"現地で何ポンド使えるか？（問題{i}）",
+            "target_concepts": ["単位換算", "割合"],
+            "hints": [f"ヒント{j}: 1日あたりの予算10,000÷150を計算してみよう。" for j in range(3)],
+            "follow_up": ["1ポンドあたりのレートが変動したら？"],
+            "tags": ["旅行", "予算", f"タグ{i % 50}"],
+            "difficulty": i % 5 + 1,
+            "answer_type": "numeric",
+            "correct_answer": 66.67,
+        })
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(items, f, ensure_ascii=False)
+
+def measure(mode: str, json_path: str, bin_path: str):
+    """子プロセスで読み込み、(読み込み時間[秒], RSS増加[KB]) を返す"""
+    script = CHILD.format(root=ROOT, mode=mode, json_path=json_path, bin_path=bin_path)
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    loaded, rss = output.split()
+    return float(loaded), int(rss)
+
+def main():
+    parser = argparse.ArgumentParser(description="問題バンク読み込みのベンチマーク")
+    parser.add_argument("--problems", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from utils.problem_bank import compile_problem_bank
+
+    workdir = tempfile.mkdtemp(prefix="bench_bank_")
+    json_path = os.path.join(workdir, "problems.json")
+    bin_path = os.path.join(workdir, "problems.bin")
+    make_bank(json_path, args.problems)
+    compile_problem_bank(json_path, bin_path)
+    print(f"problems={args.problems} json={os.path.getsize(json_path) / 1e6:.1f}MB bin={os.path.getsize(bin_path) / 1e6:.1f}MB")
+
+    print(f"{'mode':<8}{'load(ms)':>12}{'rss(MB)':>12}")
+    for mode in ("json", "mmap"):
+        runs = [measure(mode, json_path, bin_path) for _ in range(args.repeat)]
+        load = min(r[0] for r in runs) * 1000
+        rss = min(r[1] for r in runs) / 1024
+        print(f"{mode:<8}{load:>12.1f}{rss:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+safe_eval のマイクロベンチマーク
+従来の「毎回 ast.parse して再帰的に評価する」実装と、
+LRUキャッシュ付きのコンパイル済み評価器を同じ式の集合で比較する
+
+    python benchmarks/bench_safe_eval.py [--calls 200000] [--unique 500]
+"""
+import os
+import sys
+import ast
+import time
+import random
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import helpers
+
+# 従来の実装（比較用）
+def legacy_safe_eval(expr):
+    """毎回解析して再帰的に評価する従来の safe_eval"""
+    try:
+        expr = expr.strip().replace('×', '*').replace('÷', '/').replace('^', '**')
+        node = ast.parse(expr, mode='eval').body
+
+        def _eval(node):
+            if isinstance(node, ast.BinOp):
+                return helpers.OPS[type(node.op)](_eval(node.left), _eval(node.right))
+            elif isinstance(node, ast.UnaryOp):
+                return helpers.OPS[type(node.op)](_eval(node.operand))
+            elif isinstance(node, ast.Constant):
+                return node.value
+            raise ValueError(f"サポートされていない式: {type(node)}")
+
+        return _eval(node)
+    except (SyntaxError, ValueError, TypeError, ZeroDivisionError, KeyError):
+        return None
+
+# 計測
+def measure(func, expressions):
+    started = time.perf_counter()
+    for expr in expressions:
+        func(expr)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="safe_eval のベンチマーク")
+    parser.add_argument("--calls", type=int, default=200000, help="評価回数")
+    parser.add_argument("--unique", type=int, default=500, help="異なる式の数（回答の種類）")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    rng = random.Random(0)
+    templates = ["{a}÷{b}", "{a}×{b}+{c}", "({a}-{b})/{c}", "{a}^2-{b}", "-{a}+{b}*{c}"]
+    pool = [rng.choice(templates).format(a=rng.randint(1, 10000), b=rng.randint(1, 500), c=rng.randint(1, 50))
+            for _ in range(args.unique)]
+    expressions = [rng.choice(pool) for _ in range(args.calls)]
+
+    legacy = measure(legacy_safe_eval, expressions)
+    helpers.compile_expression.cache_clear()
+    compiled = measure(helpers.safe_eval, expressions)
+
+    print(f"{'impl':<12}{'total(s)':>10}{'us/call':>10}")
+    print(f"{'legacy':<12}{legacy:>10.3f}{legacy / args.calls * 1e6:>10.2f}")
+    print(f"{'compiled':<12}{compiled:>10.3f}{compiled / args.calls * 1e6:>10.2f}")
+    print(f"speedup: {legacy / compiled:.1f}x  cache: {helpers.compile_expression.cache_info()}")
+
+    started = time.perf_counter()
+    helpers.safe_eval("9**9**9")
+    print(f"9**9**9 rejected in {(time.perf_counter() - started) * 1000:.3f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+セッション状態の保存のベンチマーク
+ヒント・次の問題のクリックごとに同期で保存する方式（save_session）と、
+ライトビハインドのバッファ（SessionBuffer）に記録してまとめて書き出す方式の1クリックあたりのコストを比較する
+
+    python benchmarks/bench_session_buffer.py [--sessions 50] [--clicks 2000]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    parser = argparse.ArgumentParser(description="セッション状態の保存のベンチマーク")
+    parser.add_argument("--sessions", type=int, default=50, help="同時に操作するセッション数")
+    parser.add_argument("--clicks", type=int, default=2000, help="クリック数")
+    parser.add_argument("--interval", type=float, default=2.0, help="バッファの書き出し間隔（秒）")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="bench_sessions_"))
+    from utils import database
+    database.init_database()
+
+    clicks = [(f"s{i % args.sessions}", f"u{i % args.sessions}", i // args.sessions, i % 3) for i in range(args.clicks)]
+
+    commits = database.get_writer_stats()["completed"]
+    started = time.perf_counter()
+    for session_id, user_id, problem_idx, hint_step in clicks:
+        database.save_session(session_id, user_id, "分析力", problem_idx, hint_step)
+    sync_time = time.perf_counter() - started
+    sync_writes = database.get_writer_stats()["completed"] - commits
+
+    buffer = database.SessionBuffer(flush_interval=args.interval)
+    commits = database.get_writer_stats()["completed"]
+    started = time.perf_counter()
+    for session_id, user_id, problem_idx, hint_step in clicks:
+        buffer.update(session_id, user_id, "分析力", problem_idx, hint_step)
+    buffered_time = time.perf_counter() - started
+    buffer.close()
+    buffered_writes = database.get_writer_stats()["completed"] - commits
+
+    print(f"sessions: {args.sessions}  clicks: {args.clicks:,}")
+    print(f"{'mode':<12}{'us/click':>12}{'writes':>10}")
+    print(f"{'sync':<12}{sync_time / args.clicks * 1e6:>12.1f}{sync_writes:>10}")
+    print(f"{'buffered':<12}{buffered_time / args.clicks * 1e6:>12.1f}{buffered_writes:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,31 @@ class Problem:
     correct_answer: Optional[Union[float, str, List[str]]] = None
     explanation: Optional[str] = None
     related_problems: List[str] = None
+    title: Optional[str] = None
+    context: Optional[str] = None
+    target_concepts: List[str] = None
+    tolerance: Optional[float] = None  # 数値回答の許容誤差（Noneなら既定値）
+    unit: Optional[str] = None  # 数値回答の単位（Noneなら正解値の表記から読み取る）
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "category": self.category,
+            "title": self.title,
+            "context": self.context,
+            "question": self.question,
+            "target_concepts": self.target_concepts or [],
+            "hints": self.hints,
+            "follow_up": self.follow_up,
+            "tags": self.tags,
+            "difficulty": self.difficulty,
+            "answer_type": self.answer_type,
+            "correct_answer": self.correct_answer,
+            "explanation": self.explanation,
+            "related_problems": self.related_problems or [],
+            "tolerance": self.tolerance,
+            "unit": self.unit
+        }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Problem':
@@ -31,7 +56,12 @@ class Problem:
             answer_type=data.get("answer_type", "text"),
             correct_answer=data.get("correct_answer"), 
             explanation=data.get("explanation"),
-            related_problems=data.get("related_problems", [])
+            related_problems=data.get("related_problems", []),
+            title=data.get("title"),
+            context=data.get("context"),
+            target_concepts=data.get("target_concepts", []),
+            tolerance=data.get("tolerance"),
+            unit=data.get("unit")
         )
 
 # チャットメッセージモデル
@@ -1,10 +1,15 @@
 import streamlit as st
-import json
 import time
 import uuid
 import logging
+from functools import partial
 from pathlib import Path
-import sqlite3
+from utils.database import buffer_session, flush_sessions, save_chat_messages, save_thought_logs, save_problem_attempt, flush_session_logs, reset_answer_streak
+from utils.problem_bank import get_catalog
+from utils.grading import grade_answer, parse_numeric_answer
+from utils.achievements import BADGES
+from utils.helpers import calculate_xp_reward
+from utils.llm import stream_problem_feedback, generate_hint, generate_follow_up, LLMPrefetcher, STUB_RESPONSES
 
 # アプリ設定を最初に行う（他のStreamlitコマンドより前）
 st.set_page_config(
@@ -14,8 +19,6 @@ st.set_page_config(
 )
 
 # 定数
-PROBLEM_JSON = "problems.json"
-DB_PATH = "thinking_app.db"
 MAX_HINT = 3
 CATEGORY_ICONS = {
     "数で考える力": "🔢",
@@ -57,33 +60,57 @@ def check_session_state():
     if 'start_time' not in st.session_state:
         st.session_state.start_time = time.time()
 
-# 問題データの読み込み
-@st.cache_data(ttl=3600)
-def load_problems():
-    """問題データをJSONから読み込む（1時間キャッシュ）"""
-    try:
-        with open(PROBLEM_JSON, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"問題データロードエラー: {str(e)}")
-        st.error(f"問題データロードエラー: {str(e)}")
-        return []
+# セッションの問題カタログを取得
+def get_session_catalog():
+    """セッションで使用中の問題カタログを取得（問題の途中では新しい版に切り替えない）"""
+    if 'catalog' not in st.session_state:
+        st.session_state.catalog = get_catalog()
+    return st.session_state.catalog
 
-# 現在のカテゴリの問題を取得
-def get_category_problems():
-    """現在選択されているカテゴリの問題一覧を取得"""
-    problems = load_problems()
+# 現在のカテゴリの問題数を取得
+def get_category_problem_count():
+    """現在選択されているカテゴリの問題数を取得"""
     if st.session_state.current_category:
-        return [p for p in problems if p.get("category") == st.session_state.current_category]
-    return []
+        return get_session_catalog().count(st.session_state.current_category)
+    return 0
+
+# ヒント数の上限を取得
+def get_hint_limit(problem):
+    """用意されたヒントがあればその数、なければLLMで生成するMAX_HINT個"""
+    return len(problem.hints) if problem.hints else MAX_HINT
+
+# ユーザーIDを取得
+def get_user_id():
+    """ログイン中のユーザーID（未設定ならguest）"""
+    return st.session_state.get("user", {}).get("user_id", "guest")
+
+# セッションの先読みを取得
+def get_prefetcher():
+    """セッション単位のLLM先読みを取得"""
+    if 'prefetcher' not in st.session_state:
+        st.session_state.prefetcher = LLMPrefetcher()
+    return st.session_state.prefetcher
+
+# LLM呼び出しの先読み
+def prefetch_llm_calls(problem):
+    """問題を読んでいる間に、LLMが必要な次のヒントとフォローアップを生成しておく"""
+    # 回答後は取り出し済みの先読みを再開しない
+    if st.session_state.answer_submitted:
+        return
+    prefetcher = get_prefetcher()
+    user_id = get_user_id()
+    step = st.session_state.hint_step
+    if len(problem.hints) <= step < get_hint_limit(problem):
+        prefetcher.prefetch(("hint", problem.id, step), generate_hint, problem.to_dict(), step, user_id)
+    if not problem.follow_up:
+        prefetcher.prefetch(("follow_up", problem.id), partial(generate_follow_up, user_id=user_id), problem.to_dict())
 
 # 現在の問題を取得
 def get_current_problem():
     """現在の問題インデックスに対応する問題を取得"""
-    problems = get_category_problems()
-    if problems and 0 <= st.session_state.problem_index < len(problems):
-        return problems[st.session_state.problem_index]
-    return None
+    if not st.session_state.current_category:
+        return None
+    return get_session_catalog().get_by_index(st.session_state.current_category, st.session_state.problem_index)
 
 # チャットメッセージの表示
 def display_chat_messages():
@@ -102,18 +129,60 @@ def display_chat_messages():
             </div>
             """, unsafe_allow_html=True)
 
-# LLM 応答生成スタブ
-def generate_reply(prompt: str) -> str:
-    """LLM応答生成のスタブ関数（将来的にAPI連携）"""
-    # 実際のLLM API呼び出しに置き換え予定
-    return "追加の深掘りを提案します。この問題の解き方をもう少し考えてみましょう。物事を別の視点から見ることで新しい解決策が見つかることがあります。"
+# 深掘りフィードバックのストリーミング表示
+def display_feedback_stream(problem):
+    """
+    保留中のフィードバックを受信しながら表示し、完了後に履歴へ保存
+    保留の印は履歴に格納するまで消さないため、表示中に再実行や例外で中断された場合は次の描画で生成し直す
+    """
+    pending = st.session_state.pending_feedback
+    
+    user_id = get_user_id()
+    feedback = st.write_stream(stream_problem_feedback(problem.to_dict(), pending["answer"], user_id))
+    
+    # フォローアップ質問（LLM生成の場合は先読み結果を使用）
+    if problem.follow_up:
+        follow_up = generate_follow_up(problem.to_dict())
+    else:
+        follow_up = get_prefetcher().take(("follow_up", problem.id), partial(generate_follow_up, user_id=user_id),
+                                          problem.to_dict(), default=STUB_RESPONSES["follow_up"])
+    
+    st.session_state.chat_history.append({
+        "role": "assistant",
+        "text": feedback if isinstance(feedback, str) else "".join(map(str, feedback)),
+        "timestamp": time.time()
+    })
+    st.session_state.chat_history.append({
+        "role": "assistant",
+        "text": f"深掘り質問: {follow_up}",
+        "timestamp": time.time()
+    })
+    # 最終テキストを履歴に格納したので保留を解除
+    st.session_state.pending_feedback = None
+    st.markdown(f"深掘り質問: {follow_up}")
+    
+    # 最終テキストを含めてチャット履歴を保存
+    try:
+        save_chat_messages(
+            st.session_state.session_id,
+            problem.id,
+            st.session_state.chat_history
+        )
+    except Exception as e:
+        logging.error(f"チャット履歴保存エラー: {str(e)}")
 
 # ヒントボタンのコールバック
 def on_hint_click():
     """ヒントボタンクリック時の処理"""
     problem = get_current_problem()
-    if problem and "hints" in problem and st.session_state.hint_step < len(problem["hints"]):
-        hint = problem["hints"][st.session_state.hint_step]
+    step = st.session_state.hint_step
+    if problem and step < get_hint_limit(problem):
+        if step < len(problem.hints):
+            hint = problem.hints[step]
+        else:
+            # LLM生成のヒントは先読み結果を使用
+            hint = get_prefetcher().take(("hint", problem.id, step), generate_hint, problem.to_dict(), step,
+                                         get_user_id(), default=STUB_RESPONSES["hint"])
         st.session_state.chat_history.append({
             "role": "assistant",
             "text": f"ヒント {st.session_state.hint_step + 1}: {hint}",
@@ -121,9 +190,9 @@ def on_hint_click():
         })
         st.session_state.hint_step += 1
         
-        # ヒント使用をデータベースに記録
+        # ヒント使用を記録（バッファにまとめて後で保存）
         try:
-            save_session(
+            buffer_session(
                 st.session_state.session_id,
                 st.session_state.user.get("user_id", "guest"),
                 st.session_state.current_category,
@@ -145,7 +214,7 @@ def on_thought_submit():
         try:
             save_thought_logs(
                 st.session_state.session_id,
-                get_current_problem().get("id", "unknown"),
+                get_current_problem().id,
                 st.session_state.thought_logs
             )
         except Exception as e:
@@ -165,27 +234,19 @@ def process_answer(answer_text, problem):
         "timestamp": time.time()
     })
     
-    # 正誤チェック（簡易実装）
-    is_correct = False
-    correct_answer = problem.get("correct_answer", "")
-    
-    if problem.get("answer_type") == "numeric":
-        # 数値回答の場合
-        try:
-            user_answer = float(answer_text.strip().replace(',', ''))
-            correct_val = float(str(correct_answer).replace(',', ''))
-            is_correct = abs(user_answer - correct_val) < 0.01
-        except (ValueError, TypeError):
-            is_correct = False
-    else:
-        # テキスト回答の場合（単純文字列比較）
-        is_correct = answer_text.strip().lower() == str(correct_answer).lower()
+    # 正誤チェック（再採点と同じ採点エンジンで判定）
+    is_correct = grade_answer(problem, answer_text)
     
     # 回答結果のメッセージを追加
     if is_correct:
-        response = f"正解です！ {problem.get('explanation', '')}"
+        response = f"正解です！ {problem.explanation or ''}"
     else:
         response = f"惜しいですね。もう一度考えてみましょう。"
+        if problem.answer_type == "numeric" and parse_numeric_answer(answer_text) is None:
+            # 数値として読めなかった場合は、答え方の問題であることを伝える
+            response += "（回答を数値として読み取れませんでした。「66.7ポンド」「1万円」「10000÷150」のように入力してください）"
+        # 不正解で連続正解が途切れる
+        reset_answer_streak(get_user_id())
     
     st.session_state.chat_history.append({
         "role": "assistant",
@@ -193,14 +254,9 @@ def process_answer(answer_text, problem):
         "timestamp": time.time()
     })
     
-    # 正解の場合、深掘りフィードバックを提供
+    # 正解の場合、深掘りフィードバックを提供（画面描画時にストリーミング表示）
     if is_correct:
-        feedback = generate_reply(f"Problem: {problem.get('question')} Answer: {answer_text}")
-        st.session_state.chat_history.append({
-            "role": "assistant", 
-            "text": feedback,
-            "timestamp": time.time()
-        })
+        st.session_state.pending_feedback = {"answer": answer_text}
         
         # 問題解答記録を保存
         try:
@@ -211,22 +267,39 @@ def process_answer(answer_text, problem):
             attempt = {
                 "attempt_id": str(uuid.uuid4()),
                 "user_id": st.session_state.user.get("user_id", "guest"),
-                "problem_id": problem.get("id", "unknown"),
-                "category": problem.get("category", "unknown"),
+                "problem_id": problem.id,
+                "category": problem.category,
                 "timestamp": time.time(),
                 "duration": duration,
                 "is_correct": is_correct,
                 "hints_used": st.session_state.hint_step,
                 "thought_length": thought_length,
-                "answer_text": answer_text
+                "answer_text": answer_text,
+                "xp_reward": calculate_xp_reward(problem.to_dict(), duration, st.session_state.hint_step)
             }
             
             save_problem_attempt(attempt)
             
+            # 台帳で加算されたXPとレベルを画面の状態に反映（差分のみ書き込み、行の上書きはしない）
+            if "xp_points" in attempt:
+                st.session_state.user["xp_points"] = attempt["xp_points"]
+                st.session_state.user["level"] = attempt["level"]
+            
+            # 新しく獲得したバッジを知らせる
+            for badge_id in attempt.get("awarded_badges") or []:
+                badge = BADGES.get(badge_id)
+                if badge and badge_id not in st.session_state.user.setdefault("badges", []):
+                    st.session_state.user["badges"].append(badge_id)
+                    st.session_state.chat_history.append({
+                        "role": "assistant",
+                        "text": f"{badge['icon']} バッジ「{badge['name']}」を獲得しました！（{badge['desc']}）",
+                        "timestamp": time.time()
+                    })
+            
             # チャット履歴を保存
             save_chat_messages(
                 st.session_state.session_id,
-                problem.get("id", "unknown"),
+                problem.id,
                 st.session_state.chat_history
             )
         except Exception as e:
@@ -235,29 +308,56 @@ def process_answer(answer_text, problem):
 # 次の問題へ移動するコールバック
 def on_next_problem():
     """次の問題へ移動するボタンクリック時の処理"""
-    problems = get_category_problems()
-    if problems and st.session_state.problem_index < len(problems) - 1:
-        st.session_state.problem_index += 1
+    # 前の問題の先読みは不要になるため取り消す
+    get_prefetcher().cancel_all()
+    
+    # 前の問題の未保存のチャット履歴と思考ログをまとめて保存
+    previous = get_current_problem()
+    if previous:
+        flush_session_logs(
+            st.session_state.session_id,
+            previous.id,
+            st.session_state.chat_history,
+            st.session_state.thought_logs
+        )
+    
+    # 問題の切り替え時に最新の問題カタログへ更新
+    st.session_state.catalog = get_catalog()
+    
+    # 新しいカタログでの現在の問題の位置から進める（前に問題が追加・削除されても重複・飛ばしが起きない）
+    position = st.session_state.catalog.index_of(previous.id) if previous else None
+    if position is None:
+        # 現在の問題が削除された場合は、同じ位置に繰り上がった問題が次の問題
+        position = st.session_state.problem_index - 1
+    
+    if position < get_category_problem_count() - 1:
+        st.session_state.problem_index = position + 1
         st.session_state.hint_step = 0
         st.session_state.chat_history = []
         st.session_state.thought_logs = []
         st.session_state.answer_submitted = False
+        st.session_state.pending_feedback = None
         st.session_state.start_time = time.time()
         
-        # セッション更新
+        # セッション更新（問題の切り替えはタイマーを待たずにこのセッションの変更を書き出す）
         try:
-            save_session(
+            buffer_session(
                 st.session_state.session_id,
                 st.session_state.user.get("user_id", "guest"),
                 st.session_state.current_category,
                 st.session_state.problem_index,
                 st.session_state.hint_step
             )
+            flush_sessions(st.session_state.session_id)
         except Exception as e:
             logging.error(f"セッション更新エラー: {str(e)}")
     else:
         # 全問題終了の処理
         st.session_state.all_complete = True
+        try:
+            flush_sessions(st.session_state.session_id)
+        except Exception as e:
+            logging.error(f"セッション更新エラー: {str(e)}")
 
 # 問題セクションの表示
 def display_problem_section():
@@ -269,15 +369,20 @@ def display_problem_section():
             st.markdown('<meta http-equiv="refresh" content="0;URL=./home">', unsafe_allow_html=True)
         return
     
+    # 読んでいる間にLLM呼び出しを先読み
+    prefetch_llm_calls(problem)
+    
     # 問題表示
-    st.markdown(f"### {problem.get('category')} {CATEGORY_ICONS.get(problem.get('category'), '📝')}")
-    st.markdown(f"**Q. {problem.get('question')}**")
+    st.markdown(f"### {problem.category} {CATEGORY_ICONS.get(problem.category, '📝')}")
+    st.markdown(f"**Q. {problem.question}**")
     
     # チャット履歴の表示
     display_chat_messages()
+    if st.session_state.get("pending_feedback"):
+        display_feedback_stream(problem)
     
     # 回答入力フォーム
-    answer_key = f"answer_{problem.get('id', 'unknown')}"
+    answer_key = f"answer_{problem.id}"
     
     if not st.session_state.answer_submitted:
         st.text_area("あなたの回答", key=answer_key, height=100)
@@ -290,14 +395,13 @@ def display_problem_section():
         st.button("回答する", on_click=on_answer_submit)
     
     # ヒントボタン（回答済みでなく、ヒントが残っている場合）
-    if not st.session_state.answer_submitted and "hints" in problem and st.session_state.hint_step < len(problem["hints"]):
-        st.button(f"ヒントを表示 ({st.session_state.hint_step + 1}/{len(problem['hints'])})", 
+    if not st.session_state.answer_submitted and st.session_state.hint_step < get_hint_limit(problem):
+        st.button(f"ヒントを表示 ({st.session_state.hint_step + 1}/{get_hint_limit(problem)})", 
                 on_click=on_hint_click)
     
     # 次の問題へ（回答済みの場合）
     if st.session_state.answer_submitted:
-        problems = get_category_problems()
-        if problems and st.session_state.problem_index < len(problems) - 1:
+        if st.session_state.problem_index < get_category_problem_count() - 1:
             st.button("次の問題へ", on_click=on_next_problem)
         else:
             st.success("おめでとうございます！すべての問題を完了しました。")
@@ -318,125 +422,6 @@ def display_thought_log_section():
     st.text_area("新しい思考を追加", key="thought_input", height=100)
     st.button("思考を記録", on_click=on_thought_submit)
 
-# データベース関連関数
-def save_session(session_id, user_id, category, problem_idx, hint_step):
-    """セッションデータをデータベースに保存"""
-    try:
-        now = time.time()
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            
-            # セッション存在確認
-            cursor.execute("SELECT session_id FROM sessions WHERE session_id = ?", (session_id,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # 既存セッション更新
-                cursor.execute(
-                    """UPDATE sessions SET  
-                       updated_at = ?,
-                       category = ?,
-                       problem_index = ?,
-                       hint_step = ?
-                       WHERE session_id = ?""",
-                    (now, category, problem_idx, hint_step, session_id)
-                )
-            else:
-                # 新規セッション作成
-                cursor.execute(
-                    """INSERT INTO sessions
-                       (session_id, user_id, created_at, updated_at, category, problem_index, hint_step)
-                       VALUES (?, ?, ?, ?, ?, ?, ?)""", 
-                    (session_id, user_id, now, now, category, problem_idx, hint_step)
-                )
-            
-        return True
-    except sqlite3.Error as e:
-        logging.error(f"セッション保存エラー: {str(e)}")
-        return False
-
-def save_chat_messages(session_id, problem_id, messages):
-    """チャットメッセージをデータベースに保存"""
-    try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            
-            # 既存メッセージ削除
-            cursor.execute(
-                "DELETE FROM chat_history WHERE session_id = ? AND problem_id = ?",
-                (session_id, problem_id)
-            )
-            
-            # 新しいメッセージを挿入
-            for msg in messages:
-                cursor.execute(
-                    """INSERT INTO chat_history
-                       (session_id, problem_id, role, content, timestamp)
-                       VALUES (?, ?, ?, ?, ?)""",
-                    (session_id, problem_id, msg["role"], msg["text"], msg.get("timestamp", time.time()))
-                )
-            
-        return True
-    except sqlite3.Error as e:
-        logging.error(f"チャット履歴保存エラー: {str(e)}")
-        return False
-
-def save_thought_logs(session_id, problem_id, thoughts):
-    """思考ログをデータベースに保存"""
-    try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            
-            # 既存思考ログ削除
-            cursor.execute(
-                "DELETE FROM thought_logs WHERE session_id = ? AND problem_id = ?",
-                (session_id, problem_id)
-            )
-            
-            # 新しい思考ログを挿入
-            for i, thought in enumerate(thoughts):
-                cursor.execute(
-                    """INSERT INTO thought_logs
-                       (session_id, problem_id, content, timestamp) 
-                       VALUES (?, ?, ?, ?)""",
-                    (session_id, problem_id, thought, time.time() - (len(thoughts) - i))
-                )
-            
-        return True
-    except sqlite3.Error as e:
-        logging.error(f"思考ログ保存エラー: {str(e)}")
-        return False
-
-def save_problem_attempt(attempt):
-    """問題解答記録をデータベースに保存"""
-    try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                """INSERT INTO problem_attempts
-                   (attempt_id, user_id, problem_id, category, timestamp,
-                    duration, is_correct, hints_used, thought_length, answer_text)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", 
-                (
-                    attempt["attempt_id"],
-                    attempt["user_id"],
-                    attempt["problem_id"],
-                    attempt["category"],
-                    attempt["timestamp"],
-                    attempt["duration"],
-                    attempt["is_correct"],
-                    attempt["hints_used"],
-                    attempt["thought_length"],
-                    attempt["answer_text"]
-                )
-            )
-            
-        return True
-    except sqlite3.Error as e:
-        logging.error(f"問題解答記録エラー: {str(e)}")
-        return False
-
 # 問題ページのメイン関数
 def main():
     """問題ページのメイン処理"""
@@ -1,33 +1,10 @@
 import streamlit as st
 import json
-import sqlite3
 import time
 from pathlib import Path
-
-# 定数
-DB_PATH = "thinking_app.db"
-USER_LEVELS = {
-    0: {"name": "初心者", "icon": "🌱", "req": 0},
-    1: {"name": "探究者", "icon": "🔍", "req": 100}, 
-    2: {"name": "思考家", "icon": "💭", "req": 300},
-    3: {"name": "分析者", "icon": "📊", "req": 600},
-    4: {"name": "論理家", "icon": "⚖️", "req": 1000},
-    5: {"name": "戦略家", "icon": "♟️", "req": 1500},
-    6: {"name": "賢者", "icon": "🧠", "req": 2500}
-}
-
-# バッジ情報
-BADGES = {
-    "first_correct": {"name": "ファーストステップ", "icon": "🥇", "desc": "初めての正解"},
-    "streak_3": {"name": "3連続正解", "icon": "🔥", "desc": "3問連続で正解"},
-    "streak_5": {"name": "5連続正解", "icon": "🔥🔥", "desc": "5問連続で正解"}, 
-    "streak_10": {"name": "10連続正解", "icon": "🔥🔥🔥", "desc": "10問連続で正解"},
-    "no_hint": {"name": "独力解決者", "icon": "💪", "desc": "ヒントなしで問題を解決"}, 
-    "fast_solver": {"name": "スピード思考", "icon": "⚡", "desc": "60秒以内に正解"},
-    "deep_thinker": {"name": "深い思考", "icon": "🧘", "desc": "300文字以上の思考ログを残す"},
-    "complete_category": {"name": "カテゴリマスター", "icon": "🏆", "desc": "カテゴリ内の全問題を解く"},
-    "all_categories": {"name": "全領域マスター", "icon": "👑", "desc": "すべてのカテゴリで問題を解く"}
-}
+from utils.database import run_write
+from utils.achievements import BADGES
+from utils.helpers import get_level_curve
 
 # セッション状態の確認
 def check_session_state():
@@ -52,14 +29,11 @@ def update_user_profile():
             st.session_state.user["username"] = new_username
             
             # データベースに保存
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute(
+            user_id = st.session_state.user["user_id"]
+            run_write(lambda conn: conn.execute(
                 "UPDATE users SET username = ? WHERE user_id = ?",
-                (new_username, st.session_state.user["user_id"])
-            )
-            conn.commit()
-            conn.close()
+                (new_username, user_id)
+            ))
             
             st.success("プロフィールを更新しました！")
             st.experimental_rerun()
@@ -68,27 +42,15 @@ def update_user_profile():
 
 # レベル情報を取得
 def get_level_info(level):
-    return USER_LEVELS.get(level, USER_LEVELS[0])
+    return get_level_curve().info(level)
 
 # 次のレベル情報を取得
 def get_next_level_info(level):
-    next_level = level + 1
-    if next_level in USER_LEVELS:
-        return USER_LEVELS[next_level]
-    return None
+    return get_level_curve().next_info(level)
 
 # レベル進捗を計算
 def calculate_level_progress(xp_points, level):
-    current_req = USER_LEVELS.get(level, {"req": 0})["req"]
-    next_level = level + 1
-    
-    if next_level in USER_LEVELS:
-        next_req = USER_LEVELS[next_level]["req"]
-        points_in_level = xp_points - current_req
-        level_range = next_req - current_req
-        return min(1.0, points_in_level / level_range)
-    
-    return 1.0  # 最大レベル達成
+    return get_level_curve().progress(xp_points, level)
 
 # ユーザープロフィール表示
 def display_user_profile():
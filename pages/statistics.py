@@ -2,12 +2,12 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-import sqlite3
 import time
 from datetime import datetime, timedelta
+from utils.database import get_user_stats, get_leaderboard_view
+from utils.leaderboard import week_of
 
 # 定数
-DB_PATH = "thinking_app.db"
 CATEGORY_ICONS = {
     "数で考える力": "🔢",
     "ことばで伝える力": "💬", 
@@ -29,105 +29,6 @@ def check_session_state():
                 "username": "ゲストユーザー"
             }
 
-# ユーザー統計の取得
-def get_user_stats(user_id):
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # 全体統計
-        cursor.execute(
-            """SELECT 
-               COUNT(*) as total_attempts,
-               SUM(CASE WHEN is_correct = 1 THEN 1 ELSE 0 END) as correct_answers,
-               AVG(CASE WHEN is_correct = 1 THEN duration ELSE NULL END) as avg_correct_time,
-               SUM(hints_used) as total_hints,
-               AVG(thought_length) as avg_thought_length  
-               FROM problem_attempts
-               WHERE user_id = ?""",
-            (user_id,)
-        )
-        
-        overall = dict(cursor.fetchone() or {
-            "total_attempts": 0,
-            "correct_answers": 0,
-            "avg_correct_time": 0,
-            "total_hints": 0,
-            "avg_thought_length": 0
-        })
-        
-        # 成功率の計算
-        if overall.get("total_attempts"):
-            overall["success_rate"] = (overall.get("correct_answers", 0) / overall.get("total_attempts", 1)) * 100
-        else:
-            overall["success_rate"] = 0
-            
-        # カテゴリ別分析
-        cursor.execute(
-            """SELECT 
-               category,
-               COUNT(*) as attempts,
-               SUM(CASE WHEN is_correct = 1 THEN 1 ELSE 0 END) as correct
-               FROM problem_attempts
-               WHERE user_id = ?
-               GROUP BY category""",
-            (user_id,)
-        )
-        
-        categories = [dict(row) for row in cursor.fetchall()]
-        
-        # 最近の活動 - 最新10件
-        cursor.execute(
-            """SELECT * FROM problem_attempts
-               WHERE user_id = ?
-               ORDER BY timestamp DESC
-               LIMIT 10""",
-            (user_id,)
-        )
-        
-        recent = [dict(row) for row in cursor.fetchall()]
-        
-        # 過去30日の日別活動
-        thirty_days_ago = time.time() - (30 * 24 * 60 * 60) 
-        cursor.execute(
-            """SELECT 
-               date(datetime(timestamp, 'unixepoch', 'localtime')) as day,  
-               COUNT(*) as attempts,
-               SUM(CASE WHEN is_correct = 1 THEN 1 ELSE 0 END) as correct
-               FROM problem_attempts
-               WHERE user_id = ? AND timestamp >= ?
-               GROUP BY day
-               ORDER BY day""",
-            (user_id, thirty_days_ago)
-        )
-        
-        daily = [dict(row) for row in cursor.fetchall()]
-        
-        conn.close()
-        
-        return {
-            "overall": overall,
-            "categories": categories,
-            "recent": recent,
-            "daily": daily  
-        }
-    except sqlite3.Error as e:
-        st.error(f"統計データ取得エラー: {e}")
-        return {  
-            "overall": {
-                "total_attempts": 0,
-                "correct_answers": 0,
-                "avg_correct_time": 0,
-                "total_hints": 0,
-                "avg_thought_length": 0,
-                "success_rate": 0
-            },
-            "categories": [],
-            "recent": [],
-            "daily": []
-        }
-
 # 統計ダッシュボードの表示
 def display_statistics_dashboard(stats):
     # 全体サマリー
@@ -258,6 +159,26 @@ def display_statistics_dashboard(stats):
         
         st.dataframe(display_df, use_container_width=True)
 
+# ランキングの表示
+def display_leaderboard(user_id):
+    st.markdown("---")
+    st.markdown("## ランキング")
+    
+    boards = {"総合": "overall", "今週": f"week:{week_of(time.time())}"}
+    for category in CATEGORY_ICONS:
+        boards[f"{CATEGORY_ICONS[category]} {category}"] = f"category:{category}"
+    label = st.selectbox("ランキングの種類", list(boards.keys()))
+    view = get_leaderboard_view(user_id, boards[label])
+    
+    if view["rank"]:
+        st.metric("あなたの順位", f"{view['rank']}位")
+    if not view["top"]:
+        st.info("まだランキングのデータがありません。")
+    else:
+        df_top = pd.DataFrame(view["top"])[['rank', 'username', 'score']]
+        df_top.columns = ['順位', 'ユーザー', 'XP']
+        st.dataframe(df_top, use_container_width=True, hide_index=True)
+
 # 統計ページのメイン関数
 def main():
     # セッション状態の確認
@@ -274,6 +195,9 @@ def main():
         
         # 統計ダッシュボードの表示
         display_statistics_dashboard(stats)
+        
+        # ランキングの表示
+        display_leaderboard(user.get("user_id", "temp_user"))
     else:
         st.error("ユーザー情報が見つかりません。メインページからやり直してください。")
         if st.button("ホームに戻る"):
@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# テスト用のLLMスタブサーバー
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """
+    /single は {"text": ...}、/batch は {"results": [...]}、/stream は行単位の断片を返す
+    サーバーの属性で遅延・ステータスコード・失敗を制御し、同時実行数を記録する
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with server.lock:
+            server.requests.append((self.path, self.client_address[1]))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            # delays・statusesに値があればリクエストごとに先頭から使う
+            with server.lock:
+                delay = server.delays.pop(0) if server.delays else server.delay
+                status = server.statuses.pop(0) if server.statuses else 200
+            if delay:
+                time.sleep(delay)
+            if status != 200:
+                self._send_json(status, {"error": "stub error"})
+                return
+            if self.path == "/batch":
+                if server.fail_batch:
+                    self._send_json(500, {"error": "batch failed"})
+                else:
+                    self._send_json(200, {"results": [{"text": f"b:{p.get('prompt')}"} for p in payload.get("batch", [])]})
+            elif self.path == "/stream":
+                self._send_stream(payload)
+            else:
+                self._send_json(200, {"text": f"s:{payload.get('prompt')}"})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, payload):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i in range(self.server.stream_chunks):
+                line = (json.dumps({"text": f"c{i}"}) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+                self.wfile.flush()
+                time.sleep(self.server.stream_delay)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.stream_aborted.set()
+            self.close_connection = True
+
+# スタブサーバーの起動
+@pytest.fixture
+def llm_server():
+    """ローカルのLLMスタブサーバーを起動し、ベースURLを属性に持つサーバーを返す"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubLLMHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.delay = 0.0
+    server.delays = []
+    server.statuses = []
+    server.fail_batch = False
+    server.stream_chunks = 3
+    server.stream_delay = 0.0
+    server.stream_aborted = threading.Event()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+# テスト用データベース
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """一時ディレクトリのデータベースを使うよう共有プールとライターを差し替える"""
+    from utils import database
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, "_pool", None)
+    monkeypatch.setattr(database, "_writer", None)
+    monkeypatch.setattr(database, "_database_initialized", False)
+    monkeypatch.setattr(database, "_session_buffer", None)
+    database._persisted_counts.clear()
+    yield database
+    if database._session_buffer is not None:
+        database._session_buffer.close()
+    if database._writer is not None:
+        database._writer.stop()
+    if database._pool is not None:
+        database._pool.close_all()
@@ -0,0 +1,148 @@
+import json
+import time
+import uuid
+
+import pytest
+
+from models.data_models import Problem
+from utils import achievements
+from utils.achievements import AchievementEngine, AchievementState
+from utils.problem_bank import ProblemCatalog
+
+def make_catalog():
+    problems = [
+        Problem(id=f"{category}{i}", category=category, question="?", hints=[], follow_up=[], tags=[])
+        for category in ("a", "b") for i in range(2)
+    ]
+    return ProblemCatalog(problems)
+
+def make_attempt(problem_id, is_correct=True, user_id="u1", **overrides):
+    attempt = {
+        "attempt_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "problem_id": problem_id,
+        "category": problem_id[0],
+        "timestamp": time.time(),
+        "duration": 120.0,
+        "is_correct": is_correct,
+        "hints_used": 1,
+        "thought_length": 10,
+        "answer_text": "x",
+    }
+    attempt.update(overrides)
+    return attempt
+
+def test_apply_awards_each_badge_once():
+    engine = AchievementEngine(make_catalog)
+    catalog = make_catalog()
+    state = AchievementState("u1")
+
+    assert engine.apply(state, make_attempt("a0"), catalog) == ["first_correct"]
+    assert engine.apply(state, make_attempt("a0", hints_used=0, duration=30), catalog) == ["no_hint", "fast_solver"]
+    assert engine.apply(state, make_attempt("a1"), catalog) == ["streak_3", "complete_category"]
+    assert engine.apply(state, make_attempt("b0", is_correct=False, thought_length=400), catalog) == ["deep_thinker"]
+    assert state.streak == 0
+    assert engine.apply(state, make_attempt("b0"), catalog) == ["all_categories"]
+    assert engine.apply(state, make_attempt("b1"), catalog) == []
+    assert state.solved == {"a": {"a0", "a1"}, "b": {"b0", "b1"}}
+    assert state.correct_total == 5
+
+def test_deep_thinker_is_awarded_regardless_of_correctness():
+    engine = AchievementEngine(make_catalog)
+    state = AchievementState("u1", streak=2)
+    assert engine.apply(state, make_attempt("a0", is_correct=False, thought_length=300), make_catalog()) == ["deep_thinker"]
+    assert state.streak == 0 and state.solved == {}
+
+def test_category_completion_survives_catalog_changes():
+    engine = AchievementEngine(make_catalog)
+    state = AchievementState("u1")
+    for problem_id in ("a0", "a1"):
+        engine.apply(state, make_attempt(problem_id), make_catalog())
+
+    # 問題の挿入・並べ替え後も解いた問題は問題IDで判定され、新しい問題を解くまで未達成
+    reordered = ProblemCatalog([
+        Problem(id=pid, category="a", question="?", hints=[], follow_up=[], tags=[]) for pid in ("a1", "a_new", "a0")
+    ])
+    assert "complete_category" not in engine.apply(state, make_attempt("a0"), reordered)
+    state.badges.remove("complete_category")
+    assert engine.apply(state, make_attempt("a_new"), reordered) == ["complete_category"]
+
+    # 問題が削除されても、残りの問題をすべて解いていれば達成
+    state.badges.remove("complete_category")
+    removed = ProblemCatalog([Problem(id="a0", category="a", question="?", hints=[], follow_up=[], tags=[])])
+    assert "complete_category" in engine.apply(state, make_attempt("a0"), removed)
+
+def test_legacy_bitmaps_are_read_as_problem_ids():
+    engine = AchievementEngine(make_catalog)
+    assert engine._decode_solved({"a": 0b10, "b": ["b0"]}) == {"a": {"a1"}, "b": {"b0"}}
+
+@pytest.fixture
+def engine(temp_db, monkeypatch):
+    engine = AchievementEngine(make_catalog)
+    monkeypatch.setattr(achievements, "_engine", engine)
+    assert temp_db.init_database()
+    temp_db.get_or_create_user("u1")
+    return engine
+
+def test_save_problem_attempt_awards_badges(temp_db, engine):
+    first = make_attempt("a0")
+    assert temp_db.save_problem_attempt(first)
+    assert first["awarded_badges"] == ["first_correct"]
+    for problem_id in ("a1", "b0"):
+        temp_db.save_problem_attempt(make_attempt(problem_id))
+
+    user = temp_db.get_or_create_user("u1")
+    assert user["badges"] == ["first_correct", "complete_category", "streak_3", "all_categories"]
+    with temp_db.get_connection() as conn:
+        row = conn.execute("SELECT streak, correct_total, solved FROM achievement_state WHERE user_id = 'u1'").fetchone()
+    assert row[:2] == (3, 3)
+    assert json.loads(row[2]) == {"a": ["a0", "a1"], "b": ["b0"]}
+
+    # 不正解で連続正解が途切れる
+    assert temp_db.reset_answer_streak("u1")
+    temp_db.run_write(lambda conn: None)
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT streak FROM achievement_state WHERE user_id = 'u1'").fetchone()[0] == 0
+
+def test_backfill_matches_incremental_state(temp_db, engine):
+    attempts = [make_attempt(pid, timestamp=i) for i, pid in enumerate(["a0", "a1", "b0", "b1", "a0"])]
+    for attempt in attempts:
+        temp_db.save_problem_attempt(attempt)
+    with temp_db.get_connection() as conn:
+        incremental = conn.execute("SELECT streak, correct_total, solved FROM achievement_state").fetchall()
+
+    # 状態とバッジを失った状態から履歴を再生する
+    temp_db.run_write(lambda conn: conn.execute("DELETE FROM achievement_state"))
+    temp_db.run_write(lambda conn: conn.execute("UPDATE users SET badges = '[]'"))
+    result = temp_db.backfill_achievements()
+    assert result == {"users": 1, "attempts": 5, "awarded": 5}
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT streak, correct_total, solved FROM achievement_state").fetchall() == incremental
+    assert set(temp_db.get_or_create_user("u1")["badges"]) == {
+        "first_correct", "streak_3", "streak_5", "complete_category", "all_categories"}
+
+def test_backfill_commits_in_user_chunks(temp_db, engine, monkeypatch):
+    for user_id in ("u1", "u2", "u3"):
+        temp_db.get_or_create_user(user_id)
+        for i, problem_id in enumerate(["a0", "a1"]):
+            temp_db.save_problem_attempt(make_attempt(problem_id, user_id=user_id, timestamp=i))
+    monkeypatch.setattr(temp_db, "DB_MAINTENANCE_CHUNK", 2)
+    temp_db.run_write(lambda conn: conn.execute("DELETE FROM achievement_state"))
+
+    commits = temp_db.get_writer_stats()["completed"]
+    assert temp_db.backfill_achievements() == {"users": 3, "attempts": 6, "awarded": 0}
+    assert temp_db.get_writer_stats()["completed"] - commits == 2
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM achievement_state WHERE correct_total = 2").fetchone()[0] == 3
+    assert temp_db.backfill_achievements("u2") == {"users": 1, "attempts": 2, "awarded": 0}
+
+def test_badge_failure_keeps_attempt(temp_db, engine, monkeypatch):
+    def broken(conn, attempt):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(engine, "process", broken)
+    attempt = make_attempt("a0")
+    assert temp_db.save_problem_attempt(attempt)
+    assert attempt["awarded_badges"] == []
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM problem_attempts").fetchone()[0] == 1
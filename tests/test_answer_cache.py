@@ -0,0 +1,58 @@
+import pytest
+
+pytest.importorskip("httpx")
+
+from utils import llm
+from utils.llm import AnswerSimilarityCache
+
+def test_near_duplicate_answer_reuses_feedback():
+    cache = AnswerSimilarityCache()
+    cache.add("num_01", "66.7ポンド", "フィードバックA")
+    assert cache.lookup("num_01", "約66.67ポンド") == "フィードバックA"
+    assert cache.lookup("num_01", "66.7 ポンド") == "フィードバックA"
+    assert cache.lookup("num_01", "６６．７　ポンド") == "フィードバックA"
+    assert cache.lookup("num_01", "76.6ポンド") is None
+    # 別の問題の回答は再利用しない
+    assert cache.lookup("num_02", "66.7ポンド") is None
+
+    stats = cache.stats()
+    assert stats["lookups"] == 5
+    assert stats["llm_calls_saved"] == 3
+    assert stats["hit_rate"] == 0.6
+
+def test_per_problem_and_problem_count_limits():
+    cache = AnswerSimilarityCache(max_problems=2, max_answers=3)
+    for i in range(5):
+        cache.add("p1", f"回答{i}です", f"f{i}")
+    cache.add("p2", "x", "fx")
+    cache.add("p3", "y", "fy")
+
+    stats = cache.stats()
+    assert stats["problems"] == 2
+    assert cache.lookup("p1", "x") is None
+    assert cache._indexes["p3"][0].shape == (1, cache.dims)
+
+def test_generate_problem_feedback_skips_llm_for_similar_answer(monkeypatch):
+    monkeypatch.setattr(llm, "answer_cache", AnswerSimilarityCache())
+    calls = []
+
+    def fake_call(prompt, context=None, use_cache=True, **kwargs):
+        calls.append(prompt)
+        return "よく考えられた答えです"
+
+    monkeypatch.setattr(llm, "call_llm_api", fake_call)
+    problem = {"id": "num_01", "question": "何ポンド？", "correct_answer": 66.67}
+    assert llm.generate_problem_feedback(problem, "66.7ポンド") == "よく考えられた答えです"
+    assert llm.generate_problem_feedback(problem, "約66.67ポンド") == "よく考えられた答えです"
+    assert len(calls) == 1
+
+    # ストリーミング経路も同じキャッシュを使う
+    assert "".join(llm.stream_problem_feedback(problem, "66.7 ポンド")) == "よく考えられた答えです"
+    assert len(calls) == 1
+
+def test_stub_feedback_is_not_cached(monkeypatch):
+    monkeypatch.setattr(llm, "answer_cache", AnswerSimilarityCache())
+    monkeypatch.delenv("LLM_API_KEY", raising=False)
+    problem = {"id": "p", "question": "q"}
+    llm.generate_problem_feedback(problem, "答え")
+    assert llm.answer_cache.stats()["stored"] == 0
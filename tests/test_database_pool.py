@@ -0,0 +1,43 @@
+import sqlite3
+
+from utils.database import ConnectionPool
+
+def test_nested_use_commits_only_at_outermost(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=2)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE t (v INTEGER)")
+
+    with pool.connection() as outer:
+        outer.row_factory = sqlite3.Row
+        outer.execute("INSERT INTO t VALUES (1)")
+        with pool.connection() as inner:
+            assert inner is outer
+            inner.execute("INSERT INTO t VALUES (2)")
+        # 内側の終了ではコミットもrow_factoryのリセットもしない
+        assert outer.in_transaction
+        assert outer.row_factory is sqlite3.Row
+        assert outer.execute("SELECT COUNT(*) AS n FROM t").fetchone()["n"] == 2
+
+    assert outer.row_factory is None
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2
+    pool.close_all()
+
+def test_nested_error_rolls_back_outer_transaction(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=2)
+    with pool.connection() as conn:
+        conn.execute("CREATE TABLE t (v INTEGER)")
+
+    try:
+        with pool.connection() as outer:
+            outer.execute("INSERT INTO t VALUES (1)")
+            with pool.connection() as inner:
+                inner.execute("INSERT INTO t VALUES (2)")
+                raise ValueError("失敗")
+    except ValueError:
+        pass
+
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    assert pool.stats()["reuses"] == 1
+    pool.close_all()
@@ -0,0 +1,94 @@
+import sqlite3
+import threading
+
+import pytest
+
+from utils.database import DatabaseWriter
+
+@pytest.fixture
+def writer(tmp_path):
+    writer = DatabaseWriter(str(tmp_path / "writer.db"))
+    writer.run(lambda conn: conn.execute("CREATE TABLE t (v INTEGER)"))
+    yield writer
+    writer.stop()
+
+def rows(writer):
+    with sqlite3.connect(writer.db_path) as conn:
+        return [v for (v,) in conn.execute("SELECT v FROM t ORDER BY v")]
+
+def hold(writer):
+    """ライタースレッドを止めておくジョブを投入し、再開用のイベントを返す"""
+    started, release = threading.Event(), threading.Event()
+
+    def _job(conn):
+        started.set()
+        release.wait(5)
+
+    future = writer.submit(_job)
+    assert started.wait(5)
+    return release, future
+
+def insert(value, fail=False):
+    def _job(conn):
+        conn.execute("INSERT INTO t VALUES (?)", (value,))
+        if fail:
+            raise ValueError(f"失敗するジョブ: {value}")
+        return value
+    return _job
+
+def test_failed_job_does_not_roll_back_batch_neighbours(writer):
+    release, blocker = hold(writer)
+    # ライタースレッドが止まっている間に投入したジョブは1つのバッチにまとめてコミットされる
+    futures = [writer.submit(insert(1)), writer.submit(insert(2, fail=True)), writer.submit(insert(3))]
+    commits = writer.stats()["commits"]
+    release.set()
+    blocker.result(5)
+
+    assert futures[0].result(5) == 1
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    assert futures[2].result(5) == 3
+    # 失敗したジョブの書き込みだけがセーブポイントまで巻き戻される
+    assert rows(writer) == [1, 3]
+    stats = writer.stats()
+    # 止めていたジョブのコミットと、3件をまとめたバッチのコミット
+    assert stats["commits"] == commits + 2
+    assert (stats["completed"], stats["failed"]) == (4, 1)
+
+def test_run_surfaces_timeout_as_operational_error(writer):
+    release, blocker = hold(writer)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="タイムアウト"):
+            writer.run(insert(1), timeout=0.05)
+    finally:
+        release.set()
+    blocker.result(5)
+    # 呼び出し側は待つのをやめるが、投入済みのジョブは後でコミットされる
+    writer.run(lambda conn: None)
+    assert rows(writer) == [1]
+
+def test_full_queue_rejects_submissions(tmp_path):
+    writer = DatabaseWriter(str(tmp_path / "writer.db"), max_queue=1)
+    release, blocker = hold(writer)
+    try:
+        queued = writer.submit(lambda conn: "queued")
+        with pytest.raises(sqlite3.OperationalError, match="満杯"):
+            writer.submit(lambda conn: "rejected", timeout=0.05)
+        stats = writer.stats()
+        assert (stats["rejected"], stats["queue_depth"], stats["max_queue_depth"]) == (1, 1, 1)
+    finally:
+        release.set()
+    assert queued.result(5) == "queued"
+    writer.stop()
+
+def test_stats_track_commits_and_latency(writer):
+    before = writer.stats()
+    for value in range(3):
+        writer.run(insert(value))
+    stats = writer.stats()
+    assert stats["submitted"] == before["submitted"] + 3
+    assert stats["completed"] == before["completed"] + 3
+    assert stats["commits"] == before["commits"] + 3
+    assert stats["queue_depth"] == 0
+    assert 0 < stats["avg_commit_time"] <= stats["max_commit_time"]
+    assert stats["commit_time"] == pytest.approx(stats["avg_commit_time"] * stats["commits"])
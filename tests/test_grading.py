@@ -0,0 +1,133 @@
+import time
+import uuid
+
+import numpy as np
+
+from models.data_models import Problem
+from utils import grading
+
+def make_problem(answer_type, correct_answer, problem_id="p1", unit=None):
+    return Problem(id=problem_id, category="数で考える力", question="?", hints=[], follow_up=[], tags=[],
+                   answer_type=answer_type, correct_answer=correct_answer, unit=unit)
+
+def test_numeric_batch_uses_tolerance():
+    problem = make_problem("numeric", "66.67")
+    answers = ["66.67", "６６．６７", "66.665", "1,000", "abc", "", "66.7", "66.67"]
+    assert grading.grade_answers(problem, answers).tolist() == [True, True, True, False, False, False, False, True]
+    assert grading.grade_answers(problem, ["66.7"], tolerance=0.05).tolist() == [True]
+
+def test_text_and_choice_answers_are_normalized():
+    text = make_problem("text", "Python")
+    assert grading.grade_answer(text, "  python ")
+    assert not grading.grade_answer(text, "py")
+    choice = make_problem("multi_choice", ["A", "（B）"])
+    assert grading.grade_answers(choice, ["a", "(B)", "c", None]).tolist() == [True, True, False, False]
+
+def test_missing_correct_answer_never_matches():
+    assert not grading.grade_answer(make_problem("numeric", None), "1")
+    assert not grading.grade_answer(make_problem("text", None), "1")
+    assert grading.grade_answers(make_problem("text", "x"), []).shape == (0,)
+
+def insert_attempts(db, problem_id, answers, is_correct):
+    attempts = []
+    for i, answer in enumerate(answers):
+        attempt = {
+            "attempt_id": f"{i:06d}-{uuid.uuid4()}",
+            "user_id": f"u{i % 3}",
+            "problem_id": problem_id,
+            "category": "数で考える力",
+            "timestamp": time.time(),
+            "duration": 10.0,
+            "is_correct": is_correct,
+            "hints_used": 0,
+            "thought_length": 0,
+            "answer_text": answer,
+        }
+        assert db.save_problem_attempt(attempt)
+        attempts.append(attempt)
+    return attempts
+
+def test_regrade_updates_rows_and_rollups(temp_db):
+    assert temp_db.init_database()
+    insert_attempts(temp_db, "p1", ["66.67", "66.7", "67", "66.67", "66.66", "x", "66.7"], True)
+    problem = make_problem("numeric", 66.7)
+
+    progress = list(grading.iter_regrade(problem, batch_size=3))
+    assert [p["scanned"] for p in progress] == [3, 6, 7]
+    assert progress[-1]["changed"] == 5
+
+    with temp_db.get_connection() as conn:
+        correct = conn.execute("SELECT COUNT(*) FROM problem_attempts WHERE is_correct = 1").fetchone()[0]
+        assert correct == 2
+        rollup = conn.execute("SELECT SUM(correct_answers), SUM(correct_duration_sum) FROM user_stats_overall").fetchone()
+    assert rollup == (2, 20.0)
+
+    # 差分更新した統計は全件再集計の結果と一致する
+    temp_db.rebuild_user_stats()
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT SUM(correct_answers), SUM(correct_duration_sum) FROM user_stats_overall").fetchone() == rollup
+
+def test_regrade_can_resume_from_checkpoint(temp_db):
+    assert temp_db.init_database()
+    insert_attempts(temp_db, "p1", ["1", "2", "3", "4", "5"], False)
+    problem = make_problem("numeric", 3)
+
+    stream = grading.iter_regrade(problem, batch_size=2)
+    checkpoint = next(stream)["last_attempt_id"]
+    stream.close()
+
+    result = grading.regrade_problem(problem, batch_size=2, resume_after=checkpoint)
+    assert result["scanned"] == 3
+    assert result["changed"] == 1
+    # 再実行しても変化はない
+    assert grading.regrade_problem(problem)["changed"] == 0
+
+def test_parse_numeric_answer_forms():
+    parse = grading.parse_numeric_answer
+    assert parse("66.7ポンド").value == 66.7 and parse("66.7ポンド").unit == "ポンド"
+    assert parse("1万円").value == 10000
+    assert parse("1万5千円").value == 15000
+    assert parse("三百二十").value == 320
+    assert parse("1億2000万").value == 1.2e8
+    assert parse("¥1,000").value == 1000
+    assert parse("10000÷150").value == 10000 / 150
+    assert parse("約67").approximate
+    assert (parse("66〜67").low, parse("66〜67").high, parse("66〜67").value) == (66, 67, 66.5)
+    assert parse("66から67まで").value == 66.5
+    assert parse("６６．７　ポンドくらい").value == 66.7
+    for invalid in ["abc", "1a2", "3時間30分", "9**9**9", "", None, "1" * 100]:
+        assert parse(invalid) is None
+
+def test_numeric_grading_accepts_units_expressions_and_ranges():
+    problem = make_problem("numeric", "66.67")
+    answers = ["66.67ポンド", "10000÷150", "約67", "67", "66.665〜66.675", "約66.5〜67", "60〜65", "1万円"]
+    assert grading.grade_answers(problem, answers).tolist() == [True, True, True, False, True, True, False, False]
+
+def test_wide_ranges_are_wrong():
+    problem = make_problem("numeric", 66.7)
+    for answer in ["0〜100000000", "1〜1億", "66〜67", "約0〜1000"]:
+        assert not grading.grade_answer(problem, answer), answer
+
+def test_units_must_match_the_problem():
+    problem = make_problem("numeric", 66.7, unit="ポンド")
+    answers = ["66.7", "66.7ポンド", "66.7lb", "66.7kg", "66.7円", "66.7個"]
+    assert grading.grade_answers(problem, answers).tolist() == [True, True, True, False, False, False]
+    # 正解値の表記から単位を読み取り、同じ次元の単位は換算して比較する
+    problem = make_problem("numeric", "1.5kg")
+    answers = ["1.5", "1500g", "1.5キロ", "1.5m", "1500"]
+    assert grading.grade_answers(problem, answers).tolist() == [True, True, True, False, False]
+    assert grading.grade_answer(make_problem("numeric", "1000円"), "¥1,000")
+    assert not grading.grade_answer(make_problem("numeric", "1000円"), "$1000")
+
+def test_per_problem_tolerance():
+    problem = make_problem("numeric", 66.67)
+    assert not grading.grade_answer(problem, "66.7")
+    problem.tolerance = 0.05
+    assert grading.grade_answer(problem, "66.7")
+    assert grading.get_answer_key(problem).tolerance == 0.05
+
+def test_parsed_answers_are_cached():
+    grading._parse_numeric_cached.cache_clear()
+    for _ in range(3):
+        grading.parse_numeric_answer("1万円")
+    assert grading._parse_numeric_cached.cache_info().hits == 2
@@ -0,0 +1,50 @@
+def _messages(n):
+    return [{"role": "user", "text": f"m{i}", "timestamp": float(i)} for i in range(n)]
+
+def _count(database, table, session_id, problem_id):
+    with database.get_connection() as conn:
+        return conn.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE session_id = ? AND problem_id = ?",
+            (session_id, problem_id)
+        ).fetchone()[0]
+
+def test_append_only_inserts_new_messages_once(temp_db):
+    temp_db.init_database()
+    messages = _messages(3)
+    assert temp_db.save_chat_messages("s1", "p1", messages)
+    messages += _messages(5)[3:]
+    assert temp_db.save_chat_messages("s1", "p1", messages)
+    assert _count(temp_db, "chat_history", "s1", "p1") == 5
+
+    # 新しい要素がなければ書き込みスレッドに投げない
+    submitted = temp_db.get_writer_stats()["submitted"]
+    assert temp_db.save_chat_messages("s1", "p1", messages)
+    assert temp_db.get_writer_stats()["submitted"] == submitted
+
+def test_persisted_counts_are_bounded(temp_db, monkeypatch):
+    temp_db.init_database()
+    monkeypatch.setattr(temp_db, "DB_PERSISTED_COUNTS_SIZE", 4)
+    temp_db._persisted_counts.clear()
+    for i in range(10):
+        temp_db.save_thought_logs(f"s{i}", "p1", ["t"])
+    assert len(temp_db._persisted_counts) == 4
+
+    # 別の問題に移ると前の問題の件数は上書きされる
+    temp_db.save_thought_logs("s9", "p2", ["t", "u"])
+    assert temp_db._persisted_counts[("thought_logs", "s9")] == ("p2", 2)
+    assert len(temp_db._persisted_counts) == 4
+
+def test_evicted_session_resumes_from_database(temp_db, monkeypatch):
+    temp_db.init_database()
+    temp_db.save_chat_messages("s1", "p1", _messages(2))
+    temp_db._persisted_counts.clear()
+    assert temp_db.save_chat_messages("s1", "p1", _messages(3))
+    assert _count(temp_db, "chat_history", "s1", "p1") == 3
+
+def test_flush_session_logs_writes_both_tables_in_one_job(temp_db):
+    temp_db.init_database()
+    submitted = temp_db.get_writer_stats()["submitted"]
+    assert temp_db.flush_session_logs("s1", "p1", _messages(4), ["a", "b"])
+    assert temp_db.get_writer_stats()["submitted"] == submitted + 1
+    assert _count(temp_db, "chat_history", "s1", "p1") == 4
+    assert _count(temp_db, "thought_logs", "s1", "p1") == 2
@@ -0,0 +1,166 @@
+import time
+import uuid
+import random
+from datetime import date, timedelta
+
+from utils import leaderboard as leaderboard_module
+from utils.leaderboard import Leaderboard, RankingBoard, ScoreIndex, week_of
+
+def brute_rank(scores, user_id):
+    return sum(1 for score in scores.values() if score > scores[user_id]) + 1
+
+def brute_top(scores, k):
+    return [user_id for _, user_id in sorted((-score, user_id) for user_id, score in scores.items())[:k]]
+
+def test_score_index_counts_above():
+    index = ScoreIndex(size=4)
+    index.load([0, 3, 3, 7])
+    assert [index.count_above(s) for s in (0, 3, 6, 7)] == [3, 1, 1, 0]
+    index.add(5000, 1)
+    index.add(3, -1)
+    assert index.count_above(0) == 3
+    assert index.count_above(3) == 2
+    assert index.count_above(10000) == 0
+    assert [index.kth_highest(k) for k in range(0, 6)] == [None, 5000, 7, 3, 0, None]
+
+def test_board_matches_brute_force():
+    rng = random.Random(0)
+    board = RankingBoard(k=5)
+    scores = {f"u{i}": rng.randint(0, 50) for i in range(40)}
+    board.load(list(scores), list(scores.values()))
+    for _ in range(500):
+        user_id = f"u{rng.randint(0, 49)}"
+        delta = rng.randint(-20, 30)
+        scores[user_id] = max(scores.get(user_id, 0) + delta, 0)
+        board.set(user_id, scores[user_id])
+        probe = rng.choice(list(scores))
+        assert board.rank(probe) == brute_rank(scores, probe)
+        top = board.top()
+        assert [entry["user_id"] for entry in top] == brute_top(scores, 5)
+        assert [entry["rank"] for entry in top] == [brute_rank(scores, entry["user_id"]) for entry in top]
+    assert board.rank("nobody") is None
+
+def test_refresh_top_does_not_scan_all_users(monkeypatch):
+    board = RankingBoard(k=3)
+    board.load([f"u{i}" for i in range(1000)], [i % 50 for i in range(1000)])
+    assert [e["user_id"] for e in board.top()] == ["u149", "u199", "u249"]
+
+    # 上位のスコアが下がったときの選び直しは、上位のスコアの同点ユーザーだけを見る
+    monkeypatch.setattr(board, "scores", CountingDict(board.scores))
+    board.set("u199", 0)
+    board.set("u249", 0)
+    assert [(e["rank"], e["user_id"], e["score"]) for e in board.top()] == [
+        (1, "u149", 49), (1, "u299", 49), (1, "u349", 49)]
+    assert board.scores.reads < 100
+
+class CountingDict(dict):
+    reads = 0
+
+    def __getitem__(self, key):
+        CountingDict.reads += 1
+        return super().__getitem__(key)
+
+    def items(self):
+        raise AssertionError("全ユーザーを走査しました")
+
+def test_week_boards_keep_recent_weeks():
+    leaderboard = Leaderboard(k=3, weeks=2, snapshot_interval=0)
+    monday = date(2026, 1, 5)
+    for offset in range(4):
+        ts = time.mktime((monday + timedelta(weeks=offset, days=2)).timetuple())
+        leaderboard.record("u1", 10, "a", ts)
+    weeks = [name for name in leaderboard.boards() if name.startswith("week:")]
+    assert weeks == ["week:2026-01-19", "week:2026-01-26"]
+    assert leaderboard.top("overall") == [{"rank": 1, "user_id": "u1", "score": 40}]
+    assert leaderboard.top("category:a")[0]["score"] == 40
+    assert leaderboard.top("week:2026-01-05") == []
+    assert week_of(time.mktime(date(2026, 1, 11).timetuple())) == "2026-01-05"
+
+def make_attempt(user_id, category, xp_reward, timestamp=None):
+    return {
+        "attempt_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "problem_id": f"{category}1",
+        "category": category,
+        "timestamp": timestamp or time.time(),
+        "duration": 120.0,
+        "is_correct": True,
+        "hints_used": 1,
+        "thought_length": 10,
+        "answer_text": "x",
+        "xp_reward": xp_reward,
+    }
+
+def test_database_updates_and_reload_agree(temp_db, monkeypatch):
+    monkeypatch.setattr(leaderboard_module, "_leaderboard", Leaderboard(k=10, snapshot_interval=0))
+    assert temp_db.init_database()
+    for user_id in ("a", "b", "c"):
+        temp_db.get_or_create_user(user_id, f"name-{user_id}")
+    assert temp_db.save_problem_attempt(make_attempt("a", "数で考える力", 30))
+    assert temp_db.save_problem_attempt(make_attempt("b", "数で考える力", 50))
+    assert temp_db.save_problem_attempt(make_attempt("b", "分析力", 5))
+    temp_db.record_xp("c", 40, "bonus")
+    temp_db.record_xp("missing", 99, "bonus")
+
+    live = leaderboard_module.get_leaderboard()
+    assert [(e["user_id"], e["score"]) for e in live.top()] == [("b", 55), ("c", 40), ("a", 30)]
+    assert live.rank("a", "category:数で考える力") == 2
+    assert live.rank("c", "category:数で考える力") is None
+    this_week = f"week:{week_of(time.time())}"
+    assert live.rank("c", this_week) == 2
+
+    reloaded = Leaderboard(k=10, snapshot_interval=0)
+    with temp_db.get_connection() as conn:
+        reloaded.load(conn)
+    for board in live.boards():
+        assert reloaded.top(board) == live.top(board)
+
+    # 別プロセスのランキングは台帳を追いかけて同じ順位になる
+    temp_db.record_xp("a", 100, "bonus", category="分析力")
+    with temp_db.get_connection() as conn:
+        assert reloaded.sync(conn) == 1
+    for board in live.boards():
+        assert reloaded.top(board) == live.top(board)
+    assert live.rank("a") == reloaded.rank("a") == 1
+
+    view = temp_db.get_leaderboard_view("c")
+    assert view["rank"] == 3
+    assert [(e["rank"], e["username"]) for e in view["top"]] == [(1, "name-a"), (2, "name-b"), (3, "name-c")]
+
+def test_snapshot_and_category_compaction(temp_db, monkeypatch):
+    monkeypatch.setattr(leaderboard_module, "_leaderboard", Leaderboard(k=2, snapshot_interval=0))
+    assert temp_db.init_database()
+    for user_id in ("a", "b", "c"):
+        temp_db.get_or_create_user(user_id)
+        temp_db.save_problem_attempt(make_attempt(user_id, "分析力", 10, timestamp=time.time() - 100))
+    temp_db.save_problem_attempt(make_attempt("a", "分析力", 10, timestamp=time.time() - 100))
+
+    live = leaderboard_module.get_leaderboard()
+    rows = temp_db.snapshot_leaderboard()
+
+    def saved():
+        with temp_db.get_connection() as conn:
+            return conn.execute(
+                "SELECT board, position, rank, user_id, score FROM leaderboard_snapshots ORDER BY board, position"
+            ).fetchall()
+
+    first = saved()
+    assert rows == len(first) >= 4
+    assert [row[1:] for row in first if row[0] == "overall"] == [(1, 1, "a", 20), (2, 2, "b", 10)]
+    for board in live.boards():
+        assert [(e["rank"], e["user_id"], e["score"]) for e in live.top(board)] == \
+            [row[2:] for row in first if row[0] == board]
+
+    # スナップショットはデータベースから集計するため、古いメモリ上のランキングを持つプロセスが保存しても同じ内容になる
+    monkeypatch.setattr(leaderboard_module, "_leaderboard", Leaderboard(k=2, snapshot_interval=0))
+    assert temp_db.snapshot_leaderboard() == rows
+    assert saved() == first
+
+    # 集約された行は取り込み済みのイベントをまとめたものなので、追いかけても二重に加算しない
+    assert temp_db.compact_xp_events(older_than=10) > 0
+    with temp_db.get_connection() as conn:
+        assert live.sync(conn) == 0
+        reloaded = Leaderboard(k=2, snapshot_interval=0)
+        reloaded.load(conn)
+    assert reloaded.top("category:分析力") == live.top("category:分析力")
+    assert live.top() == reloaded.top()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from utils import helpers
+from utils.helpers import LevelCurve, USER_LEVELS, get_level_curve
+
+# 従来の実装（ソートして線形に探す）
+def reference_level(xp_points):
+    for level, info in sorted(USER_LEVELS.items(), key=lambda x: x[0], reverse=True):
+        if xp_points >= info["req"]:
+            return level
+    return 0
+
+def test_single_lookup_matches_reference():
+    for xp in [-10, 0, 99, 100, 101, 299, 300, 999, 1000, 2499, 2500, 10 ** 7]:
+        assert get_level_curve().level(xp) == reference_level(xp)
+
+def test_batch_matches_single_lookup():
+    curve = LevelCurve(USER_LEVELS)
+    xp = np.random.default_rng(0).integers(-50, 4000, size=2000)
+    assert curve.levels_for(xp).tolist() == [curve.level(x) for x in xp]
+    assert np.allclose(curve.progress_for(xp), [curve.progress(x) for x in xp])
+
+def test_progress_and_level_info():
+    curve = LevelCurve(USER_LEVELS)
+    assert curve.progress(200) == 0.5
+    assert curve.progress(200, level=0) == 1.0
+    assert curve.progress(3000) == 1.0
+    assert curve.info(3)["name"] == "分析者"
+    assert curve.info(99) == curve.info(0)
+    assert curve.next_info(6) is None
+    assert curve.next_info(0)["req"] == 100
+
+def test_extended_curve_adds_levels():
+    curve = LevelCurve(USER_LEVELS).extended(9, growth=2)
+    assert len(curve) == 10
+    assert curve.thresholds[-3:] == (4500, 8500, 16500)
+    assert curve.level(10 ** 6) == 9
+    assert curve.info(8)["name"] == "賢者3"
+    assert LevelCurve(USER_LEVELS).extended(3).levels == tuple(range(7))
+
+def test_rejects_invalid_levels():
+    with pytest.raises(ValueError):
+        LevelCurve({})
+    with pytest.raises(ValueError):
+        LevelCurve({0: {"req": 0}, 1: {"req": 200}, 2: {"req": 100}})
+
+def test_shared_curve_uses_max_level_setting(monkeypatch):
+    monkeypatch.setattr(helpers, "_level_curve", None)
+    monkeypatch.setattr(helpers, "LEVEL_CURVE_MAX_LEVEL", 12)
+    assert helpers.get_level_curve().levels[-1] == 12
+    monkeypatch.setattr(helpers, "_level_curve", None)
@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from utils.llm import AsyncLLMClient, RequestBatcher
+
+HEADERS = {"Content-Type": "application/json"}
+
+@pytest.fixture
+def client():
+    client = AsyncLLMClient(max_concurrency=8, max_connections=8, timeout=5)
+    yield client
+    client.close()
+
+def test_concurrent_calls_share_one_batch(llm_server, client):
+    batcher = RequestBatcher(client, window=0.2, max_batch=64)
+    with ThreadPoolExecutor(max_workers=40) as pool:
+        results = list(pool.map(
+            lambda i: batcher.call(f"{llm_server.url}/batch", HEADERS, {"prompt": f"p{i}"}, 5),
+            range(40)
+        ))
+
+    assert results == [f"b:p{i}" for i in range(40)]
+    assert batcher.stats()["batches"] < 40
+    assert all(path == "/batch" for path, _ in llm_server.requests)
+
+def test_batch_is_sent_when_full(llm_server, client):
+    batcher = RequestBatcher(client, window=10, max_batch=4)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(
+            lambda i: batcher.call(f"{llm_server.url}/batch", HEADERS, {"prompt": f"p{i}"}, 5),
+            range(4)
+        ))
+
+    assert results == [f"b:p{i}" for i in range(4)]
+    assert batcher.stats()["max_batch_size"] == 4
+
+def test_failed_batch_falls_back_to_single_requests(llm_server, client):
+    llm_server.fail_batch = True
+    batcher = RequestBatcher(client, window=0.1, max_batch=64)
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        results = list(pool.map(
+            lambda i: batcher.call(f"{llm_server.url}/batch", HEADERS, {"prompt": f"p{i}"}, 5,
+                                   fallback_url=f"{llm_server.url}/single"),
+            range(5)
+        ))
+
+    assert results == [f"s:p{i}" for i in range(5)]
+    stats = batcher.stats()
+    assert stats["failures"] >= 1
+    assert stats["fallbacks"] == 5
+
+def test_failed_batch_without_fallback_raises(llm_server, client):
+    llm_server.fail_batch = True
+    batcher = RequestBatcher(client, window=0.01, max_batch=64)
+    with pytest.raises(RuntimeError):
+        batcher.call(f"{llm_server.url}/batch", HEADERS, {"prompt": "p"}, 5)
@@ -0,0 +1,95 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from utils.llm import AsyncLLMClient
+
+HEADERS = {"Content-Type": "application/json"}
+
+@pytest.fixture
+def make_client():
+    clients = []
+
+    def _make(**kwargs):
+        client = AsyncLLMClient(**kwargs)
+        clients.append(client)
+        return client
+
+    yield _make
+    for client in clients:
+        client.close()
+
+def test_post_sync_returns_response(llm_server, make_client):
+    client = make_client(timeout=5)
+    response = client.post_sync(f"{llm_server.url}/single", HEADERS, {"prompt": "p"})
+    assert response.status_code == 200
+    assert response.json() == {"text": "s:p"}
+
+def test_semaphore_limits_in_flight_requests(llm_server, make_client):
+    llm_server.delay = 0.1
+    client = make_client(max_concurrency=2, max_connections=8, timeout=5)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(
+            lambda i: client.post_sync(f"{llm_server.url}/single", HEADERS, {"prompt": f"p{i}"}),
+            range(8)
+        ))
+
+    assert [r.json()["text"] for r in responses] == [f"s:p{i}" for i in range(8)]
+    assert llm_server.max_in_flight == 2
+    assert client.stats()["max_in_flight"] == 2
+
+def test_deadline_includes_semaphore_wait(llm_server, make_client):
+    llm_server.delay = 0.3
+    client = make_client(max_concurrency=1, timeout=5)
+    first = threading.Thread(target=client.post_sync, args=(f"{llm_server.url}/single", HEADERS, {"prompt": "a"}))
+    first.start()
+    time.sleep(0.05)
+
+    # 単独なら0.3秒で終わるが、先行リクエストの待ちを含めると期限を超える
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        client.post_sync(f"{llm_server.url}/single", HEADERS, {"prompt": "b"}, timeout=0.45)
+    assert time.monotonic() - started < 0.6
+    first.join()
+    assert client.stats()["timeouts"] == 1
+
+def test_keep_alive_reuses_connection(llm_server, make_client):
+    client = make_client(timeout=5)
+    for i in range(5):
+        client.post_sync(f"{llm_server.url}/single", HEADERS, {"prompt": f"p{i}"})
+
+    ports = {port for _, port in llm_server.requests}
+    assert len(llm_server.requests) == 5
+    assert len(ports) == 1
+
+def test_stream_sync_yields_chunks(llm_server, make_client):
+    client = make_client(timeout=5)
+    assert list(client.stream_sync(f"{llm_server.url}/stream", HEADERS, {"prompt": "p"})) == ["c0", "c1", "c2"]
+    assert client.stats()["in_flight"] == 0
+
+def test_stream_sync_cancels_request_when_reader_leaves(llm_server, make_client):
+    llm_server.stream_chunks = 100
+    llm_server.stream_delay = 0.02
+    client = make_client(timeout=5)
+    chunks = client.stream_sync(f"{llm_server.url}/stream", HEADERS, {"prompt": "p"})
+    assert next(chunks) == "c0"
+    chunks.close()
+
+    # 読み手が離れるとリクエストが打ち切られ、サーバー側の送信が失敗する
+    assert llm_server.stream_aborted.wait(3)
+    deadline = time.monotonic() + 3
+    while client.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.stats()["in_flight"] == 0
+
+def test_stream_sync_deadline(llm_server, make_client):
+    llm_server.stream_chunks = 10
+    llm_server.stream_delay = 0.2
+    client = make_client(timeout=5)
+    with pytest.raises(TimeoutError):
+        list(client.stream_sync(f"{llm_server.url}/stream", HEADERS, {"prompt": "p"}, timeout=0.3))
+    assert client.stats()["timeouts"] == 1
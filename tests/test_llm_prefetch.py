@@ -0,0 +1,37 @@
+import time
+import threading
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from utils.llm import LLMPrefetcher, get_prefetch_stats
+
+def test_take_returns_prefetched_result():
+    prefetcher = LLMPrefetcher()
+    prefetcher.prefetch("k", lambda x: x * 2, 21)
+    assert prefetcher.take("k", lambda x: -1, 21) == 42
+
+def test_take_without_prefetch_runs_function():
+    prefetcher = LLMPrefetcher()
+    assert prefetcher.take("k", lambda x: x + 1, 1) == 2
+
+def test_slow_prefetch_returns_default_without_calling_again():
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        release.wait(5)
+        return "遅い"
+
+    prefetcher = LLMPrefetcher()
+    prefetcher.prefetch("k", slow)
+    timeouts = get_prefetch_stats()["timeouts"]
+
+    started = time.monotonic()
+    result = prefetcher.take("k", lambda: calls.append(1), timeout=0.1, default="スタブ")
+    assert result == "スタブ"
+    assert time.monotonic() - started < 1
+    assert calls == []
+    assert get_prefetch_stats()["timeouts"] == timeouts + 1
+    release.set()
@@ -0,0 +1,117 @@
+import time
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from utils import llm
+from utils.llm import (
+    CircuitBreaker, CircuitOpenError, LLMResilience, LLMStatusError, RetryBudget, STUB_RESPONSES
+)
+
+def _failing(error):
+    def _attempt(remaining):
+        raise error
+    return _attempt
+
+def test_breaker_opens_and_fails_fast():
+    resilience = LLMResilience(max_retries=0, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+    for _ in range(3):
+        with pytest.raises(TimeoutError):
+            resilience.call(_failing(TimeoutError("遅い")), 1)
+
+    assert resilience.breaker.state == CircuitBreaker.OPEN
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        resilience.call(lambda remaining: calls.append(1), 1)
+    assert calls == []
+    assert resilience.stats()["short_circuited"] == 1
+
+def test_half_open_probe_closes_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    # 半開の間は試行を1件だけ許可する
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_retries_with_backoff_until_success():
+    attempts = []
+
+    def _attempt(remaining):
+        attempts.append(remaining)
+        if len(attempts) < 3:
+            raise LLMStatusError(503)
+        return "ok"
+
+    resilience = LLMResilience(max_retries=2, backoff=0.01)
+    assert resilience.call(_attempt, 5) == "ok"
+    assert len(attempts) == 3
+    assert attempts[-1] < attempts[0]
+    assert resilience.stats()["retries"] == 2
+
+def test_client_errors_are_not_retried_or_counted():
+    resilience = LLMResilience(max_retries=2, backoff=0.01, breaker=CircuitBreaker(failure_threshold=1))
+    with pytest.raises(LLMStatusError):
+        resilience.call(_failing(LLMStatusError(400)), 1)
+    assert resilience.stats()["retries"] == 0
+    assert resilience.breaker.state == CircuitBreaker.CLOSED
+
+def test_retry_budget_limits_retries():
+    resilience = LLMResilience(max_retries=5, backoff=0.001, budget=RetryBudget(ratio=0, capacity=2))
+    with pytest.raises(TimeoutError):
+        resilience.call(_failing(TimeoutError("遅い")), 5)
+    stats = resilience.stats()
+    assert stats["retries"] == 2
+    assert stats["budget_exhausted"] == 1
+
+def test_metrics_hook_receives_state_changes():
+    events = []
+    resilience = LLMResilience(max_retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60))
+    resilience.metrics_hook = lambda event, data: events.append((event, data))
+    with pytest.raises(TimeoutError):
+        resilience.call(_failing(TimeoutError("遅い")), 1)
+
+    assert ("breaker", {"previous": "closed", "state": "open"}) in events
+    assert any(event == "call" and data["outcome"] == "failures" for event, data in events)
+
+def test_hedge_delay_uses_recent_p95():
+    resilience = LLMResilience(hedge=True)
+    assert resilience.hedge_delay() is None
+    for i in range(100):
+        resilience.call(lambda remaining: "ok", 1)
+        resilience._latencies[-1] = i / 100
+    assert resilience.hedge_delay() == pytest.approx(0.95)
+
+def test_hedged_request_wins_over_slow_first(llm_server):
+    llm_server.delays = [1.0, 0.0]
+    client = llm.AsyncLLMClient(timeout=5)
+    try:
+        started = time.monotonic()
+        response = client.post_hedged_sync(f"{llm_server.url}/single", {}, {"prompt": "p"}, 5, hedge_after=0.1)
+        assert response.json() == {"text": "s:p"}
+        assert time.monotonic() - started < 0.8
+        stats = client.stats()
+        assert stats["hedged"] == 1
+        assert stats["hedge_wins"] == 1
+    finally:
+        client.close()
+
+def test_call_llm_api_falls_back_to_canned_response_when_open(llm_server, monkeypatch):
+    monkeypatch.setenv("LLM_API_KEY", "test")
+    monkeypatch.setenv("LLM_API_ENDPOINT", f"{llm_server.url}/single")
+    monkeypatch.delenv("LLM_BATCH_ENDPOINT", raising=False)
+    monkeypatch.setattr(llm, "resilience", LLMResilience(
+        max_retries=1, backoff=0.01, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    ))
+    llm_server.statuses = [500, 500]
+
+    assert llm.call_llm_api("問題のヒント", use_cache=False) == STUB_RESPONSES["default"]
+    assert llm.resilience.breaker.state == CircuitBreaker.OPEN
+    requests = len(llm_server.requests)
+    # 開いている間はAPIを呼ばずにプロンプトに合ったスタブを返す
+    assert llm.call_llm_api("問題のヒント", use_cache=False) == STUB_RESPONSES["hint"]
+    assert len(llm_server.requests) == requests
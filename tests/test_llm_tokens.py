@@ -0,0 +1,88 @@
+import time
+import threading
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from utils import llm
+from utils.llm import TokenBudget, compact_text, estimate_tokens, truncate_to_tokens
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("ポンド") == 3
+    assert estimate_tokens("abcdefgh") == 2
+
+def test_truncate_keeps_head_and_tail_within_limit():
+    text = "あ" * 500 + "い" * 500
+    truncated = truncate_to_tokens(text, 100)
+    assert estimate_tokens(truncated) <= 100
+    assert truncated.startswith("あ") and truncated.endswith("い")
+    assert truncate_to_tokens("短い", 100) == "短い"
+
+def test_compact_text_removes_repeated_sentences():
+    seen = set()
+    assert compact_text("1ポンド=150円。", 100, seen) == "1ポンド=150円。"
+    assert compact_text("1ポンド=150円。  答えは66.7ポンド。答えは66.7ポンド。", 100, seen) == "答えは66.7ポンド。"
+
+def test_compact_text_keeps_line_breaks():
+    text = "1行目。\n2行目。\n\n表：\n  A  B\n最後の文。"
+    assert compact_text(text, 100) == "1行目。\n2行目。\n\n表：\nA B\n最後の文。"
+    # 除いた文の前後の改行は1つにまとめる
+    assert compact_text("同じ文。\n同じ文。\n別の文。 続き。", 100) == "同じ文。\n別の文。 続き。"
+
+def test_feedback_prompt_is_bounded_for_huge_answers():
+    problem = {"id": "p", "question": "何ポンド？", "context": "1ポンド=150円。", "correct_answer": 66.67}
+    prompt, _ = llm._feedback_request(problem, "とても長い回答です" * 2000)
+    assert estimate_tokens(prompt) < llm.LLM_QUESTION_MAX_TOKENS + llm.LLM_ANSWER_MAX_TOKENS + 200
+
+def test_budget_waits_instead_of_failing():
+    budget = TokenBudget(per_minute=1000, per_user_minute=100, window=0.2)
+    assert budget.acquire("u1", 80, timeout=1)
+    started = time.monotonic()
+    # 同じユーザーは枠が空くまで待たされる
+    assert budget.acquire("u1", 80, timeout=1)
+    assert time.monotonic() - started >= 0.15
+    # 別のユーザーは待たない
+    started = time.monotonic()
+    assert budget.acquire("u2", 80, timeout=1)
+    assert time.monotonic() - started < 0.1
+    assert budget.stats()["waited"] == 1
+
+def test_budget_gives_up_after_timeout():
+    budget = TokenBudget(per_minute=100, per_user_minute=100, window=10)
+    assert budget.acquire(None, 90)
+    assert not budget.acquire(None, 90, timeout=0.05)
+    assert budget.stats()["gave_up"] == 1
+
+def test_idle_users_are_swept_from_usage():
+    budget = TokenBudget(per_minute=1000, per_user_minute=100, window=0.1)
+    for user_id in ("u1", "u2", "u3"):
+        assert budget.acquire(user_id, 10)
+    assert budget.stats()["active_users"] == 3
+    time.sleep(0.15)
+    # 他のユーザーの呼び出しで、呼び出しのないユーザーの記録も掃除される
+    assert budget.acquire("u4", 10)
+    assert set(budget._usage) == {None, "u4"}
+    assert budget.stats()["active_users"] == 1
+    time.sleep(0.15)
+    assert budget.stats()["active_users"] == 0
+    assert budget._usage == {} and budget._totals == {}
+
+def test_oversized_request_passes_when_window_is_empty():
+    budget = TokenBudget(per_minute=10, per_user_minute=10, window=10)
+    assert budget.acquire("u", 50, timeout=0)
+
+def test_call_llm_api_counts_tokens_per_function(llm_server, monkeypatch):
+    monkeypatch.setenv("LLM_API_KEY", "test")
+    monkeypatch.setenv("LLM_API_ENDPOINT", f"{llm_server.url}/single")
+    monkeypatch.delenv("LLM_BATCH_ENDPOINT", raising=False)
+    monkeypatch.setattr(llm, "token_budget", TokenBudget())
+    monkeypatch.setattr(llm, "resilience", llm.LLMResilience())
+
+    problem = {"id": "p", "question": "問題文", "category": "数"}
+    llm.generate_hint(problem, 0, "u1")
+    counters = llm.get_token_stats()["functions"]["generate_hint"]
+    assert counters["calls"] == 1
+    assert counters["tokens_in"] > 0
+    assert counters["tokens_out"] > 0
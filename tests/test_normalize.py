@@ -0,0 +1,27 @@
+from utils import helpers
+from utils.helpers import check_choice_match, check_text_match, normalize_choices, normalize_text
+
+def test_nfkc_width_folding():
+    assert normalize_text("６６．７　ポンド") == "66.7 ポンド"
+    assert normalize_text("ﾎﾟﾝﾄﾞ") == "ポンド"
+    assert normalize_text("ＡＢＣ（ｘ）") == "abc(x)"
+    assert normalize_text("−5") == "-5"
+    assert normalize_text("  a\n\tb  ") == "a b"
+    assert normalize_text("") == ""
+    assert normalize_text(None) == ""
+
+def test_long_text_bypasses_cache():
+    helpers._normalize_cached.cache_clear()
+    text = "Ａ" * (helpers.NORMALIZE_CACHE_MAX_LENGTH + 1)
+    assert normalize_text(text) == "a" * len(text)
+    assert helpers._normalize_cached.cache_info().currsize == 0
+    normalize_text("Ａ")
+    normalize_text("Ａ")
+    assert helpers._normalize_cached.cache_info().hits == 1
+
+def test_matchers_use_cached_choices():
+    normalize_choices.cache_clear()
+    for _ in range(3):
+        assert check_choice_match("ｂ", ["A", "B"])
+    assert normalize_choices.cache_info().misses == 1
+    assert check_text_match("ﾎﾟﾝﾄﾞ", "ポンド", fuzzy=False)
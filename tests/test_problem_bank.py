@@ -0,0 +1,177 @@
+import gc
+import os
+import json
+import threading
+
+from utils import problem_bank
+from utils.problem_bank import CompiledProblemCatalog, ProblemCatalog, compile_problem_bank
+
+def _problem(problem_id, category="数", difficulty=1, **extra):
+    item = {
+        "id": problem_id,
+        "category": category,
+        "question": f"{problem_id}の問題",
+        "hints": [],
+        "follow_up": [],
+        "tags": ["t"],
+        "difficulty": difficulty,
+    }
+    item.update(extra)
+    return item
+
+def _write(path, items):
+    path.write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
+
+def test_compiled_catalog_matches_json(tmp_path):
+    json_path, bin_path = tmp_path / "p.json", tmp_path / "p.bin"
+    _write(json_path, [_problem("a"), _problem("b", "言葉", 3), _problem("c")])
+    assert compile_problem_bank(str(json_path), str(bin_path)) == 3
+
+    compiled = CompiledProblemCatalog(str(bin_path))
+    plain = ProblemCatalog.from_json(str(json_path))
+    assert [p.to_dict() for p in compiled] == [p.to_dict() for p in plain]
+    assert compiled.index_of("c") == 1
+    compiled.close()
+    assert compiled.closed
+
+def test_non_integer_difficulty_is_coerced_or_skipped(tmp_path):
+    json_path, bin_path = tmp_path / "p.json", tmp_path / "p.bin"
+    _write(json_path, [_problem("a", difficulty="2"), _problem("b", difficulty="難しい"), _problem("c", difficulty=2 ** 40)])
+    assert compile_problem_bank(str(json_path), str(bin_path)) == 1
+
+    catalog = CompiledProblemCatalog(str(bin_path))
+    assert catalog.get("a").difficulty == 2
+    assert [p.id for p in catalog.by_difficulty(2)] == ["a"]
+    catalog.close()
+
+def test_replaced_catalog_is_closed_when_released(tmp_path, monkeypatch):
+    json_path, bin_path = tmp_path / "p.json", tmp_path / "p.bin"
+    _write(json_path, [_problem("a")])
+    compile_problem_bank(str(json_path), str(bin_path))
+    monkeypatch.setattr(problem_bank, "_catalog", None)
+
+    old = CompiledProblemCatalog(str(bin_path), version=1)
+    problem_bank._set_catalog(old)
+    assert old.get("a") is not None
+    finalizer = old._finalizer
+
+    problem_bank._set_catalog(CompiledProblemCatalog(str(bin_path), version=2))
+    # セッションが保持している間は閉じない
+    assert finalizer.alive
+    gc.disable()
+    try:
+        del old
+        # 循環参照がないため、参照がなくなった時点で閉じる
+        assert not finalizer.alive
+    finally:
+        gc.enable()
+    problem_bank._catalog.close()
+
+def _watched(tmp_path, monkeypatch, items):
+    """tmp_path の problems.json を監視するウォッチャーと、その時点のカタログを用意する"""
+    json_path = tmp_path / "problems.json"
+    _write(json_path, items)
+    monkeypatch.setattr(problem_bank, "_catalog", None)
+    monkeypatch.setattr(problem_bank, "_catalog_version", 0)
+    problem_bank._set_catalog(problem_bank.load_catalog(str(json_path), str(tmp_path / "problems.bin"),
+                                                        problem_bank._next_version()))
+    watcher = problem_bank.ProblemBankWatcher(str(json_path), str(tmp_path / "problems.bin"), interval=0)
+    return json_path, watcher
+
+def _rewrite(path, items, bump=1):
+    # 同じ時刻の書き換えでも変更として検出されるよう更新日時を進める
+    stat = path.stat()
+    _write(path, items)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + bump * 1_000_000_000))
+
+def test_check_now_reloads_only_on_change(tmp_path, monkeypatch):
+    json_path, watcher = _watched(tmp_path, monkeypatch, [_problem("a"), _problem("b")])
+    assert watcher.check_now() is False
+    assert watcher.reloads == 0
+
+    _rewrite(json_path, [_problem("a"), _problem("b"), _problem("c", "言葉")])
+    assert watcher.check_now() is True
+    assert watcher.check_now() is False
+    catalog = problem_bank.get_catalog()
+    assert (watcher.reloads, catalog.version, len(catalog)) == (1, 2, 3)
+    assert catalog.categories() == ["数", "言葉"]
+
+def test_swap_keeps_catalogs_held_by_sessions(tmp_path, monkeypatch):
+    json_path, watcher = _watched(tmp_path, monkeypatch, [_problem("a"), _problem("b")])
+    held = problem_bank.get_catalog()
+
+    _rewrite(json_path, [_problem("b")])
+    assert watcher.check_now() is True
+    current = problem_bank.get_catalog()
+    assert current is not held and current.version > held.version
+    # 取得済みのカタログは差し替え後も元の内容のまま使える
+    assert [p.id for p in held] == ["a", "b"]
+    assert held.get("a").question == "aの問題"
+    assert [p.id for p in current] == ["b"]
+
+    # 古いバージョンのカタログで新しいカタログを上書きしない
+    problem_bank._set_catalog(ProblemCatalog.from_dicts([_problem("x")], version=held.version))
+    assert problem_bank.get_catalog() is current
+
+def test_concurrent_readers_see_whole_catalogs(tmp_path, monkeypatch):
+    small = [_problem("a"), _problem("b")]
+    large = small + [_problem(f"n{i}") for i in range(50)]
+    json_path, watcher = _watched(tmp_path, monkeypatch, small)
+    seen, stop = set(), threading.Event()
+
+    def read():
+        while not stop.is_set():
+            catalog = problem_bank.get_catalog()
+            seen.add((len(catalog), len(catalog.by_category("数"))))
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for i in range(10):
+        _rewrite(json_path, large if i % 2 == 0 else small, bump=i + 1)
+        assert watcher.check_now() is True
+    stop.set()
+    for reader in readers:
+        reader.join()
+    assert seen <= {(2, 2), (52, 52)}
+
+def test_invalid_update_keeps_previous_catalog(tmp_path, monkeypatch):
+    json_path, watcher = _watched(tmp_path, monkeypatch, [_problem("a"), _problem("b")])
+    before = problem_bank.get_catalog()
+
+    broken = _problem("c")
+    del broken["question"]
+    # 通常の読み込みでは不正な問題をスキップするが、監視による再読み込みは厳格に検証して全体を取り込まない
+    _rewrite(json_path, [_problem("a"), _problem("b"), broken])
+    assert watcher.check_now() is False
+    assert watcher.failures == 1
+    assert problem_bank.get_catalog() is before
+
+    stat = json_path.stat()
+    json_path.write_text("[{壊れたJSON", encoding="utf-8")
+    os.utime(json_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2_000_000_000))
+    assert watcher.check_now() is False
+    assert watcher.failures == 2
+    assert problem_bank.get_catalog() is before
+
+def test_failed_signature_is_not_retried_until_file_changes(tmp_path, monkeypatch):
+    json_path, watcher = _watched(tmp_path, monkeypatch, [_problem("a")])
+    _rewrite(json_path, {"not": "a list"})
+    calls = []
+    original = problem_bank.load_catalog
+
+    def counting_load(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(problem_bank, "load_catalog", counting_load)
+    assert watcher.check_now() is False
+    # 失敗したファイルの (更新日時, サイズ) を覚えておき、同じ内容を読み直し続けない
+    assert watcher.check_now() is False
+    assert (watcher.failures, len(calls)) == (1, 1)
+
+    _rewrite(json_path, [_problem("a"), _problem("b")], bump=2)
+    assert watcher.check_now() is True
+    assert len(calls) == 2
+    assert watcher._signature == watcher._current_signature()
+    assert len(problem_bank.get_catalog()) == 2
@@ -0,0 +1,25 @@
+import sqlite3
+
+def test_hot_queries_use_indexes(temp_db):
+    assert temp_db.init_database()
+    conn = sqlite3.connect(temp_db.DB_PATH)
+    try:
+        assert temp_db.find_full_scans(conn) == []
+        assert temp_db.get_schema_version(conn) == temp_db.MIGRATIONS[-1][0]
+    finally:
+        conn.close()
+
+def test_migrations_are_idempotent(temp_db):
+    assert temp_db.init_database()
+    version = temp_db.apply_migrations()
+    assert temp_db.apply_migrations() == version
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == len(temp_db.MIGRATIONS)
+
+def test_init_runs_once_per_process(temp_db):
+    assert temp_db.init_database()
+    submitted = temp_db.get_writer_stats()["submitted"]
+    for _ in range(3):
+        assert temp_db.init_database()
+    # 再実行ごとのスキーマ移行（書き込みロック）は発生しない
+    assert temp_db.get_writer_stats()["submitted"] == submitted
@@ -0,0 +1,107 @@
+from utils import llm
+from utils.llm import ResponseCache
+
+class FakeClock:
+    """テストから進める時計"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def persisted(db, key):
+    with db.get_connection() as conn:
+        return conn.execute("SELECT response, expires_at FROM llm_cache WHERE cache_key = ?", (key,)).fetchone()
+
+def wait_for_writes(db):
+    # ライターは投入順に処理するため、空のジョブの完了で先行する書き込みの完了を待てる
+    db.run_write(lambda conn: None)
+
+def test_make_key_normalizes_whitespace_and_params():
+    key = ResponseCache.make_key("問題の  ヒント\n", {"b": 1, "a": 2}, {"temperature": 0.7})
+    assert key == ResponseCache.make_key("問題の ヒント", {"a": 2, "b": 1}, {"temperature": 0.7})
+    assert key != ResponseCache.make_key("問題の ヒント", {"a": 2, "b": 1}, {"temperature": 0.2})
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = ResponseCache(max_entries=10, ttl=60, persistent=False, clock=clock)
+    cache.put("k", "応答")
+    cache.put("short", "短い応答", ttl=5)
+
+    clock.now += 59
+    assert cache.get("k") == "応答"
+    assert cache.get("short") is None
+    clock.now += 1
+    assert cache.get("k") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 0)
+    assert stats["hit_rate"] == 1 / 3
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_entries=2, ttl=60, persistent=False, clock=FakeClock())
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    # 直前に読んだ a は残り、最も長く使われていない b が追い出される
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("A", "C")
+    assert cache.stats()["evictions"] == 1
+
+    cache.put("a", "A2")
+    cache.put("d", "D")
+    assert cache.get("c") is None
+    assert cache.get("a") == "A2"
+
+def test_persistent_tier_survives_a_new_process(temp_db):
+    assert temp_db.init_database()
+    clock = FakeClock()
+    cache = ResponseCache(max_entries=10, ttl=60, persistent=True, clock=clock)
+    cache.put("k", "応答")
+    wait_for_writes(temp_db)
+    assert persisted(temp_db, "k") == ("応答", 1060.0)
+
+    # メモリ層を持たない別のキャッシュ（再起動後のプロセス）は永続層から読み、メモリ層に載せる
+    restarted = ResponseCache(max_entries=10, ttl=60, persistent=True, clock=clock)
+    assert restarted.get("k") == "応答"
+    assert restarted.get("k") == "応答"
+    stats = restarted.stats()
+    assert (stats["persistent_hits"], stats["hits"], stats["entries"]) == (1, 1, 1)
+
+    clock.now += 60
+    assert ResponseCache(max_entries=10, ttl=60, persistent=True, clock=clock).get("k") is None
+
+def test_persistent_tier_purges_expired_rows(temp_db):
+    assert temp_db.init_database()
+    clock = FakeClock()
+    cache = ResponseCache(max_entries=10, ttl=60, persistent=True, clock=clock)
+    cache.put("old", "古い応答", ttl=10)
+    cache.put("new", "新しい応答", ttl=100)
+    wait_for_writes(temp_db)
+
+    clock.now += 50
+    cache.purge_expired()
+    wait_for_writes(temp_db)
+    assert persisted(temp_db, "old") is None
+    assert persisted(temp_db, "new") == ("新しい応答", 1100.0)
+
+def test_uncached_calls_bypass_the_cache(llm_server, monkeypatch):
+    monkeypatch.setenv("LLM_API_KEY", "test")
+    monkeypatch.setenv("LLM_API_ENDPOINT", f"{llm_server.url}/single")
+    monkeypatch.delenv("LLM_BATCH_ENDPOINT", raising=False)
+    cache = ResponseCache(max_entries=10, ttl=60, persistent=False)
+    monkeypatch.setattr(llm, "response_cache", cache)
+
+    # 自由記述の回答を含むプロンプトはキャッシュを読まず、書き込みもしない
+    assert llm.call_llm_api("回答への講評", use_cache=False) == "s:回答への講評"
+    assert llm.call_llm_api("回答への講評", use_cache=False) == "s:回答への講評"
+    assert len(llm_server.requests) == 2
+    stats = cache.stats()
+    assert (stats["bypassed"], stats["entries"], stats["hits"] + stats["misses"]) == (2, 0, 0)
+
+    assert llm.call_llm_api("回答への講評") == "s:回答への講評"
+    assert llm.call_llm_api("回答への講評") == "s:回答への講評"
+    assert len(llm_server.requests) == 3
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
@@ -0,0 +1,44 @@
+import time
+
+from utils import helpers
+from utils.helpers import compile_expression, safe_eval
+
+def test_basic_arithmetic():
+    assert safe_eval("2+3*4") == 14
+    assert safe_eval("10000÷150") == 10000 / 150
+    assert safe_eval("2^10") == 1024
+    assert safe_eval("-(3-5)") == 2
+    assert safe_eval(" 3 × 4 ") == 12
+
+def test_rejects_non_numeric_and_unsupported():
+    assert safe_eval("'a' + 'b'") is None
+    assert safe_eval("__import__('os')") is None
+    assert safe_eval("True + 1") is None
+    assert safe_eval("1 // 2") is None
+    assert safe_eval("1/0") is None
+    assert safe_eval("(-8)**0.5") is None
+
+def test_huge_power_is_rejected_quickly():
+    started = time.perf_counter()
+    assert safe_eval("9**9**9") is None
+    assert safe_eval("(2**64)**64") is None
+    assert safe_eval("10.0**400") is None
+    assert time.perf_counter() - started < 0.5
+
+def test_length_and_node_limits():
+    assert safe_eval("1" * (helpers.SAFE_EVAL_MAX_LENGTH + 1)) is None
+    assert safe_eval("+".join(["1"] * helpers.SAFE_EVAL_MAX_NODES)) is None
+    assert safe_eval("+".join(["1"] * 10)) == 10
+
+def test_wall_time_limit(monkeypatch):
+    monkeypatch.setattr(helpers, "SAFE_EVAL_TIMEOUT", -1)
+    assert safe_eval("1+1") is None
+
+def test_compiled_expressions_are_cached():
+    compile_expression.cache_clear()
+    for _ in range(5):
+        assert safe_eval("12*3") == 36
+        assert safe_eval("1+") is None
+    info = compile_expression.cache_info()
+    assert info.misses == 2
+    assert info.hits == 8
@@ -0,0 +1,78 @@
+import time
+import sqlite3
+
+def session_row(db, session_id):
+    with db.get_connection() as conn:
+        return conn.execute(
+            "SELECT category, problem_index, hint_step FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+
+def test_save_session_upserts(temp_db):
+    assert temp_db.init_database()
+    assert temp_db.save_session("s1", "u1", "分析力", 0, 0)
+    assert temp_db.save_session("s1", "u1", "分析力", 2, 1)
+    assert session_row(temp_db, "s1") == ("分析力", 2, 1)
+
+def test_changes_are_coalesced_into_one_write(temp_db):
+    assert temp_db.init_database()
+    buffer = temp_db.SessionBuffer(flush_interval=60)
+    commits = temp_db.get_writer_stats()["completed"]
+    for step in range(20):
+        buffer.update("s1", "u1", "分析力", 3, step)
+    buffer.update("s2", "u2", "論理的思考力", 1, 0)
+    assert temp_db.get_writer_stats()["completed"] == commits
+    assert session_row(temp_db, "s1") is None
+
+    assert buffer.flush(wait=True) == 2
+    assert temp_db.get_writer_stats()["completed"] == commits + 1
+    assert session_row(temp_db, "s1") == ("分析力", 3, 19)
+    assert session_row(temp_db, "s2") == ("論理的思考力", 1, 0)
+    assert buffer.stats() == {"updates": 21, "flushes": 1, "rows": 2, "failures": 0, "pending": 0}
+    buffer.close()
+
+def test_timer_flushes_in_background(temp_db):
+    assert temp_db.init_database()
+    buffer = temp_db.SessionBuffer(flush_interval=0.05)
+    buffer.update("s1", "u1", "分析力", 4, 2)
+    deadline = time.time() + 5
+    while session_row(temp_db, "s1") is None and time.time() < deadline:
+        time.sleep(0.02)
+    assert session_row(temp_db, "s1") == ("分析力", 4, 2)
+
+def test_failed_flush_keeps_newer_changes(temp_db, monkeypatch):
+    assert temp_db.init_database()
+    buffer = temp_db.SessionBuffer(flush_interval=60)
+    buffer.update("s1", "u1", "分析力", 1, 0)
+
+    def full_queue(job):
+        buffer.update("s1", "u1", "分析力", 2, 0)
+        raise sqlite3.OperationalError("書き込みキューが満杯です")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(temp_db, "run_write", full_queue)
+        assert buffer.flush(wait=True) == 0
+    assert buffer.stats()["pending"] == 1
+    buffer.close()
+    assert session_row(temp_db, "s1") == ("分析力", 2, 0)
+
+def test_problem_boundary_flushes_only_that_session(temp_db):
+    assert temp_db.init_database()
+    buffer = temp_db.SessionBuffer(flush_interval=60)
+    buffer.update("s1", "u1", "分析力", 1, 2)
+    buffer.update("s2", "u2", "分析力", 0, 1)
+    buffer.update("s1", "u1", "分析力", 2, 0)
+
+    # on_next_problem と同じく、切り替えたセッションだけをタイマーを待たずに書き出す
+    assert buffer.flush("s1", wait=True) == 1
+    assert session_row(temp_db, "s1") == ("分析力", 2, 0)
+    assert session_row(temp_db, "s2") is None
+    assert buffer.flush("s1") == 0
+    assert buffer.stats()["pending"] == 1
+    buffer.close()
+    assert session_row(temp_db, "s2") == ("分析力", 0, 1)
+
+def test_zero_interval_writes_synchronously(temp_db):
+    assert temp_db.init_database()
+    buffer = temp_db.SessionBuffer(flush_interval=0)
+    assert buffer.update("s1", "u1", "分析力", 5, 1)
+    assert session_row(temp_db, "s1") == ("分析力", 5, 1)
@@ -0,0 +1,111 @@
+import time
+import uuid
+import random
+
+import pytest
+
+def record_attempts(db, count=60, users=5, seed=0):
+    rng = random.Random(seed)
+    now = time.time()
+    for _ in range(count):
+        assert db.save_problem_attempt({
+            "attempt_id": str(uuid.uuid4()),
+            "user_id": f"u{rng.randrange(users)}",
+            "problem_id": f"p{rng.randrange(10)}",
+            "category": rng.choice(["数で考える力", "分析力", "論理的思考力"]),
+            "timestamp": now - rng.randrange(20) * 86400,
+            "duration": float(rng.randrange(10, 300)),
+            "is_correct": rng.random() < 0.6,
+            "hints_used": rng.randrange(4),
+            "thought_length": rng.randrange(500),
+            "answer_text": "x",
+        })
+
+def direct_stats(db, user_id):
+    """解答記録から直接集計した統計（ロールアップとの比較用）"""
+    with db.get_connection() as conn:
+        overall = conn.execute(
+            """SELECT COUNT(*), SUM(is_correct), SUM(CASE WHEN is_correct = 1 THEN duration ELSE 0 END),
+                      SUM(hints_used), SUM(thought_length)
+               FROM problem_attempts WHERE user_id = ?""",
+            (user_id,)
+        ).fetchone()
+        categories = conn.execute(
+            "SELECT category, COUNT(*), SUM(is_correct) FROM problem_attempts WHERE user_id = ? GROUP BY category",
+            (user_id,)
+        ).fetchall()
+        daily = conn.execute(
+            """SELECT date(datetime(timestamp, 'unixepoch', 'localtime')) AS day, COUNT(*), SUM(is_correct)
+               FROM problem_attempts WHERE user_id = ? AND day >= ? GROUP BY day ORDER BY day""",
+            (user_id, time.strftime("%Y-%m-%d", time.localtime(time.time() - 30 * 24 * 60 * 60)))
+        ).fetchall()
+    return overall, sorted(tuple(c) for c in categories), [tuple(d) for d in daily]
+
+def assert_matches_direct(db, user_id):
+    stats = db.get_user_stats(user_id)
+    (total, correct, correct_duration, hints, thought), categories, daily = direct_stats(db, user_id)
+    overall = stats["overall"]
+    assert overall["total_attempts"] == total
+    assert overall["correct_answers"] == correct
+    assert overall["avg_correct_time"] == pytest.approx(correct_duration / correct if correct else 0)
+    assert overall["total_hints"] == hints
+    assert overall["avg_thought_length"] == pytest.approx(thought / total)
+    assert sorted((c["category"], c["attempts"], c["correct"]) for c in stats["categories"]) == categories
+    assert [(d["day"], d["attempts"], d["correct"]) for d in stats["daily"]] == daily
+
+def test_user_stats_match_direct_aggregation(temp_db):
+    assert temp_db.init_database()
+    record_attempts(temp_db)
+    for i in range(5):
+        assert_matches_direct(temp_db, f"u{i}")
+
+def test_user_stats_are_read_from_rollups(temp_db):
+    assert temp_db.init_database()
+    record_attempts(temp_db, count=10, users=1)
+    temp_db.run_write(lambda conn: conn.execute(
+        "UPDATE user_stats_overall SET total_attempts = 999 WHERE user_id = 'u0'"
+    ))
+    assert temp_db.get_user_stats("u0")["overall"]["total_attempts"] == 999
+
+def test_rebuild_commits_in_user_chunks(temp_db, monkeypatch):
+    assert temp_db.init_database()
+    record_attempts(temp_db, users=7)
+    monkeypatch.setattr(temp_db, "DB_MAINTENANCE_CHUNK", 2)
+
+    # 集計を壊し、解答記録のないユーザーの集計も混ぜる
+    def _corrupt(conn):
+        conn.execute("UPDATE user_stats_overall SET total_attempts = 0")
+        conn.execute("DELETE FROM user_stats_category")
+        conn.execute("INSERT INTO user_stats_overall (user_id, total_attempts) VALUES ('ghost', 5)")
+    temp_db.run_write(_corrupt)
+
+    commits = temp_db.get_writer_stats()["completed"]
+    assert temp_db.rebuild_user_stats() == 7
+    # 解答のあるユーザー 7人 / 2人 = 4チャンク、集計テーブルの8人 / 2人 = 4チャンク
+    assert temp_db.get_writer_stats()["completed"] - commits == 8
+    for i in range(7):
+        assert_matches_direct(temp_db, f"u{i}")
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM user_stats_overall WHERE user_id = 'ghost'").fetchone()[0] == 0
+
+def test_migration_backfill_is_retried_until_complete(temp_db, monkeypatch):
+    assert temp_db.init_database()
+    version = temp_db.MIGRATIONS[-1][0]
+    calls = []
+
+    def _backfill():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("中断")
+
+    monkeypatch.setattr(temp_db, "MIGRATIONS", temp_db.MIGRATIONS + [
+        (version + 1, "テスト用の移行", ["CREATE TABLE IF NOT EXISTS backfill_test (x INTEGER)"])
+    ])
+    monkeypatch.setattr(temp_db, "MIGRATION_BACKFILLS", {version + 1: _backfill})
+    with pytest.raises(RuntimeError):
+        temp_db.apply_migrations()
+    with temp_db.get_connection() as conn:
+        assert temp_db.get_schema_version(conn) == version
+    assert temp_db.apply_migrations() == version + 1
+    assert temp_db.apply_migrations() == version + 1
+    assert len(calls) == 2
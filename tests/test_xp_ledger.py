@@ -0,0 +1,80 @@
+import threading
+
+def ledger_total(db, user_id):
+    with db.get_connection() as conn:
+        return conn.execute("SELECT COALESCE(SUM(delta), 0) FROM xp_events WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+def test_record_xp_updates_xp_and_level(temp_db):
+    assert temp_db.init_database()
+    temp_db.get_or_create_user("u1")
+    assert temp_db.record_xp("u1", 60, "test") == (60, 0)
+    assert temp_db.record_xp("u1", 60, "test") == (120, 1)
+    user = temp_db.get_or_create_user("u1")
+    assert (user["xp_points"], user["level"]) == (120, 1)
+    assert ledger_total(temp_db, "u1") == 120
+
+def test_concurrent_increments_are_not_lost(temp_db):
+    assert temp_db.init_database()
+    temp_db.get_or_create_user("u1")
+
+    def _worker():
+        for _ in range(50):
+            temp_db.record_xp("u1", 1, "tab")
+
+    threads = [threading.Thread(target=_worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert temp_db.get_or_create_user("u1")["xp_points"] == 200
+
+def test_batched_application(temp_db):
+    assert temp_db.init_database()
+    for user_id in ("a", "b"):
+        temp_db.get_or_create_user(user_id)
+    totals = temp_db.apply_xp_events([
+        {"user_id": "a", "delta": 50, "reason": "x"},
+        {"user_id": "b", "delta": 700, "reason": "x"},
+        {"user_id": "a", "delta": 60, "reason": "y"},
+        {"user_id": "missing", "delta": 5, "reason": "x"},
+    ])
+    assert totals == {"a": (110, 1), "b": (700, 3)}
+
+def test_compaction_keeps_totals(temp_db):
+    assert temp_db.init_database()
+    temp_db.get_or_create_user("u1")
+    temp_db.apply_xp_events([{"user_id": "u1", "delta": 10, "reason": "old", "created_at": i} for i in range(20)])
+    temp_db.record_xp("u1", 5, "recent")
+    assert temp_db.compact_xp_events(older_than=3600) == 20
+    with temp_db.get_connection() as conn:
+        rows = conn.execute("SELECT reason, delta FROM xp_events ORDER BY event_id").fetchall()
+    assert sorted(rows) == [("compacted", 200), ("recent", 5)]
+    assert ledger_total(temp_db, "u1") == temp_db.get_or_create_user("u1")["xp_points"] == 205
+    # 2回目の集約では古い行が集約済みの1行だけになる
+    assert temp_db.compact_xp_events(older_than=3600) == 1
+    assert ledger_total(temp_db, "u1") == 205
+
+def test_automatic_compaction(temp_db, monkeypatch):
+    assert temp_db.init_database()
+    temp_db.get_or_create_user("u1")
+    monkeypatch.setattr(temp_db, "XP_COMPACT_EVERY", 3)
+    monkeypatch.setattr(temp_db, "XP_COMPACT_AFTER", -1)
+    monkeypatch.setattr(temp_db, "_xp_events_since_compaction", 0)
+    for _ in range(3):
+        temp_db.record_xp("u1", 1, "x")
+    temp_db.run_write(lambda conn: None)
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT reason, delta FROM xp_events").fetchall() == [("compacted", 3)]
+
+def test_problem_attempt_records_xp_in_same_transaction(temp_db):
+    assert temp_db.init_database()
+    temp_db.get_or_create_user("u1")
+    attempt = {
+        "attempt_id": "a1", "user_id": "u1", "problem_id": "p", "category": "c", "timestamp": 1.0,
+        "duration": 5.0, "is_correct": True, "hints_used": 0, "thought_length": 0, "answer_text": "x",
+        "xp_reward": 120,
+    }
+    assert temp_db.save_problem_attempt(attempt)
+    assert (attempt["xp_points"], attempt["level"]) == (120, 1)
+    with temp_db.get_connection() as conn:
+        assert conn.execute("SELECT attempt_id, delta FROM xp_events").fetchall() == [("a1", 120)]
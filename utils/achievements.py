@@ -0,0 +1,225 @@
+import json
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+from utils.problem_bank import ProblemCatalog, get_catalog
+
+# バッジ情報
+BADGES = {
+    "first_correct": {"name": "ファーストステップ", "icon": "🥇", "desc": "初めての正解"},
+    "streak_3": {"name": "3連続正解", "icon": "🔥", "desc": "3問連続で正解"},
+    "streak_5": {"name": "5連続正解", "icon": "🔥🔥", "desc": "5問連続で正解"},
+    "streak_10": {"name": "10連続正解", "icon": "🔥🔥🔥", "desc": "10問連続で正解"},
+    "no_hint": {"name": "独力解決者", "icon": "💪", "desc": "ヒントなしで問題を解決"},
+    "fast_solver": {"name": "スピード思考", "icon": "⚡", "desc": "60秒以内に正解"},
+    "deep_thinker": {"name": "深い思考", "icon": "🧘", "desc": "300文字以上の思考ログを残す"},
+    "complete_category": {"name": "カテゴリマスター", "icon": "🏆", "desc": "カテゴリ内の全問題を解く"},
+    "all_categories": {"name": "全領域マスター", "icon": "👑", "desc": "すべてのカテゴリで問題を解く"}
+}
+
+# 判定条件
+STREAK_BADGES = ((3, "streak_3"), (5, "streak_5"), (10, "streak_10"))
+FAST_SOLVER_SECONDS = 60
+DEEP_THINKER_LENGTH = 300
+BACKFILL_BATCH_SIZE = 5000
+
+# ユーザーごとの実績判定の状態
+@dataclass
+class AchievementState:
+    """
+    バッジ判定に必要な最小限の累積状態
+    solved はカテゴリごとの、正解した問題IDの集合（問題の追加・削除・並べ替えの影響を受けない）
+    """
+    user_id: str
+    streak: int = 0
+    correct_total: int = 0
+    solved: Dict[str, Set[str]] = field(default_factory=dict)
+    badges: List[str] = field(default_factory=list)
+
+# 実績判定エンジン
+class AchievementEngine:
+    """
+    解答記録のイベントごとに累積状態を更新してバッジを付与する
+    1イベントあたり状態の読み書きは主キーでの1行ずつで、解答履歴は再走査しない
+    """
+
+    def __init__(self, catalog_getter: Callable[[], ProblemCatalog] = get_catalog):
+        self.catalog_getter = catalog_getter
+        self._lock = threading.Lock()
+        self._stats = {"events": 0, "awarded": 0, "backfilled_attempts": 0}
+
+    def load_state(self, conn: sqlite3.Connection, user_id: str) -> AchievementState:
+        """ユーザーの累積状態と獲得済みバッジを読み込む"""
+        state = AchievementState(user_id)
+        row = conn.execute(
+            "SELECT streak, correct_total, solved FROM achievement_state WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        if row:
+            state.streak, state.correct_total = row[0], row[1]
+            state.solved = self._decode_solved(json.loads(row[2]))
+        row = conn.execute("SELECT badges FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row and row[0]:
+            state.badges = json.loads(row[0])
+        return state
+
+    def _decode_solved(self, raw: Dict[str, Any]) -> Dict[str, Set[str]]:
+        """
+        保存形式（カテゴリ -> 問題IDのリスト）を集合に戻す
+        旧形式（カテゴリ内の位置のビットマップ）は現在のカタログの並びで問題IDに読み替える
+        """
+        solved = {}
+        catalog = None
+        for category, value in raw.items():
+            if isinstance(value, int):
+                catalog = catalog or self.catalog_getter()
+                value = [p.id for i, p in enumerate(catalog.by_category(category)) if value >> i & 1]
+            solved[category] = set(value)
+        return solved
+
+    def save_state(self, conn: sqlite3.Connection, state: AchievementState, awarded: List[str]) -> None:
+        """累積状態を保存し、新しいバッジがあればユーザーのバッジ一覧も更新する"""
+        conn.execute(
+            """INSERT INTO achievement_state (user_id, streak, correct_total, solved, updated_at)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT (user_id) DO UPDATE SET
+                   streak = excluded.streak,
+                   correct_total = excluded.correct_total,
+                   solved = excluded.solved,
+                   updated_at = excluded.updated_at""",
+            (state.user_id, state.streak, state.correct_total,
+             json.dumps({category: sorted(ids) for category, ids in state.solved.items()}, ensure_ascii=False),
+             time.time())
+        )
+        if awarded:
+            conn.execute(
+                "UPDATE users SET badges = ? WHERE user_id = ?",
+                (json.dumps(state.badges, ensure_ascii=False), state.user_id)
+            )
+
+    def apply(self, state: AchievementState, attempt: Dict[str, Any], catalog: ProblemCatalog) -> List[str]:
+        """1件の解答記録で状態を更新し、新たに獲得したバッジIDの一覧を返す"""
+        earned = []
+        # 思考ログのバッジは正誤を問わない（不正解でも考えた過程を残したことを評価する）
+        if (attempt.get("thought_length") or 0) >= DEEP_THINKER_LENGTH:
+            earned.append("deep_thinker")
+
+        if not attempt.get("is_correct"):
+            state.streak = 0
+        else:
+            state.streak += 1
+            state.correct_total += 1
+            earned.append("first_correct")
+            earned.extend(badge for required, badge in STREAK_BADGES if state.streak >= required)
+            if not attempt.get("hints_used"):
+                earned.append("no_hint")
+            if (attempt.get("duration") or 0) <= FAST_SOLVER_SECONDS:
+                earned.append("fast_solver")
+
+            category = attempt.get("category")
+            problem_id = attempt.get("problem_id")
+            if category and problem_id:
+                solved = state.solved.setdefault(category, set())
+                solved.add(problem_id)
+                # 現在のカタログのカテゴリ内の問題をすべて解いていれば達成（削除された問題は数えない）
+                required = catalog.category_ids(category)
+                if required and required <= solved:
+                    earned.append("complete_category")
+                categories = catalog.categories()
+                if categories and all(state.solved.get(c) for c in categories):
+                    earned.append("all_categories")
+
+        awarded = [badge for badge in earned if badge not in state.badges]
+        state.badges.extend(awarded)
+        return awarded
+
+    def process(self, conn: sqlite3.Connection, attempt: Dict[str, Any]) -> List[str]:
+        """解答記録のイベントを処理して、新たに獲得したバッジIDの一覧を返す（書き込みトランザクション内で呼ぶ）"""
+        state = self.load_state(conn, attempt["user_id"])
+        awarded = self.apply(state, attempt, self.catalog_getter())
+        self.save_state(conn, state, awarded)
+        with self._lock:
+            self._stats["events"] += 1
+            self._stats["awarded"] += len(awarded)
+        return awarded
+
+    def reset_streak(self, conn: sqlite3.Connection, user_id: str) -> None:
+        """不正解のイベントで連続正解数を0に戻す（記録されない不正解もストリークを途切れさせる）"""
+        conn.execute("UPDATE achievement_state SET streak = 0 WHERE user_id = ? AND streak > 0", (user_id,))
+        with self._lock:
+            self._stats["events"] += 1
+
+    def backfill(self, conn: sqlite3.Connection, user_ids: Sequence[str],
+                 batch_size: int = BACKFILL_BATCH_SIZE) -> Dict[str, int]:
+        """
+        指定ユーザーの解答履歴をユーザー・時刻順に再生して累積状態を作り直す（獲得済みのバッジは残す）
+        バッジ判定の条件を変更した場合や、累積状態を失った場合に使う
+        1回の書き込みトランザクションで処理するため、全ユーザーはチャンクに分けて呼ぶこと
+        """
+        catalog = self.catalog_getter()
+        where = f"WHERE user_id IN ({', '.join('?' * len(user_ids))})"
+        params = tuple(user_ids)
+        conn.execute(f"DELETE FROM achievement_state {where}", params)
+        cursor = conn.execute(
+            f"""SELECT user_id, problem_id, category, duration, is_correct, hints_used, thought_length
+                FROM problem_attempts {where} ORDER BY user_id, timestamp""",
+            params
+        )
+        columns = [column[0] for column in cursor.description]
+        result = {"users": 0, "attempts": 0, "awarded": 0}
+        state = None
+        awarded = []
+
+        def _finish():
+            self.save_state(conn, state, awarded)
+            result["users"] += 1
+            result["awarded"] += len(awarded)
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                attempt = dict(zip(columns, row))
+                if state is None or state.user_id != attempt["user_id"]:
+                    if state is not None:
+                        _finish()
+                    state = self.load_state(conn, attempt["user_id"])
+                    state.streak, state.correct_total, state.solved = 0, 0, {}
+                    awarded = []
+                awarded.extend(self.apply(state, attempt, catalog))
+            result["attempts"] += len(rows)
+        if state is not None:
+            _finish()
+
+        with self._lock:
+            self._stats["backfilled_attempts"] += result["attempts"]
+            self._stats["awarded"] += result["awarded"]
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """処理したイベント数と付与したバッジ数を返す"""
+        with self._lock:
+            return dict(self._stats)
+
+# 共有エンジン
+_engine = None
+_engine_lock = threading.Lock()
+
+# 共有エンジンの取得
+def get_achievement_engine() -> AchievementEngine:
+    """プロセス共通の実績判定エンジンを取得"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AchievementEngine()
+    return _engine
+
+# バッジ付与の統計
+def get_achievement_stats() -> Dict[str, int]:
+    """処理した解答イベント数と付与したバッジ数を取得"""
+    return get_achievement_engine().stats()
@@ -1,20 +1,583 @@
 import sqlite3
 import json
+import os
 import time
 import uuid
+import queue
 import logging
+import atexit
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Dict, Any, Callable
+
+from utils.achievements import get_achievement_engine
+from utils.leaderboard import get_leaderboard
 
 # 定数
 DB_PATH = "thinking_app.db"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_WRITE_QUEUE_SIZE = int(os.getenv("DB_WRITE_QUEUE_SIZE", "1000"))
+DB_WRITE_TIMEOUT = float(os.getenv("DB_WRITE_TIMEOUT", "10"))
+DB_WRITE_BATCH = 64  # 1回のコミットでまとめる最大書き込み数
+DB_MAINTENANCE_CHUNK = int(os.getenv("DB_MAINTENANCE_CHUNK", "200"))  # 再集計・バッジ再生で1回のコミットに含めるユーザー数
+DB_PERSISTED_COUNTS_SIZE = int(os.getenv("DB_PERSISTED_COUNTS_SIZE", "4096"))  # 件数キャッシュに保持するセッション数
+XP_COMPACT_AFTER = float(os.getenv("XP_COMPACT_AFTER", str(30 * 24 * 60 * 60)))  # この秒数より古いXPイベントはユーザーごとに集約
+XP_COMPACT_EVERY = int(os.getenv("XP_COMPACT_EVERY", "1000"))  # 集約を実行するXPイベント数の間隔（0で自動実行しない）
+XP_UPDATE_CHUNK = 500  # レベル再計算で1回のIN句に入れるユーザー数
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "1"))  # セッション状態をまとめて書き出す間隔（秒、0で変更ごとに同期書き込み）
+
+# 接続ごとのPRAGMA設定
+def apply_pragmas(conn: sqlite3.Connection) -> None:
+    """接続単位のPRAGMA（同期モード・ビジータイムアウト・mmap）を設定"""
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+
+# SQLite接続プール
+class ConnectionPool:
+    """
+    プロセス全体で共有するスレッドセーフなSQLite接続プール
+    同一スレッド内の入れ子呼び出しでは同じ接続を再利用する
+    """
+
+    def __init__(self, db_path: str = DB_PATH, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._stats = {"hits": 0, "misses": 0, "waits": 0, "wait_time": 0.0, "reuses": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        """新しい接続を作成"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        apply_pragmas(conn)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """接続を取得（空きがなければ返却を待つ）"""
+        # 同一スレッドで既に保持している接続を再利用
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            self._local.depth += 1
+            with self._lock:
+                self._stats["reuses"] += 1
+            return held
+
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._stats["hits"] += 1
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+                    self._stats["misses"] += 1
+            if can_create:
+                try:
+                    conn = self._connect()
+                except sqlite3.Error:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                # プールが満杯なので返却を待つ
+                started = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError("接続プールの待機がタイムアウトしました")
+                finally:
+                    with self._lock:
+                        self._stats["waits"] += 1
+                        self._stats["wait_time"] += time.perf_counter() - started
+
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """接続をプールへ返却"""
+        if getattr(self._local, "conn", None) is not conn:
+            return
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        self._local.conn = None
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        接続を貸し出すコンテキストマネージャ
+        sqlite3.Connectionのwith文と同様に正常終了でcommit、例外でrollbackする
+        入れ子の場合は最も外側の貸し出しを終えた時点でcommitし、row_factoryを戻す
+        """
+        conn = self.acquire()
+        outermost = self._local.depth == 1
+        try:
+            if outermost:
+                with conn:
+                    yield conn
+            else:
+                yield conn
+        finally:
+            if outermost:
+                conn.row_factory = None
+            self.release(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """プールのヒット/待機統計を取得"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self.size
+            stats["created"] = self._created
+        stats["idle"] = self._idle.qsize()
+        total = stats["hits"] + stats["misses"] + stats["waits"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        stats["avg_wait_time"] = stats["wait_time"] / stats["waits"] if stats["waits"] else 0.0
+        return stats
+
+    def close_all(self) -> None:
+        """待機中の接続をすべて閉じる"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# 共有プールの取得
+def get_pool() -> ConnectionPool:
+    """プロセス共通の接続プールを取得"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+# 接続の取得
+def get_connection():
+    """共有プールから接続を借りる（with文で使用）"""
+    return get_pool().connection()
+
+# プール統計の取得
+def get_pool_stats() -> Dict[str, Any]:
+    """接続プールのヒット/待機統計を取得"""
+    return get_pool().stats()
+
+# 書き込み専用スレッド
+class DatabaseWriter:
+    """
+    すべての書き込みを1本の専用スレッドで直列に実行するライター
+    キューに溜まった書き込みはまとめて1トランザクションでコミットする
+    """
+
+    def __init__(self, db_path: str = DB_PATH, max_queue: int = DB_WRITE_QUEUE_SIZE):
+        self.db_path = db_path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "commits": 0,
+            "max_queue_depth": 0,
+            "commit_time": 0.0,
+            "max_commit_time": 0.0,
+        }
+
+    def start(self) -> None:
+        """ライタースレッドを起動"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, job: Callable[[sqlite3.Connection], Any], timeout: float = DB_WRITE_TIMEOUT) -> Future:
+        """書き込みジョブをキューに追加（キューが満杯なら待機）"""
+        self.start()
+        future = Future()
+        try:
+            self._queue.put((job, future), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise sqlite3.OperationalError("書き込みキューが満杯です")
+        with self._lock:
+            self._stats["submitted"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue.qsize())
+        return future
+
+    def run(self, job: Callable[[sqlite3.Connection], Any], timeout: float = DB_WRITE_TIMEOUT) -> Any:
+        """書き込みジョブを実行し、コミット完了まで待つ"""
+        future = self.submit(job, timeout)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise sqlite3.OperationalError("書き込みがタイムアウトしました")
+
+    def stop(self, timeout: float = DB_WRITE_TIMEOUT) -> None:
+        """キューを処理し終えてからライタースレッドを停止"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put((None, None))
+        thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """キュー深さとコミットレイテンシの統計を取得"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["avg_commit_time"] = stats["commit_time"] / stats["commits"] if stats["commits"] else 0.0
+        return stats
+
+    def _run(self) -> None:
+        """ライタースレッドのメインループ"""
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        apply_pragmas(conn)
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < DB_WRITE_BATCH:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                jobs = [(job, future) for job, future in batch if job is not None]
+                if jobs:
+                    self._commit(conn, jobs)
+                if len(jobs) < len(batch):
+                    break
+        finally:
+            conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, jobs) -> None:
+        """ジョブをまとめて実行し1回でコミット（失敗したジョブのみロールバック）"""
+        started = time.perf_counter()
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job, future in jobs:
+                conn.execute("SAVEPOINT job")
+                try:
+                    results.append((future, job(conn), None))
+                    conn.execute("RELEASE job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logging.error(f"書き込みコミットエラー: {str(e)}")
+            results = [(future, None, e) for _, future in jobs]
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats["commits"] += 1
+            self._stats["commit_time"] += elapsed
+            self._stats["max_commit_time"] = max(self._stats["max_commit_time"], elapsed)
+            for _, _, error in results:
+                self._stats["failed" if error else "completed"] += 1
+
+        for future, result, error in results:
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+_writer = None
+
+# 共有ライターの取得
+def get_writer() -> DatabaseWriter:
+    """プロセス共通の書き込みスレッドを取得"""
+    global _writer
+    if _writer is None:
+        with _pool_lock:
+            if _writer is None:
+                _writer = DatabaseWriter()
+                atexit.register(_writer.stop)
+    return _writer
+
+# 書き込みの実行
+def run_write(job: Callable[[sqlite3.Connection], Any]) -> Any:
+    """書き込みジョブをライタースレッドで実行し結果を返す"""
+    return get_writer().run(job)
+
+# 書き込み統計の取得
+def get_writer_stats() -> Dict[str, Any]:
+    """書き込みキューの深さとコミットレイテンシを取得"""
+    return get_writer().stats()
+
+# 統計ロールアップの再集計SQL（{where}にユーザー条件を埋め込む）
+ROLLUP_REBUILD_SQL = [
+    """INSERT INTO user_stats_overall
+       (user_id, total_attempts, correct_answers, correct_duration_sum, total_hints, thought_length_sum)
+       SELECT user_id, COUNT(*), SUM(CASE WHEN is_correct = 1 THEN 1 ELSE 0 END),
+              SUM(CASE WHEN is_correct = 1 THEN duration ELSE 0 END), SUM(hints_used), SUM(thought_length)
+       FROM problem_attempts {where} GROUP BY user_id""",
+    """INSERT INTO user_stats_category (user_id, category, attempts, correct)
+       SELECT user_id, category, COUNT(*), SUM(CASE WHEN is_correct = 1 THEN 1 ELSE 0 END)
+       FROM problem_attempts {where} GROUP BY user_id, category""",
+    """INSERT INTO user_stats_daily (user_id, day, attempts, correct)
+       SELECT user_id, date(datetime(timestamp, 'unixepoch', 'localtime')), COUNT(*),
+              SUM(CASE WHEN is_correct = 1 THEN 1 ELSE 0 END)
+       FROM problem_attempts {where} GROUP BY user_id, date(datetime(timestamp, 'unixepoch', 'localtime'))""",
+]
+ROLLUP_TABLES = ["user_stats_overall", "user_stats_category", "user_stats_daily"]
+
+# スキーマ移行（バージョン, 説明, SQL文のリスト）
+# 既存の移行は変更せず、新しい移行を末尾に追加すること
+MIGRATIONS = [
+    (1, "解答履歴・チャット・思考ログのインデックス追加", [
+        "CREATE INDEX IF NOT EXISTS idx_attempts_user_time ON problem_attempts (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_attempts_user_category ON problem_attempts (user_id, category, is_correct)",
+        "CREATE INDEX IF NOT EXISTS idx_chat_session_problem ON chat_history (session_id, problem_id)",
+        "CREATE INDEX IF NOT EXISTS idx_thoughts_session_problem ON thought_logs (session_id, problem_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id)",
+    ]),
+    (2, "ユーザー統計ロールアップテーブルの追加", [
+        """CREATE TABLE IF NOT EXISTS user_stats_overall (
+               user_id TEXT PRIMARY KEY,
+               total_attempts INTEGER NOT NULL DEFAULT 0,
+               correct_answers INTEGER NOT NULL DEFAULT 0,
+               correct_duration_sum FLOAT NOT NULL DEFAULT 0,
+               total_hints INTEGER NOT NULL DEFAULT 0,
+               thought_length_sum INTEGER NOT NULL DEFAULT 0
+           )""",
+        """CREATE TABLE IF NOT EXISTS user_stats_category (
+               user_id TEXT NOT NULL,
+               category TEXT NOT NULL,
+               attempts INTEGER NOT NULL DEFAULT 0,
+               correct INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (user_id, category)
+           )""",
+        """CREATE TABLE IF NOT EXISTS user_stats_daily (
+               user_id TEXT NOT NULL,
+               day TEXT NOT NULL,
+               attempts INTEGER NOT NULL DEFAULT 0,
+               correct INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (user_id, day)
+           )""",
+    ]),
+    (3, "LLM応答キャッシュテーブルの追加", [
+        """CREATE TABLE IF NOT EXISTS llm_cache (
+               cache_key TEXT PRIMARY KEY,
+               response TEXT NOT NULL,
+               created_at FLOAT NOT NULL,
+               expires_at FLOAT NOT NULL
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache (expires_at)",
+    ]),
+    (4, "問題別の再採点用インデックス追加", [
+        "CREATE INDEX IF NOT EXISTS idx_attempts_problem ON problem_attempts (problem_id, attempt_id)",
+    ]),
+    (5, "バッジ判定の累積状態テーブルの追加", [
+        """CREATE TABLE IF NOT EXISTS achievement_state (
+               user_id TEXT PRIMARY KEY,
+               streak INTEGER NOT NULL DEFAULT 0,
+               correct_total INTEGER NOT NULL DEFAULT 0,
+               solved TEXT NOT NULL DEFAULT '{}',
+               updated_at FLOAT NOT NULL
+           )""",
+    ]),
+    (6, "XP台帳テーブルの追加", [
+        """CREATE TABLE IF NOT EXISTS xp_events (
+               event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+               user_id TEXT NOT NULL,
+               delta INTEGER NOT NULL,
+               reason TEXT NOT NULL,
+               attempt_id TEXT,
+               created_at FLOAT NOT NULL
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_xp_events_time ON xp_events (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_xp_events_user ON xp_events (user_id, created_at)",
+        # 既存ユーザーのXPを台帳の初期残高として記録する
+        """INSERT INTO xp_events (user_id, delta, reason, created_at)
+           SELECT user_id, xp_points, 'opening_balance', created_at FROM users WHERE xp_points != 0""",
+    ]),
+    (7, "XP台帳へのカテゴリ追加とランキングのスナップショットテーブル", [
+        "ALTER TABLE xp_events ADD COLUMN category TEXT",
+        """UPDATE xp_events SET category = (
+               SELECT category FROM problem_attempts WHERE problem_attempts.attempt_id = xp_events.attempt_id
+           ) WHERE attempt_id IS NOT NULL""",
+        """CREATE TABLE IF NOT EXISTS leaderboard_snapshots (
+               board TEXT NOT NULL,
+               position INTEGER NOT NULL,
+               rank INTEGER NOT NULL,
+               user_id TEXT NOT NULL,
+               score INTEGER NOT NULL,
+               taken_at FLOAT NOT NULL,
+               PRIMARY KEY (board, position)
+           )""",
+    ]),
+    (8, "総合ランキング用のXPインデックス追加", [
+        "CREATE INDEX IF NOT EXISTS idx_users_xp ON users (xp_points DESC, user_id)",
+    ]),
+]
+
+# 移行後に分割コミットで行うデータの埋め戻し（バージョン -> 関数）
+# 埋め戻しが終わるまでそのバージョンは適用済みとして記録しないため、途中で止まっても次回の起動でやり直される
+# （埋め戻しのある移行のSQL文は再実行しても問題ないように書くこと）
+MIGRATION_BACKFILLS = {
+    2: lambda: _rebuild_all_rollups(),
+}
+
+# 再採点で問題ごとの解答記録を attempt_id 順に読み出すSQL
+REGRADE_BATCH_SQL = """SELECT attempt_id, user_id, category, timestamp, duration, is_correct, answer_text
+       FROM problem_attempts WHERE problem_id = ? AND attempt_id > ?
+       ORDER BY attempt_id LIMIT ?"""
+
+# 実行計画を監視するホットクエリ（名前, SQL, パラメータ）
+HOT_QUERIES = [
+    ("stats_overall",
+     "SELECT * FROM user_stats_overall WHERE user_id = ?",
+     ("u",)),
+    ("stats_categories",
+     "SELECT category, attempts, correct FROM user_stats_category WHERE user_id = ?",
+     ("u",)),
+    ("stats_recent",
+     "SELECT * FROM problem_attempts WHERE user_id = ? ORDER BY timestamp DESC LIMIT 10",
+     ("u",)),
+    ("stats_daily",
+     "SELECT day, attempts, correct FROM user_stats_daily WHERE user_id = ? AND day >= ? ORDER BY day",
+     ("u", "2000-01-01")),
+    ("chat_count",
+     "SELECT COUNT(*) FROM chat_history WHERE session_id = ? AND problem_id = ?",
+     ("s", "p")),
+    ("chat_delete",
+     "DELETE FROM chat_history WHERE session_id = ? AND problem_id = ?",
+     ("s", "p")),
+    ("thoughts_count",
+     "SELECT COUNT(*) FROM thought_logs WHERE session_id = ? AND problem_id = ?",
+     ("s", "p")),
+    ("thoughts_delete",
+     "DELETE FROM thought_logs WHERE session_id = ? AND problem_id = ?",
+     ("s", "p")),
+    ("regrade_batch",
+     REGRADE_BATCH_SQL,
+     ("p", "", 1)),
+    ("leaderboard_sync",
+     "SELECT event_id, user_id, delta, category, created_at, reason FROM xp_events WHERE event_id > ? ORDER BY event_id",
+     (0,)),
+]
+
+# 現在のスキーマバージョン取得
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """適用済みの最新スキーマバージョンを取得"""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS schema_version (
+               version INTEGER PRIMARY KEY,
+               description TEXT NOT NULL,
+               applied_at FLOAT NOT NULL
+           )"""
+    )
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+# スキーマ移行の適用
+def apply_migrations() -> int:
+    """
+    未適用のスキーマ移行を順番に適用し、適用後のバージョンを返す
+    埋め戻しのある移行は、SQL文の適用後に埋め戻しをユーザー単位の分割コミットで行ってからバージョンを記録する
+    """
+    def _record(conn, target, description):
+        conn.execute(
+            "INSERT OR IGNORE INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+            (target, description, time.time())
+        )
+        logging.info(f"スキーマ移行を適用しました: v{target} {description}")
+    
+    def _migrate(conn):
+        # ライタースレッドのBEGIN IMMEDIATE内で確認するため、複数プロセスでも二重適用されない
+        version = get_schema_version(conn)
+        for target, description, statements in MIGRATIONS:
+            if target <= version:
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            if target in MIGRATION_BACKFILLS:
+                return version, (target, description)
+            _record(conn, target, description)
+            version = target
+        return version, None
+    
+    while True:
+        version, pending = run_write(_migrate)
+        if pending is None:
+            return version
+        logging.info(f"スキーマ移行の埋め戻しを開始します: v{pending[0]} {pending[1]}")
+        MIGRATION_BACKFILLS[pending[0]]()
+        run_write(lambda conn: _record(conn, *pending))
+
+# 全件スキャンの検出
+def find_full_scans(conn: sqlite3.Connection = None):
+    """HOT_QUERIESのうち、実行計画にテーブルの全件スキャンを含むものを返す"""
+    if conn is None:
+        # EXPLAINはスキーマ変更を検知しないため、キャッシュのない新しい接続で確認する
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            return find_full_scans(conn)
+        finally:
+            conn.close()
+    
+    offenders = []
+    for name, sql, params in HOT_QUERIES:
+        for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall():
+            detail = row[-1]
+            # "SCAN"は全件走査（"USING COVERING INDEX"付きでも索引全体を走査する）
+            if detail.startswith("SCAN "):
+                offenders.append((name, detail))
+    return offenders
+
+_database_initialized = False
+_init_lock = threading.Lock()
 
 # データベース初期化
 def init_database():
-    """SQLiteデータベースを必要なテーブルで初期化"""
+    """
+    SQLiteデータベースを必要なテーブルで初期化
+    Streamlitの再実行ごとに呼ばれるため、テーブル作成・スキーマ移行・実行計画チェックはプロセスで1度だけ行う
+    """
+    global _database_initialized
+    if _database_initialized:
+        return True
+    with _init_lock:
+        if _database_initialized:
+            return True
+        _database_initialized = _init_database()
+        return _database_initialized
+
+def _init_database():
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             
+            # WALモード（読み取りが書き込みにブロックされない）
+            cursor.execute("PRAGMA journal_mode=WAL")
+            
             # ユーザーテーブル
             cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -101,8 +664,19 @@ def init_database():
                 UNIQUE(user_id, date, goal_type)
             )
             ''')
-            
-            return True
+        
+        # スキーマ移行の適用
+        apply_migrations()
+        
+        # ランキングをデータベースから構築
+        with get_connection() as conn:
+            get_leaderboard().load(conn)
+        
+        # ホットクエリの実行計画チェック
+        for name, detail in find_full_scans():
+            logging.warning(f"全件スキャンのクエリがあります: {name} - {detail}")
+        
+        return True
     except sqlite3.Error as e:
         logging.error(f"データベース初期化エラー: {str(e)}")
         return False
@@ -117,7 +691,7 @@ def get_or_create_user(user_id=None, username=None):
         username = f"ユーザー{user_id[:6]}"
     
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             
             # ユーザー存在確認
@@ -151,9 +725,9 @@ def get_or_create_user(user_id=None, username=None):
                     "learning_paths": ["基礎思考力"]
                 }
                 
-                # データベースに挿入
-                cursor.execute(
-                    """INSERT INTO users 
+                # データベースに挿入（ライタースレッド経由）
+                run_write(lambda write_conn: write_conn.execute(
+                    """INSERT OR IGNORE INTO users 
                        (user_id, username, created_at, xp_points, level, streak_days,
                         last_active, badges, settings, learning_paths)
                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
@@ -169,7 +743,7 @@ def get_or_create_user(user_id=None, username=None):
                         json.dumps(new_user["settings"]),
                         json.dumps(new_user["learning_paths"])
                     )
-                )
+                ))
                 
                 return new_user
     except sqlite3.Error as e:
@@ -186,47 +760,359 @@ def get_or_create_user(user_id=None, username=None):
             "learning_paths": ["基礎思考力"]
         }
 
-# ユーザープロフィール保存
-def save_user_profile(user):
-    """ユーザープロフィールをデータベースに保存"""
+# 前回の集約以降に適用したXPイベント数
+_xp_events_since_compaction = 0
+_xp_compaction_lock = threading.Lock()
+
+# XPイベントの適用
+def _apply_xp(conn, events):
+    """
+    XPイベントを台帳に追記し、ユーザーのXPを差分だけ原子的に加算してレベルを更新する
+    events は user_id, delta と任意の reason, attempt_id, category, created_at を持つ辞書のリスト
+    戻り値はユーザーごとの (加算後のXP, レベル)
+    """
+    from utils.helpers import get_level_curve
+    
+    deltas = {}
+    for event in events:
+        deltas[event["user_id"]] = deltas.get(event["user_id"], 0) + int(event["delta"])
+    conn.executemany(
+        "UPDATE users SET xp_points = xp_points + ? WHERE user_id = ?",
+        [(delta, user_id) for user_id, delta in deltas.items() if delta]
+    )
+    
+    # 加算後のXPからレベルをまとめて求め、変わったユーザーだけ更新する
+    totals = {}
+    user_ids = list(deltas)
+    for i in range(0, len(user_ids), XP_UPDATE_CHUNK):
+        chunk = user_ids[i:i + XP_UPDATE_CHUNK]
+        rows = conn.execute(
+            f"SELECT user_id, xp_points, level FROM users WHERE user_id IN ({', '.join('?' * len(chunk))})",
+            chunk
+        ).fetchall()
+        if not rows:
+            continue
+        levels = get_level_curve().levels_for([row[1] for row in rows])
+        conn.executemany(
+            "UPDATE users SET level = ? WHERE user_id = ?",
+            [(int(level), row[0]) for row, level in zip(rows, levels) if level != row[2]]
+        )
+        totals.update({row[0]: (row[1], int(level)) for row, level in zip(rows, levels)})
+    
+    # 台帳には存在するユーザーのイベントだけを記録する（台帳の合計とXPを一致させる）
+    now = time.time()
+    conn.executemany(
+        "INSERT INTO xp_events (user_id, delta, reason, attempt_id, category, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (event["user_id"], int(event["delta"]), event.get("reason", ""), event.get("attempt_id"),
+             event.get("category"), event.get("created_at", now))
+            for event in events if event["user_id"] in totals
+        ]
+    )
+    return totals
+
+# 台帳の集約の要否判定
+def _count_xp_events(count):
+    """適用したXPイベント数を数え、XP_COMPACT_EVERY 件ごとに集約をバックグラウンドで実行する"""
+    global _xp_events_since_compaction
+    if XP_COMPACT_EVERY <= 0:
+        return
+    with _xp_compaction_lock:
+        _xp_events_since_compaction += count
+        if _xp_events_since_compaction < XP_COMPACT_EVERY:
+            return
+        _xp_events_since_compaction = 0
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                """UPDATE users SET
-                   username = ?,
-                   xp_points = ?,
-                   level = ?,
-                   streak_days = ?,
-                   last_active = ?,  
-                   badges = ?,
-                   settings = ?,
-                   learning_paths = ?
-                   WHERE user_id = ?""",
-                (
-                    user["username"],
-                    user["xp_points"],
-                    user["level"],
-                    user["streak_days"],
-                    user["last_active"],
-                    json.dumps(user["badges"]),
-                    json.dumps(user["settings"]),
-                    json.dumps(user["learning_paths"]),
-                    user["user_id"]
-                )
-            )
-            
-            return True
+        get_writer().submit(lambda conn: _compact_xp(conn, time.time() - XP_COMPACT_AFTER))
+    except sqlite3.Error as e:
+        logging.warning(f"XP台帳の集約をスキップしました: {str(e)}")
+
+# ランキングへの取り込み
+def sync_leaderboard(force=False):
+    """
+    台帳に前回以降コミットされたXPイベント（他プロセスの分を含む）をランキングに取り込み、取り込んだ件数を返す
+    force=False なら LEADERBOARD_SYNC_INTERVAL 秒以内の再取り込みは省略する
+    """
+    leaderboard = get_leaderboard()
+    if not leaderboard.loaded or not (force or leaderboard.sync_due()):
+        return 0
+    try:
+        with get_connection() as conn:
+            return leaderboard.sync(conn)
+    except sqlite3.Error as e:
+        logging.error(f"ランキング取り込みエラー: {str(e)}")
+        return 0
+
+# ランキングのスナップショット保存
+def snapshot_leaderboard():
+    """各ボードの上位K人をデータベースから集計し、スナップショットテーブルを置き換える（保存した行数を返す）"""
+    leaderboard = get_leaderboard()
+    try:
+        # 台帳の集計は読み取り接続で行い、書き込みは置き換えだけにする
+        with get_connection() as conn:
+            rows = leaderboard.snapshot_rows(conn)
+        return run_write(lambda conn: leaderboard.save_snapshot(conn, rows))
+    except sqlite3.Error as e:
+        logging.error(f"ランキングのスナップショット保存エラー: {str(e)}")
+        return 0
+
+# XP加算後のランキング更新
+def _publish_xp():
+    """自プロセスのXP加算をすぐにランキングへ取り込み、間隔が空いていればスナップショットをバックグラウンドで保存する"""
+    sync_leaderboard(force=True)
+    if get_leaderboard().snapshot_due():
+        threading.Thread(target=snapshot_leaderboard, name="leaderboard-snapshot", daemon=True).start()
+
+# XPイベントの一括適用
+def apply_xp_events(events):
+    """複数のXPイベントを1トランザクションで台帳に追記・加算し、ユーザーごとの (XP, レベル) を返す"""
+    if not events:
+        return {}
+    try:
+        totals = run_write(lambda conn: _apply_xp(conn, events))
+        _count_xp_events(len(events))
+        _publish_xp()
+        return totals
+    except sqlite3.Error as e:
+        logging.error(f"XP加算エラー: {str(e)}")
+        return {}
+
+# XPの加算
+def record_xp(user_id, delta, reason, attempt_id=None, category=None):
+    """1件のXP変化を記録し、加算後の (XP, レベル) を返す（ユーザーが存在しなければNone）"""
+    totals = apply_xp_events([{
+        "user_id": user_id, "delta": delta, "reason": reason, "attempt_id": attempt_id, "category": category
+    }])
+    return totals.get(user_id)
+
+# XP台帳の集約
+def _compact_xp(conn, cutoff):
+    """
+    cutoff より古いXPイベントをユーザー・カテゴリごとに1行へまとめ、削除した行数を返す
+    （合計XPとカテゴリ別の合計は変わらない。週間ランキングは LEADERBOARD_WEEKS より古い週が対象外のため影響しない）
+    """
+    max_id = conn.execute("SELECT MAX(event_id) FROM xp_events WHERE created_at < ?", (cutoff,)).fetchone()[0]
+    if max_id is None:
+        return 0
+    conn.execute(
+        """INSERT INTO xp_events (user_id, delta, reason, category, created_at)
+           SELECT user_id, SUM(delta), 'compacted', category, MAX(created_at) FROM xp_events
+           WHERE created_at < ? AND event_id <= ? GROUP BY user_id, category""",
+        (cutoff, max_id)
+    )
+    return conn.execute(
+        "DELETE FROM xp_events WHERE created_at < ? AND event_id <= ?", (cutoff, max_id)
+    ).rowcount
+
+# XP台帳の集約（公開API）
+def compact_xp_events(older_than=XP_COMPACT_AFTER):
+    """older_than 秒より古いXPイベントをユーザーごとに集約し、削除した行数を返す"""
+    try:
+        return run_write(lambda conn: _compact_xp(conn, time.time() - older_than))
+    except sqlite3.Error as e:
+        logging.error(f"XP台帳集約エラー: {str(e)}")
+        return 0
+
+# 統計ロールアップの加算
+def _update_rollups(conn, attempt):
+    """1件の解答記録を全体・カテゴリ別・日別の集計に加算"""
+    correct = 1 if attempt["is_correct"] else 0
+    day = time.strftime("%Y-%m-%d", time.localtime(attempt["timestamp"]))
+    
+    conn.execute(
+        """INSERT INTO user_stats_overall
+           (user_id, total_attempts, correct_answers, correct_duration_sum, total_hints, thought_length_sum)
+           VALUES (?, 1, ?, ?, ?, ?)
+           ON CONFLICT (user_id) DO UPDATE SET
+               total_attempts = total_attempts + 1,
+               correct_answers = correct_answers + excluded.correct_answers,
+               correct_duration_sum = correct_duration_sum + excluded.correct_duration_sum,
+               total_hints = total_hints + excluded.total_hints,
+               thought_length_sum = thought_length_sum + excluded.thought_length_sum""",
+        (
+            attempt["user_id"],
+            correct,
+            attempt["duration"] if correct else 0,
+            attempt["hints_used"] or 0,
+            attempt["thought_length"] or 0
+        )
+    )
+    conn.execute(
+        """INSERT INTO user_stats_category (user_id, category, attempts, correct)
+           VALUES (?, ?, 1, ?)
+           ON CONFLICT (user_id, category) DO UPDATE SET
+               attempts = attempts + 1,
+               correct = correct + excluded.correct""",
+        (attempt["user_id"], attempt["category"], correct)
+    )
+    conn.execute(
+        """INSERT INTO user_stats_daily (user_id, day, attempts, correct)
+           VALUES (?, ?, 1, ?)
+           ON CONFLICT (user_id, day) DO UPDATE SET
+               attempts = attempts + 1,
+               correct = correct + excluded.correct""",
+        (attempt["user_id"], day, correct)
+    )
+
+# ユーザーIDの分割読み出し
+def iter_user_chunks(table, chunk_size=None):
+    """
+    table に現れるユーザーIDを昇順に chunk_size 件（省略時は DB_MAINTENANCE_CHUNK 件）ずつ返す
+    チャンクごとに読み取り接続でキーセットページングするため、書き込みを長時間止めない
+    """
+    chunk_size = chunk_size or DB_MAINTENANCE_CHUNK
+    last_user_id = ""
+    while True:
+        with get_connection() as conn:
+            rows = conn.execute(
+                f"SELECT DISTINCT user_id FROM {table} WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (last_user_id, chunk_size)
+            ).fetchall()
+        if not rows:
+            return
+        chunk = [row[0] for row in rows]
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_user_id = chunk[-1]
+
+# 統計ロールアップの再集計（ユーザー指定）
+def _rebuild_rollups(conn, user_ids):
+    """指定ユーザーの統計ロールアップを解答記録から作り直し、集計したユーザー数を返す"""
+    where = f"WHERE user_id IN ({', '.join('?' * len(user_ids))})"
+    for table in ROLLUP_TABLES:
+        conn.execute(f"DELETE FROM {table} {where}", user_ids)
+    for sql in ROLLUP_REBUILD_SQL:
+        conn.execute(sql.format(where=where), user_ids)
+    return conn.execute(f"SELECT COUNT(*) FROM user_stats_overall {where}", user_ids).fetchone()[0]
+
+# 解答記録のないユーザーの統計ロールアップの削除
+def _drop_stale_rollups(conn, user_ids):
+    """指定ユーザーのうち、解答記録が1件もないユーザーの統計ロールアップを削除"""
+    stale = [
+        user_id for user_id in user_ids
+        if conn.execute("SELECT 1 FROM problem_attempts WHERE user_id = ? LIMIT 1", (user_id,)).fetchone() is None
+    ]
+    if stale:
+        _rebuild_rollups(conn, stale)
+
+# 全ユーザーの統計ロールアップの再集計
+def _rebuild_all_rollups():
+    """
+    全ユーザーの統計ロールアップを DB_MAINTENANCE_CHUNK 人ずつ別々のコミットで作り直す
+    各チャンクはユーザー単位で原子的に置き換えるため、並行して記録される解答とも整合する
+    """
+    rebuilt = 0
+    for chunk in iter_user_chunks("problem_attempts"):
+        rebuilt += run_write(lambda conn: _rebuild_rollups(conn, chunk))
+    # 解答記録が残っていないユーザーの集計を削除
+    for chunk in iter_user_chunks("user_stats_overall"):
+        run_write(lambda conn: _drop_stale_rollups(conn, chunk))
+    return rebuilt
+
+# 統計ロールアップの再構築
+def rebuild_user_stats(user_id=None):
+    """解答記録から統計ロールアップを再計算し、集計したユーザー数を返す（user_id省略時は全ユーザー）"""
+    try:
+        if user_id:
+            return run_write(lambda conn: _rebuild_rollups(conn, [user_id]))
+        return _rebuild_all_rollups()
     except sqlite3.Error as e:
-        logging.error(f"ユーザープロフィール保存エラー: {str(e)}")
+        logging.error(f"統計ロールアップ再構築エラー: {str(e)}")
+        return 0
+
+# 再採点対象の解答記録の取得
+def fetch_attempts_for_regrade(problem_id, after_attempt_id="", limit=5000):
+    """問題の解答記録を attempt_id が after_attempt_id より後のものから順に最大limit件取得"""
+    with get_connection() as conn:
+        return conn.execute(REGRADE_BATCH_SQL, (problem_id, after_attempt_id, limit)).fetchall()
+
+# 再採点結果の書き戻し
+def apply_regrade(changes):
+    """
+    正誤が変わった解答記録を一括で更新し、統計ロールアップの正解数も同じトランザクションで補正する
+    changes は (attempt_id, user_id, category, timestamp, duration, is_correct) のリスト
+    """
+    if not changes:
+        return 0
+    
+    def _write(conn):
+        conn.executemany(
+            "UPDATE problem_attempts SET is_correct = ? WHERE attempt_id = ?",
+            [(1 if correct else 0, attempt_id) for attempt_id, _, _, _, _, correct in changes]
+        )
+        overall = []
+        category = []
+        daily = []
+        for _, user_id, category_name, timestamp, duration, correct in changes:
+            delta = 1 if correct else -1
+            day = time.strftime("%Y-%m-%d", time.localtime(timestamp))
+            overall.append((delta, delta * (duration or 0), user_id))
+            category.append((delta, user_id, category_name))
+            daily.append((delta, user_id, day))
+        conn.executemany(
+            """UPDATE user_stats_overall SET correct_answers = correct_answers + ?,
+                   correct_duration_sum = correct_duration_sum + ? WHERE user_id = ?""",
+            overall
+        )
+        conn.executemany(
+            "UPDATE user_stats_category SET correct = correct + ? WHERE user_id = ? AND category = ?",
+            category
+        )
+        conn.executemany(
+            "UPDATE user_stats_daily SET correct = correct + ? WHERE user_id = ? AND day = ?",
+            daily
+        )
+        return len(changes)
+    
+    return run_write(_write)
+
+# 連続正解のリセット
+def reset_answer_streak(user_id):
+    """不正解時に連続正解数を0に戻す（画面を待たせないよう書き込みの完了は待たない）"""
+    try:
+        get_writer().submit(lambda conn: get_achievement_engine().reset_streak(conn, user_id))
+        return True
+    except sqlite3.Error as e:
+        logging.error(f"連続正解リセットエラー: {str(e)}")
         return False
 
+# バッジ判定状態の再構築
+def backfill_achievements(user_id=None):
+    """
+    解答履歴を再生してバッジ判定の累積状態を作り直す（user_id省略時は全ユーザー）
+    DB_MAINTENANCE_CHUNK 人ずつ別々のコミットで再生するため、途中で失敗しても再生済みのユーザーは残る
+    """
+    result = {"users": 0, "attempts": 0, "awarded": 0}
+    chunks = [[user_id]] if user_id else iter_user_chunks("problem_attempts")
+    try:
+        for chunk in chunks:
+            counts = run_write(lambda conn: get_achievement_engine().backfill(conn, chunk))
+            for key in result:
+                result[key] += counts[key]
+    except sqlite3.Error as e:
+        logging.error(f"バッジ判定状態の再構築エラー: {str(e)}")
+    return result
+
 # 問題解答記録の保存
 def save_problem_attempt(attempt):
-    """問題解答記録をデータベースに保存"""
+    """
+    問題解答記録をデータベースに保存
+    attempt["xp_reward"] があれば同じトランザクションでXP台帳に記録し、加算後のXPとレベルを
+    attempt["xp_points"], attempt["level"] に、新たに獲得したバッジIDの一覧を attempt["awarded_badges"] に設定する
+    """
+    xp_events = []
+    if attempt.get("xp_reward"):
+        xp_events.append({
+            "user_id": attempt["user_id"],
+            "delta": attempt["xp_reward"],
+            "reason": "problem_attempt",
+            "attempt_id": attempt["attempt_id"],
+            "category": attempt["category"],
+            "created_at": attempt["timestamp"]
+        })
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        def _write(conn):
             cursor = conn.cursor()
             
             cursor.execute(
@@ -248,131 +1134,375 @@ def save_problem_attempt(attempt):
                 )
             )
             
-            return True
+            # 統計ロールアップを同じトランザクションで更新
+            _update_rollups(conn, attempt)
+            
+            # 獲得XPは差分だけ台帳に記録して加算する
+            totals = {}
+            if xp_events:
+                totals = _apply_xp(conn, xp_events)
+            
+            # バッジ判定（失敗しても解答記録は残す）
+            conn.execute("SAVEPOINT achievements")
+            try:
+                awarded = get_achievement_engine().process(conn, attempt)
+                conn.execute("RELEASE achievements")
+            except Exception as e:
+                conn.execute("ROLLBACK TO achievements")
+                conn.execute("RELEASE achievements")
+                logging.error(f"バッジ判定エラー: {str(e)}")
+                awarded = []
+            return awarded, totals
+        
+        attempt["awarded_badges"], totals = run_write(_write)
+        xp_total = totals.get(attempt["user_id"])
+        if xp_events:
+            _count_xp_events(len(xp_events))
+            _publish_xp()
+        if xp_total:
+            attempt["xp_points"], attempt["level"] = xp_total
+        return True
     except sqlite3.Error as e:
         logging.error(f"問題解答記録エラー: {str(e)}")
         return False
 
+# セッション状態のUPSERT
+SESSION_UPSERT_SQL = """INSERT INTO sessions
+       (session_id, user_id, created_at, updated_at, category, problem_index, hint_step)
+       VALUES (?, ?, ?, ?, ?, ?, ?)
+       ON CONFLICT (session_id) DO UPDATE SET
+           updated_at = excluded.updated_at,
+           category = excluded.category,
+           problem_index = excluded.problem_index,
+           hint_step = excluded.hint_step"""
+
 # セッション保存
 def save_session(session_id, user_id, category, problem_idx, hint_step):
-    """セッションデータをデータベースに保存"""
+    """セッションデータをデータベースに保存（1回のUPSERTで、書き込み完了まで待つ）"""
     try:
         now = time.time()
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            
-            # セッション存在確認
-            cursor.execute("SELECT session_id FROM sessions WHERE session_id = ?", (session_id,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                # 既存セッション更新
-                cursor.execute(
-                    """UPDATE sessions SET  
-                       updated_at = ?,
-                       category = ?,
-                       problem_index = ?,
-                       hint_step = ?
-                       WHERE session_id = ?""",
-                    (now, category, problem_idx, hint_step, session_id)
-                )
-            else:
-                # 新規セッション作成
-                cursor.execute(
-                    """INSERT INTO sessions
-                       (session_id, user_id, created_at, updated_at, category, problem_index, hint_step)
-                       VALUES (?, ?, ?, ?, ?, ?, ?)""", 
-                    (session_id, user_id, now, now, category, problem_idx, hint_step)
-                )
-            
-            return True
+        run_write(lambda conn: conn.execute(
+            SESSION_UPSERT_SQL, (session_id, user_id, now, now, category, problem_idx, hint_step)
+        ))
+        return True
     except sqlite3.Error as e:
         logging.error(f"セッション保存エラー: {str(e)}")
         return False
 
-# チャットメッセージ保存
-def save_chat_messages(session_id, problem_id, messages):
-    """チャットメッセージをデータベースに保存"""
-    try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            
-            # 既存メッセージ削除
-            cursor.execute(
-                "DELETE FROM chat_history WHERE session_id = ? AND problem_id = ?",
+# セッション状態の書き込みバッファ
+class SessionBuffer:
+    """
+    セッション状態（カテゴリ・問題番号・ヒント段階）の変更をメモリ上でセッションごとにまとめ、
+    flush_interval 秒ごとに1回の書き込みジョブ（UPSERTのexecutemany）で書き出すライトビハインドバッファ
+    クリックのたびの書き込みは発生せず、最後の状態だけが保存される
+    ヒント段階の変更はタイマーだけが上限になり、プロセスが異常終了した場合は最大 flush_interval 秒分の変更が失われる
+    問題の切り替え（on_next_problem）ではそのセッションを flush するため、問題の進み具合は切り替えごとに保存される
+    （0なら変更ごとに同期書き込み）
+    """
+
+    def __init__(self, flush_interval: float = SESSION_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._stats = {"updates": 0, "flushes": 0, "rows": 0, "failures": 0}
+
+    def update(self, session_id, user_id, category, problem_idx, hint_step) -> bool:
+        """セッション状態の変更を記録する（同期書き込みの設定でなければ書き込みを待たない）"""
+        if self.flush_interval <= 0:
+            return save_session(session_id, user_id, category, problem_idx, hint_step)
+        with self._lock:
+            self._pending[session_id] = (user_id, category, problem_idx, hint_step, time.time())
+            self._stats["updates"] += 1
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        return True
+
+    def _flush_on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+        self.flush()
+
+    def flush(self, session_id=None, wait: bool = False) -> int:
+        """
+        溜まった変更を書き出し、書き出したセッション数を返す（session_id を指定するとそのセッションのみ）
+        wait=True ならコミット完了まで待つ。書き込みに失敗した変更は新しい変更がなければ次回に持ち越す
+        """
+        with self._lock:
+            if session_id is None:
+                pending, self._pending = self._pending, {}
+            elif session_id in self._pending:
+                pending = {session_id: self._pending.pop(session_id)}
+            else:
+                pending = {}
+        if not pending:
+            return 0
+
+        rows = [
+            (sid, user_id, updated_at, updated_at, category, problem_idx, hint_step)
+            for sid, (user_id, category, problem_idx, hint_step, updated_at) in pending.items()
+        ]
+        def _done(future):
+            if future.exception() is not None:
+                logging.error(f"セッション保存エラー: {str(future.exception())}")
+                self._requeue(pending)
+        
+        try:
+            job = lambda conn: conn.executemany(SESSION_UPSERT_SQL, rows)
+            if wait:
+                run_write(job)
+            else:
+                get_writer().submit(job).add_done_callback(_done)
+        except sqlite3.Error as e:
+            logging.error(f"セッション保存エラー: {str(e)}")
+            self._requeue(pending)
+            return 0
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["rows"] += len(rows)
+        return len(rows)
+
+    def _requeue(self, pending) -> None:
+        """書き込めなかった変更を、より新しい変更がないセッションについてバッファに戻す"""
+        with self._lock:
+            self._stats["failures"] += 1
+            for sid, state in pending.items():
+                self._pending.setdefault(sid, state)
+            if self._pending and self._timer is None and self.flush_interval > 0:
+                self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def close(self) -> None:
+        """タイマーを止め、残っている変更を同期的に書き出す（プロセス終了時）"""
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        self.flush(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """記録した変更数・書き込み回数・書き出した行数・未書き出しのセッション数を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+            return stats
+
+_session_buffer = None
+
+# 共有セッションバッファの取得
+def get_session_buffer() -> SessionBuffer:
+    """プロセス共通のセッション状態バッファを取得（終了時に残りを書き出す）"""
+    global _session_buffer
+    if _session_buffer is None:
+        # 終了処理はライターより後に登録し、ライターの停止前に書き出す
+        get_writer()
+        with _pool_lock:
+            if _session_buffer is None:
+                _session_buffer = SessionBuffer()
+                atexit.register(_session_buffer.close)
+    return _session_buffer
+
+# セッション状態の更新（ライトビハインド）
+def buffer_session(session_id, user_id, category, problem_idx, hint_step):
+    """セッション状態の変更をバッファに記録し、SESSION_FLUSH_INTERVAL 秒以内にまとめて保存する"""
+    return get_session_buffer().update(session_id, user_id, category, problem_idx, hint_step)
+
+# セッション状態の書き出し
+def flush_sessions(session_id=None, wait=False):
+    """バッファに溜まったセッション状態を書き出し、書き出したセッション数を返す"""
+    return get_session_buffer().flush(session_id, wait)
+
+# 永続化済み件数（(テーブル, session_id) -> (problem_id, 件数)、LRUで上限を設ける）
+# セッションが別の問題に移ると前の問題の件数は上書きされる
+_persisted_counts = OrderedDict()
+_persisted_counts_lock = threading.Lock()
+
+# 永続化済み件数の取得
+def _get_persisted_count(table, session_id, problem_id):
+    """キャッシュ済みの件数を取得（なければNone）"""
+    with _persisted_counts_lock:
+        entry = _persisted_counts.get((table, session_id))
+        if entry is None or entry[0] != problem_id:
+            return None
+        _persisted_counts.move_to_end((table, session_id))
+        return entry[1]
+
+# 永続化済み件数の更新
+def _set_persisted_count(table, session_id, problem_id, count):
+    """件数をキャッシュし、上限を超えた古いセッションを破棄"""
+    with _persisted_counts_lock:
+        _persisted_counts[(table, session_id)] = (problem_id, count)
+        _persisted_counts.move_to_end((table, session_id))
+        while len(_persisted_counts) > DB_PERSISTED_COUNTS_SIZE:
+            _persisted_counts.popitem(last=False)
+
+# 永続化済み件数の破棄
+def _forget_persisted_count(table, session_id):
+    with _persisted_counts_lock:
+        _persisted_counts.pop((table, session_id), None)
+
+# 差分のみの追記
+def _append_rows(conn, table, session_id, problem_id, items, to_row, columns):
+    """前回保存した件数以降の要素だけをexecutemanyで追記する"""
+    persisted = _get_persisted_count(table, session_id, problem_id)
+    if persisted is None:
+        # 初回はデータベースの既存件数から再開
+        persisted = conn.execute(
+            f"SELECT COUNT(*) FROM {table} WHERE session_id = ? AND problem_id = ?",
+            (session_id, problem_id)
+        ).fetchone()[0]
+    
+    if persisted > len(items):
+        # 履歴が短くなった場合は全件を書き直す
+        conn.execute(
+            f"DELETE FROM {table} WHERE session_id = ? AND problem_id = ?",
+            (session_id, problem_id)
+        )
+        persisted = 0
+    
+    new_rows = [to_row(i, item) for i, item in enumerate(items[persisted:], start=persisted)]
+    if new_rows:
+        placeholders = ", ".join("?" for _ in columns)
+        conn.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+            new_rows
+        )
+    
+    _set_persisted_count(table, session_id, problem_id, len(items))
+    return len(new_rows)
+
+# 差分保存の書き込みジョブ作成
+def _incremental_job(table, session_id, problem_id, items, to_row, columns, append_only):
+    """追記モードまたは全件置換モードで保存する書き込みジョブを作成（保存済みなら None）"""
+    if append_only and _get_persisted_count(table, session_id, problem_id) == len(items):
+        # 新しい要素がなければ書き込みスレッドに投げない
+        return None
+    
+    def _write(conn):
+        if not append_only:
+            # 全件置換モード: 既存行を削除してから全件を追記
+            conn.execute(
+                f"DELETE FROM {table} WHERE session_id = ? AND problem_id = ?",
                 (session_id, problem_id)
             )
-            
-            # 新しいメッセージを挿入
-            for msg in messages:
-                cursor.execute(
-                    """INSERT INTO chat_history
-                       (session_id, problem_id, role, content, timestamp)
-                       VALUES (?, ?, ?, ?, ?)""",
-                    (session_id, problem_id, msg["role"], msg["text"], msg.get("timestamp", time.time()))
-                )
-            
-            return True
+            _set_persisted_count(table, session_id, problem_id, 0)
+        return _append_rows(conn, table, session_id, problem_id, items, to_row, columns)
+    
+    return _write
+
+# 差分保存の実行
+def _run_incremental(jobs):
+    """(テーブル, session_id, ジョブ) の並びを1回の書き込みでまとめて実行し、追記件数の合計を返す"""
+    jobs = [(table, session_id, job) for table, session_id, job in jobs if job is not None]
+    if not jobs:
+        return 0
+    try:
+        return run_write(lambda conn: sum(job(conn) for _, _, job in jobs))
+    except sqlite3.Error:
+        # 失敗時は件数キャッシュを破棄し、次回データベースから再取得
+        for table, session_id, _ in jobs:
+            _forget_persisted_count(table, session_id)
+        raise
+
+# チャットメッセージの書き込みジョブ
+def _chat_job(session_id, problem_id, messages, append_only):
+    now = time.time()
+    return _incremental_job(
+        "chat_history", session_id, problem_id, messages,
+        lambda i, msg: (session_id, problem_id, msg["role"], msg["text"], msg.get("timestamp", now)),
+        ("session_id", "problem_id", "role", "content", "timestamp"),
+        append_only
+    )
+
+# 思考ログの書き込みジョブ
+def _thought_job(session_id, problem_id, thoughts, append_only):
+    now = time.time()
+    return _incremental_job(
+        "thought_logs", session_id, problem_id, thoughts,
+        lambda i, thought: (session_id, problem_id, thought, now - (len(thoughts) - i)),
+        ("session_id", "problem_id", "content", "timestamp"),
+        append_only
+    )
+
+# チャットメッセージ保存
+def save_chat_messages(session_id, problem_id, messages, append_only=True):
+    """
+    チャットメッセージをデータベースに保存
+    append_only=Trueの場合は前回保存分以降のメッセージのみを追記する
+    """
+    try:
+        _run_incremental([("chat_history", session_id, _chat_job(session_id, problem_id, messages, append_only))])
+        return True
     except sqlite3.Error as e:
         logging.error(f"チャット履歴保存エラー: {str(e)}")
         return False
 
 # 思考ログ保存
-def save_thought_logs(session_id, problem_id, thoughts):
-    """思考ログをデータベースに保存"""
+def save_thought_logs(session_id, problem_id, thoughts, append_only=True):
+    """
+    思考ログをデータベースに保存
+    append_only=Trueの場合は前回保存分以降の思考ログのみを追記する
+    """
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            
-            # 既存思考ログ削除
-            cursor.execute(
-                "DELETE FROM thought_logs WHERE session_id = ? AND problem_id = ?",
-                (session_id, problem_id)
-            )
-            
-            # 新しい思考ログを挿入
-            for i, thought in enumerate(thoughts):
-                cursor.execute(
-                    """INSERT INTO thought_logs
-                       (session_id, problem_id, content, timestamp) 
-                       VALUES (?, ?, ?, ?)""",
-                    (session_id, problem_id, thought, time.time() - (len(thoughts) - i))
-                )
-            
-            return True
+        _run_incremental([("thought_logs", session_id, _thought_job(session_id, problem_id, thoughts, append_only))])
+        return True
     except sqlite3.Error as e:
         logging.error(f"思考ログ保存エラー: {str(e)}")
         return False
 
+# チャット履歴と思考ログの一括保存
+def flush_session_logs(session_id, problem_id, messages, thoughts, append_only=True):
+    """
+    チャット履歴と思考ログの未保存分を1回の書き込み（1トランザクション）でまとめて保存
+    どちらも保存済みであればデータベースに触れない
+    """
+    try:
+        _run_incremental([
+            ("chat_history", session_id, _chat_job(session_id, problem_id, messages, append_only)),
+            ("thought_logs", session_id, _thought_job(session_id, problem_id, thoughts, append_only)),
+        ])
+        return True
+    except sqlite3.Error as e:
+        logging.error(f"ログ一括保存エラー: {str(e)}")
+        return False
+
 # ユーザー統計の取得
 def get_user_stats(user_id):
     """ユーザー統計データをデータベースから取得"""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_connection() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
-            # 全体統計
+            # 全体統計（ロールアップから1行で取得）
             cursor.execute(
-                """SELECT 
-                   COUNT(*) as total_attempts,
-                   SUM(CASE WHEN is_correct = 1 THEN 1 ELSE 0 END) as correct_answers,
-                   AVG(CASE WHEN is_correct = 1 THEN duration ELSE NULL END) as avg_correct_time,
-                   SUM(hints_used) as total_hints,
-                   AVG(thought_length) as avg_thought_length  
-                   FROM problem_attempts
-                   WHERE user_id = ?""",
+                "SELECT * FROM user_stats_overall WHERE user_id = ?",
                 (user_id,)
             )
             
             overall_row = cursor.fetchone()
-            overall = dict(overall_row) if overall_row else {
-                "total_attempts": 0,
-                "correct_answers": 0,
-                "avg_correct_time": 0,
-                "total_hints": 0,
-                "avg_thought_length": 0
-            }
+            if overall_row and overall_row["total_attempts"]:
+                overall = {
+                    "total_attempts": overall_row["total_attempts"],
+                    "correct_answers": overall_row["correct_answers"],
+                    "avg_correct_time": (
+                        overall_row["correct_duration_sum"] / overall_row["correct_answers"]
+                        if overall_row["correct_answers"] else 0
+                    ),
+                    "total_hints": overall_row["total_hints"],
+                    "avg_thought_length": overall_row["thought_length_sum"] / overall_row["total_attempts"]
+                }
+            else:
+                overall = {
+                    "total_attempts": 0,
+                    "correct_answers": 0,
+                    "avg_correct_time": 0,
+                    "total_hints": 0,
+                    "avg_thought_length": 0
+                }
             
             # 成功率の計算
             if overall["total_attempts"]:
@@ -382,13 +1512,9 @@ def get_user_stats(user_id):
                 
             # カテゴリ別分析
             cursor.execute(
-                """SELECT 
-                   category,
-                   COUNT(*) as attempts,
-                   SUM(CASE WHEN is_correct = 1 THEN 1 ELSE 0 END) as correct
-                   FROM problem_attempts
-                   WHERE user_id = ?
-                   GROUP BY category""",
+                """SELECT category, attempts, correct
+                   FROM user_stats_category
+                   WHERE user_id = ?""",
                 (user_id,)
             )
             
@@ -406,15 +1532,11 @@ def get_user_stats(user_id):
             recent = [dict(row) for row in cursor.fetchall()]
             
             # 過去30日の日別活動
-            thirty_days_ago = time.time() - (30 * 24 * 60 * 60) 
+            thirty_days_ago = time.strftime("%Y-%m-%d", time.localtime(time.time() - (30 * 24 * 60 * 60)))
             cursor.execute(
-                """SELECT 
-                   date(datetime(timestamp, 'unixepoch', 'localtime')) as day,  
-                   COUNT(*) as attempts,
-                   SUM(CASE WHEN is_correct = 1 THEN 1 ELSE 0 END) as correct
-                   FROM problem_attempts
-                   WHERE user_id = ? AND timestamp >= ?
-                   GROUP BY day
+                """SELECT day, attempts, correct
+                   FROM user_stats_daily
+                   WHERE user_id = ? AND day >= ?
                    ORDER BY day""",
                 (user_id, thirty_days_ago)
             )
@@ -441,4 +1563,50 @@ def get_user_stats(user_id):
             "categories": [],
             "recent": [],
             "daily": []
-        }
\ No newline at end of file
+        }
+
+# ランキングの取得
+def get_leaderboard_view(user_id, board="overall", limit=10):
+    """ランキングの上位 limit 人（ユーザー名付き）と、指定ユーザーの順位を取得"""
+    sync_leaderboard()
+    leaderboard = get_leaderboard()
+    top = leaderboard.top(board, limit)
+    names = {}
+    if top:
+        try:
+            with get_connection() as conn:
+                user_ids = [entry["user_id"] for entry in top]
+                rows = conn.execute(
+                    f"SELECT user_id, username FROM users WHERE user_id IN ({', '.join('?' * len(user_ids))})",
+                    user_ids
+                ).fetchall()
+                names = {row[0]: row[1] for row in rows}
+        except sqlite3.Error as e:
+            logging.error(f"ランキング取得エラー: {str(e)}")
+    for entry in top:
+        entry["username"] = names.get(entry["user_id"], entry["user_id"])
+    return {"top": top, "rank": leaderboard.rank(user_id, board)}
+
+# コマンドラインからの実行
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="思考力マスター データベース管理")
+    parser.add_argument("command", choices=["migrate", "rebuild-stats", "backfill-badges", "compact-xp"], help="実行するコマンド")
+    parser.add_argument("--user-id", help="rebuild-stats / backfill-badges の対象ユーザー（省略時は全ユーザー）")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "migrate":
+        init_database()
+        print(f"スキーマバージョン: {apply_migrations()}")
+    elif args.command == "rebuild-stats":
+        init_database()
+        print(f"再集計したユーザー数: {rebuild_user_stats(args.user_id)}")
+    elif args.command == "backfill-badges":
+        init_database()
+        result = backfill_achievements(args.user_id)
+        print(f"再生した解答記録: {result['attempts']}件 / ユーザー: {result['users']}人 / 付与したバッジ: {result['awarded']}個")
+    elif args.command == "compact-xp":
+        init_database()
+        print(f"集約したXPイベント: {compact_xp_events()}件")
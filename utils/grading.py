@@ -0,0 +1,342 @@
+import os
+import re
+import math
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.helpers import normalize_text, normalize_choices, safe_eval
+from utils.database import fetch_attempts_for_regrade, apply_regrade
+
+# 定数
+GRADING_TOLERANCE = float(os.getenv("GRADING_TOLERANCE", "0.01"))  # 数値回答の許容誤差
+GRADING_BATCH_SIZE = int(os.getenv("GRADING_BATCH_SIZE", "5000"))  # 再採点で1度に読み書きする行数
+ANSWER_KEY_CACHE_SIZE = 1024
+APPROXIMATE_TOLERANCE_RATIO = float(os.getenv("APPROXIMATE_TOLERANCE_RATIO", "0.01"))  # 「約」付き回答に許す相対誤差
+NUMERIC_PARSE_CACHE_SIZE = int(os.getenv("NUMERIC_PARSE_CACHE_SIZE", "8192"))  # 数値回答の解析結果のキャッシュ件数
+NUMERIC_ANSWER_MAX_LENGTH = 64  # これより長い回答は数値として解析しない
+
+# 数値回答の表記
+APPROXIMATE_PREFIXES = ("約", "およそ", "おおよそ", "だいたい", "大体", "ほぼ", "概ね", "おおむね", "≒")
+APPROXIMATE_SUFFIXES = ("くらい", "ぐらい", "程度", "前後", "ほど")
+RANGE_PATTERN = re.compile(r"[~〜]|から")
+KANJI_DIGITS = str.maketrans("〇零一二三四五六七八九", "00123456789")
+SMALL_UNITS = {"十": 10, "百": 100, "千": 1000}
+LARGE_UNITS = {"万": 10 ** 4, "億": 10 ** 8, "兆": 10 ** 12}
+JAPANESE_NUMBER_PATTERN = re.compile(r"[0-9.〇零一二三四五六七八九十百千万億兆]+")
+JAPANESE_NUMBER_SYNTAX = re.compile(r"(?:\d+(?:\.\d+)?[十百千万億兆]?|[十百千万億兆])+")
+JAPANESE_NUMBER_PART = re.compile(r"(\d+(?:\.\d+)?)?([十百千万億兆])?")
+# 数値部分（数字・漢数字・閉じ括弧で終わる）と末尾の単位に分ける
+UNIT_PATTERN = re.compile(r"(?P<number>.*?[0-9〇零一二三四五六七八九十百千万億兆)])(?P<unit>[^0-9)〇零一二三四五六七八九十百千万億兆]*)")
+PLAIN_NUMBER_PATTERN = re.compile(r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)(?:e[+-]?\d+)?")
+EXPRESSION_PATTERN = re.compile(r"[0-9.+\-*/×÷^()e]+")
+CURRENCY_SYMBOLS = {"¥": "円", "$": "ドル", "£": "£", "€": "ユーロ"}
+
+# 単位の表記ゆれと換算（正規化後の表記 -> (基準単位, 基準単位への倍率)）
+# 表にない単位は表記が一致する場合のみ同じ単位とみなす
+UNIT_CONVERSIONS = {
+    "円": ("円", 1), "万円": ("円", 10 ** 4), "億円": ("円", 10 ** 8),
+    "ポンド": ("lb", 1), "lb": ("lb", 1), "lbs": ("lb", 1),
+    "g": ("g", 1), "グラム": ("g", 1), "kg": ("g", 1000), "キロ": ("g", 1000), "キログラム": ("g", 1000),
+    "m": ("m", 1), "メートル": ("m", 1), "cm": ("m", 0.01), "センチ": ("m", 0.01), "mm": ("m", 0.001),
+    "km": ("m", 1000), "キロメートル": ("m", 1000),
+    "秒": ("秒", 1), "分": ("秒", 60), "時間": ("秒", 3600),
+    "%": ("%", 1), "パーセント": ("%", 1),
+}
+
+# 採点用に前処理した正解
+@dataclass(frozen=True)
+class AnswerKey:
+    """問題の正解を、回答と直接比較できる形に正規化したもの"""
+    answer_type: str
+    numeric: float = math.nan
+    texts: FrozenSet[str] = frozenset()
+    tolerance: float = GRADING_TOLERANCE
+    unit: str = ""  # 正解値の単位（空なら単位を問わない）
+
+# 解析済みの数値回答
+@dataclass(frozen=True)
+class NumericAnswer:
+    """数値回答の正規形（範囲の場合は value が中央値、low/high が両端）"""
+    value: float
+    low: float
+    high: float
+    unit: str = ""
+    approximate: bool = False
+
+# 漢数字の読み取り
+def _parse_japanese_number(token: str) -> Optional[float]:
+    """「1万5千」「三百二十」「2.5億」のような漢数字混じりの数を読み取る"""
+    token = token.translate(KANJI_DIGITS)
+    if not JAPANESE_NUMBER_SYNTAX.fullmatch(token):
+        return None
+    total = 0.0
+    section = 0.0
+    for number, unit in JAPANESE_NUMBER_PART.findall(token):
+        if not number and not unit:
+            continue
+        if unit in SMALL_UNITS:
+            section += (float(number) if number else 1) * SMALL_UNITS[unit]
+        elif unit in LARGE_UNITS:
+            section += float(number) if number else 0
+            total += (section or 1) * LARGE_UNITS[unit]
+            section = 0.0
+        else:
+            section += float(number)
+    return total + section
+
+# 漢数字の展開
+def _expand_japanese_numbers(text: str) -> Optional[str]:
+    """式の中の漢数字混じりの数をアラビア数字に置き換える（読めない数があればNone）"""
+    failed = False
+
+    def _replace(match):
+        nonlocal failed
+        token = match.group(0)
+        if token.replace(".", "").isdigit():
+            return token
+        value = _parse_japanese_number(token)
+        if value is None:
+            failed = True
+            return token
+        return repr(value)
+
+    expanded = JAPANESE_NUMBER_PATTERN.sub(_replace, text)
+    return None if failed else expanded
+
+# 単位の換算比
+def _unit_ratio(unit: str, target: str) -> Optional[float]:
+    """unit の値を target の値に換算する倍率（同じ次元の単位でなければNone）"""
+    if unit == target:
+        return 1.0
+    base, factor = UNIT_CONVERSIONS.get(unit, (unit, 1))
+    target_base, target_factor = UNIT_CONVERSIONS.get(target, (target, 1))
+    return factor / target_factor if base == target_base else None
+
+# 単一の数値の読み取り
+def _parse_single(text: str) -> Optional[Tuple[float, str]]:
+    """単位付きの数・漢数字・式を (値, 単位) に変換する"""
+    currency = ""
+    if text[:1] in CURRENCY_SYMBOLS:
+        currency, text = CURRENCY_SYMBOLS[text[0]], text[1:]
+    match = UNIT_PATTERN.fullmatch(text)
+    if not match:
+        return None
+    expression = _expand_japanese_numbers(match.group("number"))
+    if expression is None:
+        return None
+    if PLAIN_NUMBER_PATTERN.fullmatch(expression):
+        value = float(expression)
+    elif EXPRESSION_PATTERN.fullmatch(expression):
+        # 「10000÷150」のような式は制限付きの safe_eval で評価する
+        value = safe_eval(expression)
+        if value is None:
+            return None
+        value = float(value)
+    else:
+        return None
+    if not math.isfinite(value):
+        return None
+    return value, match.group("unit") or currency
+
+# 数値回答の解析（キャッシュ付き）
+@lru_cache(maxsize=NUMERIC_PARSE_CACHE_SIZE)
+def _parse_numeric_cached(text: str) -> Optional[NumericAnswer]:
+    """正規化済みの回答を NumericAnswer に変換する"""
+    text = text.replace(",", "").replace(" ", "")
+    approximate = False
+    for prefix in APPROXIMATE_PREFIXES:
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+            approximate = True
+            break
+    for suffix in APPROXIMATE_SUFFIXES:
+        if text.endswith(suffix):
+            text = text[:-len(suffix)]
+            approximate = True
+            break
+    if text.endswith("まで"):
+        text = text[:-2]
+
+    parts = RANGE_PATTERN.split(text)
+    if len(parts) > 2:
+        return None
+    parsed = [_parse_single(part) for part in parts]
+    if any(p is None for p in parsed):
+        return None
+    # 「1〜2kg」のように単位が片側だけなら両端に同じ単位を使う
+    unit = parsed[-1][1] or parsed[0][1]
+    if any(u and u != unit for _, u in parsed):
+        return None
+    values = [value for value, _ in parsed]
+    low, high = min(values), max(values)
+    return NumericAnswer((low + high) / 2, low, high, unit, approximate)
+
+# 数値回答の解析
+def parse_numeric_answer(text: Any) -> Optional[NumericAnswer]:
+    """
+    「66.7ポンド」「1万円」「10000÷150」「約67」「66〜67」のような回答を数値の正規形に変換する
+    解析結果は回答の文字列ごとにキャッシュする（読み取れない場合はNone）
+    """
+    if isinstance(text, (int, float)) and not isinstance(text, bool):
+        value = float(text)
+        return NumericAnswer(value, value, value) if math.isfinite(value) else None
+    if not isinstance(text, str) or not text or len(text) > NUMERIC_ANSWER_MAX_LENGTH:
+        return None
+    normalized = normalize_text(text)
+    if not normalized:
+        return None
+    return _parse_numeric_cached(normalized)
+
+# 数値の読み取り
+def parse_number(text: Any) -> float:
+    """回答を数値として読み取る（読み取れない場合はNaN）"""
+    parsed = parse_numeric_answer(text)
+    return parsed.value if parsed else math.nan
+
+# 正解の前処理（キャッシュ付き）
+@lru_cache(maxsize=ANSWER_KEY_CACHE_SIZE)
+def _build_answer_key(answer_type: str, correct: Any, tolerance: float, unit: Optional[str] = None) -> AnswerKey:
+    """正解値を正規化して AnswerKey を作る"""
+    if correct is None:
+        return AnswerKey(answer_type, tolerance=tolerance)
+    if answer_type == "numeric":
+        parsed = parse_numeric_answer(correct)
+        if parsed is None:
+            return AnswerKey(answer_type, tolerance=tolerance)
+        unit = normalize_text(unit) if unit else parsed.unit
+        return AnswerKey(answer_type, numeric=parsed.value, tolerance=tolerance, unit=unit)
+    choices = correct if isinstance(correct, tuple) else (correct,)
+    texts = normalize_choices(choices)
+    return AnswerKey(answer_type, texts=texts - {""}, tolerance=tolerance)
+
+# 問題の正解の取得
+def get_answer_key(problem, tolerance: Optional[float] = None) -> AnswerKey:
+    """問題の正解を採点用に前処理する（正解値ごとにキャッシュされる）"""
+    correct = problem.correct_answer
+    if isinstance(correct, list):
+        correct = tuple(correct)
+    if tolerance is None:
+        # 問題ごとの許容誤差があればそれを使う
+        tolerance = problem.tolerance if getattr(problem, "tolerance", None) is not None else GRADING_TOLERANCE
+    return _build_answer_key(problem.answer_type, correct, float(tolerance), getattr(problem, "unit", None))
+
+# 数値回答の比較用の範囲
+def _numeric_bounds(key: AnswerKey, answer: Any) -> Tuple[float, float, bool]:
+    """
+    回答を正解の単位に換算した (下限, 上限, 概数か) を返す
+    単位のない回答は正解と同じ単位とみなし、換算できない単位の回答・読み取れない回答は (NaN, NaN, False)
+    """
+    parsed = parse_numeric_answer(answer)
+    if parsed is None:
+        return math.nan, math.nan, False
+    if not parsed.unit or not key.unit:
+        return parsed.low, parsed.high, parsed.approximate
+    ratio = _unit_ratio(parsed.unit, key.unit)
+    if ratio is None:
+        return math.nan, math.nan, False
+    return parsed.low * ratio, parsed.high * ratio, parsed.approximate
+
+# 一意な回答の採点
+def _grade_unique(key: AnswerKey, answers: List[Any]) -> np.ndarray:
+    """重複を除いた回答を採点して真偽値の配列を返す"""
+    if key.answer_type == "numeric":
+        if math.isnan(key.numeric):
+            return np.zeros(len(answers), dtype=bool)
+        bounds = np.array([_numeric_bounds(key, a) for a in answers], dtype=np.float64).reshape(-1, 3)
+        # 「約」付きの回答は正解値に対する相対誤差まで許す
+        tolerance = np.where(bounds[:, 2] > 0,
+                             np.maximum(key.tolerance, abs(key.numeric) * APPROXIMATE_TOLERANCE_RATIO),
+                             key.tolerance)
+        # 範囲の回答は、正解値を含み、かつ幅が許容誤差の範囲（2×許容誤差）に収まる場合のみ正解
+        # （NaN＝読み取れない回答・単位の異なる回答は比較結果が False になる）
+        return ((bounds[:, 0] - tolerance <= key.numeric) & (key.numeric <= bounds[:, 1] + tolerance)
+                & (bounds[:, 1] - bounds[:, 0] <= 2 * tolerance))
+    return np.fromiter(
+        (normalize_text(a) in key.texts if isinstance(a, str) else False for a in answers),
+        dtype=bool, count=len(answers)
+    )
+
+# 回答の一括採点
+def grade_answers(problem, answers: Sequence[Any], tolerance: Optional[float] = None) -> np.ndarray:
+    """
+    1つの問題に対する回答の配列をまとめて採点し、真偽値の配列を返す
+    同じ回答は1度だけ正規化し、数値の許容誤差はNumPyでまとめて判定する
+    """
+    key = get_answer_key(problem, tolerance)
+    index: Dict[Any, int] = {}
+    inverse = np.fromiter(
+        (index.setdefault(a, len(index)) for a in answers),
+        dtype=np.int64, count=len(answers)
+    )
+    if not index:
+        return np.zeros(0, dtype=bool)
+    return _grade_unique(key, list(index))[inverse]
+
+# 単一回答の採点
+def grade_answer(problem, answer: Any, tolerance: Optional[float] = None) -> bool:
+    """1件の回答を採点する（画面からの回答もバッチ採点と同じ規則で判定する）"""
+    if answer is None or (isinstance(answer, str) and not answer.strip()):
+        return False
+    return bool(grade_answers(problem, [answer], tolerance)[0])
+
+# 解答記録の再採点（再開可能なストリーミング）
+def iter_regrade(problem, batch_size: int = GRADING_BATCH_SIZE, resume_after: str = "",
+                 tolerance: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """
+    問題の解答記録を attempt_id 順にバッチで読み、採点し直して正誤が変わった行だけ書き戻す
+    バッチごとに進捗を返すので、中断した場合は last_attempt_id を resume_after に渡して再開できる
+    """
+    last_attempt_id = resume_after or ""
+    scanned = 0
+    changed = 0
+    while True:
+        rows = fetch_attempts_for_regrade(problem.id, last_attempt_id, batch_size)
+        if not rows:
+            break
+        grades = grade_answers(problem, [row[6] for row in rows], tolerance)
+        current = np.fromiter((bool(row[5]) for row in rows), dtype=bool, count=len(rows))
+        changes = [
+            (rows[i][0], rows[i][1], rows[i][2], rows[i][3], rows[i][4], bool(grades[i]))
+            for i in np.flatnonzero(grades != current)
+        ]
+        # 書き戻しと統計の補正は1バッチ1トランザクション（途中で止まっても整合性が保たれる）
+        apply_regrade(changes)
+        last_attempt_id = rows[-1][0]
+        scanned += len(rows)
+        changed += len(changes)
+        yield {"last_attempt_id": last_attempt_id, "scanned": scanned, "changed": changed}
+        if len(rows) < batch_size:
+            break
+
+# 解答記録の再採点
+def regrade_problem(problem, batch_size: int = GRADING_BATCH_SIZE, resume_after: str = "",
+                    tolerance: Optional[float] = None) -> Dict[str, Any]:
+    """問題の解答記録をすべて再採点し、最終的な進捗（走査件数・変更件数）を返す"""
+    progress = {"last_attempt_id": resume_after or "", "scanned": 0, "changed": 0}
+    for progress in iter_regrade(problem, batch_size, resume_after, tolerance):
+        logging.info(f"再採点の進捗: {progress}")
+    return progress
+
+# コマンドラインからの実行
+if __name__ == "__main__":
+    import argparse
+    from utils.database import init_database
+    from utils.problem_bank import get_catalog
+
+    parser = argparse.ArgumentParser(description="思考力マスター 再採点")
+    parser.add_argument("problem_id", help="再採点する問題ID")
+    parser.add_argument("--resume-after", default="", help="この attempt_id の次から再開する")
+    parser.add_argument("--batch-size", type=int, default=GRADING_BATCH_SIZE, help="1度に処理する行数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    init_database()
+    problem = get_catalog().get(args.problem_id)
+    if problem is None:
+        parser.error(f"問題が見つかりません: {args.problem_id}")
+    result = regrade_problem(problem, args.batch_size, args.resume_after)
+    print(f"走査: {result['scanned']}件 / 変更: {result['changed']}件 / 最終ID: {result['last_attempt_id']}")
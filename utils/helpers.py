@@ -1,13 +1,17 @@
 import streamlit as st
 import ast
 import operator as op
-import re
 import time
+import unicodedata
 import uuid
 import json
 import numpy as np
 import logging
-from typing import Dict, Any, Optional, List, Union
+import os
+import threading
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, Any, Optional, List, Union, Callable, Tuple, Sequence
 
 # 定数
 APP_NAME = "思考力マスター"
@@ -15,6 +19,26 @@ APP_VERSION = "1.0.1"
 THEME_COLOR = "#4F8BF9"
 MAX_HINT = 3
 
+# 数式評価の制限
+SAFE_EVAL_CACHE_SIZE = int(os.getenv("SAFE_EVAL_CACHE_SIZE", "1024"))  # コンパイル済み式のキャッシュ件数
+SAFE_EVAL_MAX_LENGTH = 200  # 式の最大文字数
+SAFE_EVAL_MAX_NODES = 64  # 式に含められるASTノード数の上限
+SAFE_EVAL_MAX_EXPONENT = 64  # べき乗の指数の絶対値の上限
+SAFE_EVAL_MAX_BITS = 1024  # 整数の計算結果のビット長の上限
+SAFE_EVAL_TIMEOUT = float(os.getenv("SAFE_EVAL_TIMEOUT", "0.05"))  # 1回の評価に許す秒数
+
+# テキスト正規化
+NORMALIZE_CACHE_SIZE = int(os.getenv("NORMALIZE_CACHE_SIZE", "8192"))  # 正規化結果のキャッシュ件数
+NORMALIZE_CACHE_MAX_LENGTH = 256  # これより長いテキストはキャッシュしない
+# NFKCで畳み込まれないダッシュ・マイナス記号をASCIIのハイフンにそろえる
+NORMALIZE_TABLE = str.maketrans({
+    '\u2010': '-',  # ハイフン
+    '\u2011': '-',  # ノーブレークハイフン
+    '\u2012': '-',  # フィギュアダッシュ
+    '\u2013': '-',  # エンダッシュ
+    '\u2212': '-',  # マイナス記号
+})
+
 # 数式演算に使用する演算子マッピング
 OPS = {
     ast.Add: op.add, 
@@ -25,6 +49,19 @@ OPS = {
     ast.Pow: op.pow
 }
 
+# ユーザーレベル（レベル番号 -> 名前・アイコン・必要XP）
+USER_LEVELS = {
+    0: {"name": "初心者", "icon": "🌱", "req": 0},
+    1: {"name": "探究者", "icon": "🔍", "req": 100},
+    2: {"name": "思考家", "icon": "💭", "req": 300},
+    3: {"name": "分析者", "icon": "📊", "req": 600},
+    4: {"name": "論理家", "icon": "⚖️", "req": 1000},
+    5: {"name": "戦略家", "icon": "♟️", "req": 1500},
+    6: {"name": "賢者", "icon": "🧠", "req": 2500}
+}
+LEVEL_CURVE_MAX_LEVEL = int(os.getenv("LEVEL_CURVE_MAX_LEVEL", str(max(USER_LEVELS))))  # USER_LEVELSより上のレベルは自動で延長
+LEVEL_CURVE_GROWTH = float(os.getenv("LEVEL_CURVE_GROWTH", "1.5"))  # 延長するレベルごとの必要XP差の伸び率
+
 # カテゴリアイコン
 CATEGORY_ICONS = {
     "数で考える力": "🔢",
@@ -110,6 +147,74 @@ def apply_custom_css():
     </style>
     """, unsafe_allow_html=True)
 
+# 数式評価の制限違反
+class EvalLimitError(ValueError):
+    """数式が評価の制限（指数・桁数・ノード数・時間）を超えた"""
+
+# 計算結果の大きさの確認
+def _check_magnitude(value, deadline: float):
+    """整数の桁数と経過時間が制限内かを確認して値を返す"""
+    if isinstance(value, complex):
+        raise ValueError("計算結果が実数になりません")
+    if isinstance(value, int) and value.bit_length() > SAFE_EVAL_MAX_BITS:
+        raise EvalLimitError(f"計算結果が大きすぎます（{SAFE_EVAL_MAX_BITS}ビット超）")
+    if time.perf_counter() > deadline:
+        raise EvalLimitError("評価時間の上限を超えました")
+    return value
+
+# 制限付きのべき乗
+def _limited_pow(base, exponent, deadline: float):
+    """指数の大きさを確認してからべき乗を計算する"""
+    if abs(exponent) > SAFE_EVAL_MAX_EXPONENT:
+        raise EvalLimitError(f"指数が大きすぎます: {exponent}")
+    return _check_magnitude(op.pow(base, exponent), deadline)
+
+# ASTノードのコンパイル
+def _compile_node(node) -> Callable[[float], Any]:
+    """検証済みのASTノードを、締め切り時刻を受け取るクロージャに変換する"""
+    if isinstance(node, ast.Constant):
+        value = node.value
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"サポートされていない値: {value!r}")
+        return lambda deadline: value
+    elif isinstance(node, ast.BinOp):
+        # 二項演算
+        if type(node.op) not in OPS:
+            raise ValueError(f"サポートされていない演算: {type(node.op)}")
+        left = _compile_node(node.left)
+        right = _compile_node(node.right)
+        if isinstance(node.op, ast.Pow):
+            return lambda deadline: _limited_pow(left(deadline), right(deadline), deadline)
+        func = OPS[type(node.op)]
+        return lambda deadline: _check_magnitude(func(left(deadline), right(deadline)), deadline)
+    elif isinstance(node, ast.UnaryOp):
+        # 単項演算
+        if type(node.op) not in OPS:
+            raise ValueError(f"サポートされていない演算: {type(node.op)}")
+        operand = _compile_node(node.operand)
+        func = OPS[type(node.op)]
+        return lambda deadline: func(operand(deadline))
+    else:
+        raise ValueError(f"サポートされていない式: {type(node)}")
+
+# 数式のコンパイル（LRUキャッシュ付き）
+@lru_cache(maxsize=SAFE_EVAL_CACHE_SIZE)
+def compile_expression(expr: str) -> Tuple[Optional[Callable[[float], Any]], Optional[str]]:
+    """
+    クリーンアップ済みの式を検証してクロージャにコンパイルする
+    不正な式も繰り返し解析しないよう、(None, エラー内容) としてキャッシュする
+    """
+    try:
+        if len(expr) > SAFE_EVAL_MAX_LENGTH:
+            raise EvalLimitError(f"式が長すぎます（{SAFE_EVAL_MAX_LENGTH}文字超）")
+        tree = ast.parse(expr, mode='eval')
+        nodes = sum(1 for node in ast.walk(tree.body) if not isinstance(node, (ast.operator, ast.unaryop)))
+        if nodes > SAFE_EVAL_MAX_NODES:
+            raise EvalLimitError(f"式が複雑すぎます（{nodes}ノード）")
+        return _compile_node(tree.body), None
+    except (SyntaxError, ValueError, RecursionError) as e:
+        return None, str(e)
+
 # 数式の安全な評価
 def safe_eval(expr: str) -> Optional[float]:
     """数式を安全に評価する関数"""
@@ -117,66 +222,43 @@ def safe_eval(expr: str) -> Optional[float]:
         # 入力のクリーンアップ
         expr = expr.strip().replace('×', '*').replace('÷', '/').replace('^', '**')
         
-        # 式の解析
-        node = ast.parse(expr, mode='eval').body
+        # 解析・検証済みの式はキャッシュから取り出す
+        compiled, error = compile_expression(expr)
+        if compiled is None:
+            raise ValueError(error)
         
-        def _eval(node):
-            """ASTノードを再帰的に評価"""
-            if isinstance(node, ast.Num):
-                return node.n
-            elif isinstance(node, ast.BinOp):
-                # 二項演算
-                if type(node.op) not in OPS:
-                    raise ValueError(f"サポートされていない演算: {type(node.op)}")
-                return OPS[type(node.op)](_eval(node.left), _eval(node.right))
-            elif isinstance(node, ast.UnaryOp):
-                # 単項演算
-                if type(node.op) not in OPS:
-                    raise ValueError(f"サポートされていない演算: {type(node.op)}")
-                return OPS[type(node.op)](_eval(node.operand))
-            elif isinstance(node, ast.Constant):
-                # Python 3.8以降向け
-                return node.value
-            else:
-                raise ValueError(f"サポートされていない式: {type(node)}")
-                
-        return _eval(node)
-    except (SyntaxError, ValueError, TypeError, ZeroDivisionError) as e:
+        return compiled(time.perf_counter() + SAFE_EVAL_TIMEOUT)
+    except (ValueError, TypeError, ZeroDivisionError, OverflowError) as e:
         logging.warning(f"式評価エラー: {str(e)} - 式: {expr}")
         return None
 
+# テキスト正規化（キャッシュなし）
+def _normalize_uncached(text: str) -> str:
+    """NFKCで全角英数・記号・半角カナを畳み込み、空白をまとめて小文字化する"""
+    if not text.isascii():
+        # 全角数字「６６．７」→「66.7」、半角カナ「ﾎﾟﾝﾄﾞ」→「ポンド」など
+        if not unicodedata.is_normalized('NFKC', text):
+            text = unicodedata.normalize('NFKC', text)
+        text = text.translate(NORMALIZE_TABLE)
+    return ' '.join(text.split()).lower()
+
+# テキスト正規化（キャッシュ付き）
+_normalize_cached = lru_cache(maxsize=NORMALIZE_CACHE_SIZE)(_normalize_uncached)
+
 # テキスト正規化
 def normalize_text(text: str) -> str:
     """テキストを正規化する関数"""
     if not text:
         return ""
-    
-    # 空白と改行の正規化
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    # 全角文字を半角に変換
-    text = text.translate(str.maketrans({
-        '　': ' ',
-        '，': ',',
-        '．': '.',
-        '！': '!',
-        '？': '?',
-        '：': ':',
-        '；': ';',
-        '（': '(',
-        '）': ')',
-        '［': '[',
-        '］': ']',
-        '｛': '{',
-        '｝': '}',
-        '＋': '+',
-        '－': '-',
-        '＊': '*',
-        '／': '/',
-        '＝': '='
-    }))
-    
-    return text.lower()
+    if len(text) > NORMALIZE_CACHE_MAX_LENGTH:
+        return _normalize_uncached(text)
+    return _normalize_cached(text)
+
+# 正解候補の正規化（問題ごとにキャッシュ）
+@lru_cache(maxsize=1024)
+def normalize_choices(choices: Tuple[str, ...]) -> frozenset:
+    """正解候補をまとめて正規化した集合を返す（同じ問題の正解は再計算しない）"""
+    return frozenset(normalize_text(str(c)) for c in choices)
 
 # 選択肢一致チェック
 def check_choice_match(user_answer: str, correct_choices: List[str]) -> bool:
@@ -184,9 +266,9 @@ def check_choice_match(user_answer: str, correct_choices: List[str]) -> bool:
     if not user_answer or not correct_choices:
         return False
     
-    # 正規化
+    # 正規化（正解候補は問題ごとにキャッシュ済みのものを使う）
     user_norm = normalize_text(user_answer)
-    choices_norm = [normalize_text(c) for c in correct_choices]
+    choices_norm = normalize_choices(tuple(correct_choices))
     
     # 完全一致または選択肢の値/キーの一致をチェック
     return user_norm in choices_norm
@@ -226,13 +308,99 @@ def check_text_match(user_answer: str, correct_answer: str, fuzzy: bool = True)
         # 厳密一致
         return user_norm == correct_norm
 
-# ユーザーレベル計算
-def calculate_user_level(xp_points: int) -> int:
-    """XPポイントからユーザーレベルを計算"""
-    for level, info in sorted(USER_LEVELS.items(), key=lambda x: x[0], reverse=True):
-        if xp_points >= info["req"]:
-            return level
-    return 0
+# レベル曲線
+class LevelCurve:
+    """
+    レベルごとの必要XPを昇順の配列に前計算したもの
+    単一のXPは bisect、XPの配列は numpy.searchsorted でレベルと進捗に変換する
+    """
+
+    def __init__(self, levels: Dict[int, Dict[str, Any]]):
+        items = sorted(levels.items())
+        if not items:
+            raise ValueError("レベルが定義されていません")
+        self.levels = tuple(level for level, _ in items)
+        self.thresholds = tuple(info["req"] for _, info in items)
+        if any(a > b for a, b in zip(self.thresholds, self.thresholds[1:])):
+            raise ValueError("必要XPはレベル順に単調増加である必要があります")
+        self._infos = tuple(dict(info) for _, info in items)
+        self._index = {level: i for i, level in enumerate(self.levels)}
+        self._levels_array = np.array(self.levels, dtype=np.int64)
+        self._thresholds_array = np.array(self.thresholds, dtype=np.float64)
+        # 最大レベルは進捗の分母が0にならないよう次の閾値を無限大とする
+        self._next_array = np.append(self._thresholds_array[1:], np.inf)
+
+    def extended(self, max_level: int, growth: float = LEVEL_CURVE_GROWTH) -> 'LevelCurve':
+        """最上位より上のレベルを、直前の必要XP差を growth 倍ずつ伸ばして max_level まで追加した曲線を返す"""
+        if max_level <= self.levels[-1]:
+            return self
+        levels = {level: info for level, info in zip(self.levels, self._infos)}
+        top = self._infos[-1]
+        step = self.thresholds[-1] - self.thresholds[-2] if len(self.thresholds) > 1 else 100
+        req = self.thresholds[-1]
+        for n, level in enumerate(range(self.levels[-1] + 1, max_level + 1), start=2):
+            step = int(round(step * growth))
+            req += step
+            levels[level] = {"name": f"{top['name']}{n}", "icon": top.get("icon", ""), "req": req}
+        return LevelCurve(levels)
+
+    def __len__(self) -> int:
+        return len(self.levels)
+
+    def _position(self, xp_points: float) -> int:
+        return max(bisect_right(self.thresholds, xp_points) - 1, 0)
+
+    def level(self, xp_points: float) -> int:
+        """XPからレベルを求める"""
+        return self.levels[self._position(xp_points)]
+
+    def info(self, level: int) -> Dict[str, Any]:
+        """レベルの名前・アイコン・必要XPを取得（未定義なら最下位）"""
+        return self._infos[self._index.get(level, 0)]
+
+    def next_info(self, level: int) -> Optional[Dict[str, Any]]:
+        """次のレベルの情報を取得（最大レベルならNone）"""
+        i = self._index.get(level)
+        if i is None or i + 1 >= len(self.levels):
+            return None
+        return self._infos[i + 1]
+
+    def progress(self, xp_points: float, level: Optional[int] = None) -> float:
+        """現在のレベル内での進捗（0.0〜1.0、最大レベルは1.0）"""
+        i = self._position(xp_points) if level is None else self._index.get(level, 0)
+        if i + 1 >= len(self.levels):
+            return 1.0
+        current, upcoming = self.thresholds[i], self.thresholds[i + 1]
+        return min(1.0, max(0.0, (xp_points - current) / (upcoming - current))) if upcoming > current else 1.0
+
+    def levels_for(self, xp_points: Sequence[float]) -> np.ndarray:
+        """XPの配列をまとめてレベルの配列に変換する"""
+        positions = np.searchsorted(self._thresholds_array, np.asarray(xp_points, dtype=np.float64), side="right") - 1
+        return self._levels_array[np.clip(positions, 0, None)]
+
+    def progress_for(self, xp_points: Sequence[float]) -> np.ndarray:
+        """XPの配列をまとめて、各レベル内での進捗の配列に変換する"""
+        xp = np.asarray(xp_points, dtype=np.float64)
+        positions = np.clip(np.searchsorted(self._thresholds_array, xp, side="right") - 1, 0, None)
+        current = self._thresholds_array[positions]
+        span = self._next_array[positions] - current
+        with np.errstate(divide="ignore", invalid="ignore"):
+            progress = np.where(np.isinf(span) | (span <= 0), 1.0, (xp - current) / span)
+        return np.clip(progress, 0.0, 1.0)
+
+# 共有レベル曲線
+_level_curve = None
+_level_curve_lock = threading.Lock()
+
+# 共有レベル曲線の取得
+def get_level_curve() -> LevelCurve:
+    """USER_LEVELS と LEVEL_CURVE_MAX_LEVEL から作ったプロセス共通のレベル曲線を取得"""
+    global _level_curve
+    if _level_curve is None:
+        with _level_curve_lock:
+            if _level_curve is None:
+                _level_curve = LevelCurve(USER_LEVELS).extended(LEVEL_CURVE_MAX_LEVEL)
+    return _level_curve
 
 # 解答XP計算
 def calculate_xp_reward(problem: Dict[str, Any], duration: float, hints_used: int) -> int:
@@ -0,0 +1,433 @@
+import os
+import time
+import heapq
+import sqlite3
+import threading
+from bisect import insort
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# 定数
+LEADERBOARD_TOP_K = int(os.getenv("LEADERBOARD_TOP_K", "100"))  # ボードごとに保持する上位人数
+LEADERBOARD_WEEKS = int(os.getenv("LEADERBOARD_WEEKS", "4"))  # 保持する週間ボードの数
+LEADERBOARD_SNAPSHOT_INTERVAL = float(os.getenv("LEADERBOARD_SNAPSHOT_INTERVAL", "300"))  # スナップショットの間隔（秒、0で保存しない）
+LEADERBOARD_SYNC_INTERVAL = float(os.getenv("LEADERBOARD_SYNC_INTERVAL", "1"))  # 他プロセスのXPイベントを取り込む間隔（秒）
+OVERALL_BOARD = "overall"
+
+# 週の開始日
+def week_of(timestamp: float) -> str:
+    """タイムスタンプが属する週（月曜始まり、ローカル時刻）の開始日を返す"""
+    day = date.fromtimestamp(timestamp)
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+# 週間ボードの集計開始時刻
+def week_cutoff(weeks: int) -> float:
+    """保持する最も古い週の月曜0時（ローカル時刻）のタイムスタンプ"""
+    oldest = date.fromisoformat(week_of(time.time())) - timedelta(weeks=weeks - 1)
+    return time.mktime(oldest.timetuple())
+
+# スコア分布の索引
+class ScoreIndex:
+    """
+    整数スコアごとの人数をFenwick木で保持し、あるスコアより上の人数をO(log M)で数える
+    （Mはスコアの最大値。必要に応じて倍々に拡張する）
+    """
+
+    def __init__(self, size: int = 1024):
+        self._size = 1
+        while self._size < size:
+            self._size *= 2
+        self._counts = np.zeros(self._size, dtype=np.int64)
+        self._tree = [0] * (self._size + 1)
+        self.total = 0
+
+    def _rebuild(self) -> None:
+        """人数の配列からFenwick木を一括で構築する"""
+        prefix = np.concatenate(([0], np.cumsum(self._counts)))
+        index = np.arange(1, self._size + 1)
+        self._tree = [0] + (prefix[index] - prefix[index - (index & -index)]).tolist()
+
+    def _grow(self, score: int) -> None:
+        size = self._size
+        while size <= score:
+            size *= 2
+        self._counts = np.concatenate((self._counts, np.zeros(size - self._size, dtype=np.int64)))
+        self._size = size
+        self._rebuild()
+
+    def load(self, scores: np.ndarray) -> None:
+        """スコアの配列から索引を作り直す"""
+        scores = np.clip(np.asarray(scores, dtype=np.int64), 0, None)
+        maximum = int(scores.max()) if len(scores) else 0
+        while self._size <= maximum:
+            self._size *= 2
+        self._counts = np.bincount(scores, minlength=self._size).astype(np.int64)
+        self.total = int(len(scores))
+        self._rebuild()
+
+    def add(self, score: int, count: int) -> None:
+        """スコアの人数を count だけ増減する"""
+        score = max(int(score), 0)
+        if score >= self._size:
+            self._grow(score)
+        self._counts[score] += count
+        self.total += count
+        i = score + 1
+        tree = self._tree
+        while i <= self._size:
+            tree[i] += count
+            i += i & -i
+
+    def kth_highest(self, k: int) -> Optional[int]:
+        """k番目（1始まり、同点も1人ずつ数える）に高いスコアをO(log M)で求める（k が人数を超えればNone）"""
+        if k < 1 or k > self.total:
+            return None
+        # 下から数えて target 番目のスコアを、Fenwick木を上位ビットから降りて探す
+        target = self.total - k + 1
+        position = 0
+        step = self._size
+        tree = self._tree
+        while step:
+            following = position + step
+            if following <= self._size and tree[following] < target:
+                position = following
+                target -= tree[following]
+            step //= 2
+        return position
+
+    def count_above(self, score: int) -> int:
+        """score より高いスコアの人数"""
+        score = max(int(score), 0)
+        if score >= self._size:
+            return 0
+        i = score + 1
+        at_or_below = 0
+        tree = self._tree
+        while i > 0:
+            at_or_below += tree[i]
+            i -= i & -i
+        return self.total - at_or_below
+
+# ランキングボード
+class RankingBoard:
+    """
+    ユーザーごとのスコアと上位K人を保持するボード
+    スコアの増減は O(log M)、順位の問い合わせも O(log M)（同点は同順位）
+    上位のスコアが下がった場合の選び直しは、スコア索引で上位K番目までのスコアを辿り
+    同点のユーザーだけを候補にするため O(K log M + 境界の同点人数)
+    """
+
+    def __init__(self, k: int = LEADERBOARD_TOP_K):
+        self.k = k
+        self.scores: Dict[str, int] = {}
+        self._index = ScoreIndex()
+        self._buckets: Dict[int, Set[str]] = {}  # スコア（索引と同じく0未満は0）ごとのユーザー
+        self._top: List[Tuple[int, str]] = []  # (-スコア, user_id) の昇順
+        self._top_members: Dict[str, int] = {}
+        self._top_dirty = False
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def load(self, user_ids: List[str], scores: Iterable[int]) -> None:
+        """ユーザーとスコアの一覧からボードを一括で作り直す"""
+        scores = np.asarray(list(scores), dtype=np.int64)
+        self.scores = dict(zip(user_ids, scores.tolist()))
+        self._index = ScoreIndex()
+        self._index.load(scores)
+        self._buckets = {}
+        for user_id, score in self.scores.items():
+            self._buckets.setdefault(max(score, 0), set()).add(user_id)
+        self._refresh_top()
+
+    def _refresh_top(self) -> None:
+        """スコア索引を上から辿って上位K人を選び直す（全ユーザーは走査しない）"""
+        entries = []
+        k = 1
+        while len(entries) < self.k:
+            score = self._index.kth_highest(k)
+            if score is None:
+                break
+            bucket = self._buckets[score]
+            entries.extend(heapq.nsmallest(self.k - len(entries), ((-self.scores[u], u) for u in bucket)))
+            k += len(bucket)
+        self._top = sorted(entries)
+        self._top_members = {user_id: -neg for neg, user_id in self._top}
+        self._top_dirty = False
+
+    def set(self, user_id: str, score: int) -> None:
+        """ユーザーのスコアを設定する"""
+        score = int(score)
+        old = self.scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self._index.add(old, -1)
+            bucket = self._buckets[max(old, 0)]
+            bucket.discard(user_id)
+            if not bucket:
+                del self._buckets[max(old, 0)]
+        self._index.add(score, 1)
+        self._buckets.setdefault(max(score, 0), set()).add(user_id)
+        self.scores[user_id] = score
+
+        if self._top_dirty:
+            return
+        if user_id in self._top_members:
+            if old is not None and score < old:
+                # 上位から外れる可能性があるため、次に参照されたときに選び直す
+                self._top_dirty = True
+                return
+            self._top.remove((-old, user_id))
+        elif len(self._top) >= self.k and (-score, user_id) >= self._top[-1]:
+            return
+        insort(self._top, (-score, user_id))
+        self._top_members[user_id] = score
+        if len(self._top) > self.k:
+            _, dropped = self._top.pop()
+            del self._top_members[dropped]
+
+    def add(self, user_id: str, delta: int) -> int:
+        """ユーザーのスコアを delta だけ増減し、新しいスコアを返す"""
+        score = self.scores.get(user_id, 0) + int(delta)
+        self.set(user_id, score)
+        return score
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """ユーザーの順位（1始まり、未参加ならNone）"""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return self._index.count_above(score) + 1
+
+    def top(self, n: Optional[int] = None) -> List[Dict[str, Any]]:
+        """上位n人（省略時はK人）を順位付きで返す"""
+        if self._top_dirty:
+            self._refresh_top()
+        entries = self._top[:n or self.k]
+        result = []
+        for neg, user_id in entries:
+            result.append({"rank": self._index.count_above(-neg) + 1, "user_id": user_id, "score": -neg})
+        return result
+
+# リーダーボード
+class Leaderboard:
+    """
+    総合・カテゴリ別・週間のランキングボードをまとめて保持し、XP台帳のイベントごとに差分で更新する
+    総合は users.xp_points、カテゴリ別・週間はXP台帳の合計をスコアとする
+    各プロセスは起動時に全ボードを読み込み、以降は台帳を event_id 順に追いかけて（sync）
+    自プロセス・他プロセスのどちらが記録したイベントも同じ順に取り込むため、プロセス間で順位が一致する
+    保存用のスナップショットはメモリ上のボードではなくデータベースから集計する
+    """
+
+    def __init__(self, k: int = LEADERBOARD_TOP_K, weeks: int = LEADERBOARD_WEEKS,
+                 snapshot_interval: float = LEADERBOARD_SNAPSHOT_INTERVAL,
+                 sync_interval: float = LEADERBOARD_SYNC_INTERVAL):
+        self.k = k
+        self.weeks = weeks
+        self.snapshot_interval = snapshot_interval
+        self.sync_interval = sync_interval
+        self.loaded = False
+        self._boards: Dict[str, RankingBoard] = {OVERALL_BOARD: RankingBoard(k)}
+        self._week_boards: "OrderedDict[str, RankingBoard]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_event_id = 0
+        self._last_sync = 0.0
+        self._last_snapshot = time.time()
+        self._stats = {"updates": 0, "syncs": 0, "snapshots": 0}
+
+    def _board(self, name: str) -> RankingBoard:
+        """ボードを取得（なければ作成、週間ボードは古いものから捨てる）"""
+        if name.startswith("week:"):
+            board = self._week_boards.get(name)
+            if board is None:
+                board = self._week_boards[name] = RankingBoard(self.k)
+                for stale in sorted(self._week_boards)[:-self.weeks]:
+                    del self._week_boards[stale]
+            return board
+        board = self._boards.get(name)
+        if board is None:
+            board = self._boards[name] = RankingBoard(self.k)
+        return board
+
+    def _lookup(self, name: str) -> Optional[RankingBoard]:
+        return self._week_boards.get(name) if name.startswith("week:") else self._boards.get(name)
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        """データベースから全ボードを作り直す（プロセス起動時に1度、以降は sync で追いかける）"""
+        # 集計と取り込み済みのイベント位置を同じ読み取りトランザクションで揃える
+        own_transaction = not conn.in_transaction
+        if own_transaction:
+            conn.execute("BEGIN")
+        try:
+            last_event_id = conn.execute("SELECT COALESCE(MAX(event_id), 0) FROM xp_events").fetchone()[0]
+            users = conn.execute("SELECT user_id, xp_points FROM users").fetchall()
+            groups: Dict[str, Tuple[List[str], List[int]]] = {}
+            for row in conn.execute(
+                "SELECT category, user_id, SUM(delta) FROM xp_events WHERE category IS NOT NULL GROUP BY category, user_id"
+            ):
+                ids, scores = groups.setdefault(f"category:{row[0]}", ([], []))
+                ids.append(row[1])
+                scores.append(row[2])
+            for row in conn.execute(
+                """SELECT date(created_at, 'unixepoch', 'localtime', 'weekday 0', '-6 days'), user_id, SUM(delta)
+                   FROM xp_events WHERE created_at >= ? GROUP BY 1, user_id""",
+                (week_cutoff(self.weeks),)
+            ):
+                ids, scores = groups.setdefault(f"week:{row[0]}", ([], []))
+                ids.append(row[1])
+                scores.append(row[2])
+        finally:
+            if own_transaction:
+                conn.execute("COMMIT")
+
+        with self._lock:
+            self._boards = {OVERALL_BOARD: RankingBoard(self.k)}
+            self._week_boards = OrderedDict()
+            self._boards[OVERALL_BOARD].load([row[0] for row in users], [row[1] or 0 for row in users])
+            for name in sorted(groups):
+                ids, scores = groups[name]
+                self._board(name).load(ids, scores)
+            self._last_event_id = last_event_id
+            self._last_sync = time.time()
+            self.loaded = True
+
+    def _apply(self, user_id: str, delta: int, category: Optional[str], timestamp: Optional[float]) -> None:
+        """XPの変化を総合・カテゴリ別・週間の各ボードに加算する（ロックを保持して呼ぶ）"""
+        self._boards[OVERALL_BOARD].add(user_id, delta)
+        if category:
+            self._board(f"category:{category}").add(user_id, delta)
+        self._board(f"week:{week_of(timestamp or time.time())}").add(user_id, delta)
+        self._stats["updates"] += 1
+
+    def record(self, user_id: str, delta: int, category: Optional[str] = None,
+               timestamp: Optional[float] = None) -> None:
+        """XPの変化を直接反映する（データベースを使わない場合用。台帳を使う場合は sync で取り込む）"""
+        with self._lock:
+            self._apply(user_id, delta, category, timestamp)
+
+    def sync(self, conn: sqlite3.Connection) -> int:
+        """
+        前回以降にコミットされたXPイベントを event_id 順に取り込み、取り込んだ件数を返す
+        台帳の集約で作られた行（reason = 'compacted'）は取り込み済みのイベントをまとめたものなので加算しない
+        """
+        with self._lock:
+            rows = conn.execute(
+                """SELECT event_id, user_id, delta, category, created_at, reason FROM xp_events
+                   WHERE event_id > ? ORDER BY event_id""",
+                (self._last_event_id,)
+            ).fetchall()
+            applied = 0
+            for event_id, user_id, delta, category, created_at, reason in rows:
+                if reason != "compacted":
+                    self._apply(user_id, delta, category, created_at)
+                    applied += 1
+                self._last_event_id = event_id
+            self._last_sync = time.time()
+            self._stats["syncs"] += 1
+            return applied
+
+    def sync_due(self) -> bool:
+        """前回の取り込みから sync_interval 秒以上経過したか"""
+        return time.time() - self._last_sync >= self.sync_interval
+
+    def top(self, board: str = OVERALL_BOARD, n: Optional[int] = None) -> List[Dict[str, Any]]:
+        """ボードの上位n人を返す（board は "overall"・"category:<名前>"・"week:<開始日>"）"""
+        with self._lock:
+            ranking = self._lookup(board)
+            return ranking.top(n) if ranking else []
+
+    def rank(self, user_id: str, board: str = OVERALL_BOARD) -> Optional[int]:
+        """ボードでのユーザーの順位（1始まり、未参加ならNone）"""
+        with self._lock:
+            ranking = self._lookup(board)
+            return ranking.rank(user_id) if ranking else None
+
+    def boards(self) -> List[str]:
+        """保持しているボード名の一覧"""
+        with self._lock:
+            return list(self._boards) + list(self._week_boards)
+
+    def snapshot_due(self) -> bool:
+        """前回のスナップショットから snapshot_interval 秒以上経過したか（経過していれば時刻を更新）"""
+        if self.snapshot_interval <= 0:
+            return False
+        with self._lock:
+            now = time.time()
+            if now - self._last_snapshot < self.snapshot_interval:
+                return False
+            self._last_snapshot = now
+            return True
+
+    def snapshot_rows(self, conn: sqlite3.Connection) -> List[Tuple]:
+        """
+        各ボードの上位K人をデータベースから集計する（メモリ上のボードは使わないため、どのプロセスでも同じ結果になる）
+        総合は users のインデックスで上位K人だけを読み、カテゴリ別・週間は台帳を集計する（読み取り接続で呼ぶ）
+        """
+        now = time.time()
+        rows = conn.execute(
+            """SELECT 'overall', ROW_NUMBER() OVER (ORDER BY xp_points DESC, user_id),
+                      RANK() OVER (ORDER BY xp_points DESC), user_id, xp_points, ?
+               FROM (SELECT user_id, xp_points FROM users ORDER BY xp_points DESC, user_id LIMIT ?)""",
+            (now, self.k)
+        ).fetchall()
+        rows += conn.execute(
+            """WITH scores AS (
+                   SELECT 'category:' || category AS board, user_id, SUM(delta) AS score
+                   FROM xp_events WHERE category IS NOT NULL GROUP BY category, user_id
+                   UNION ALL
+                   SELECT 'week:' || date(created_at, 'unixepoch', 'localtime', 'weekday 0', '-6 days'),
+                          user_id, SUM(delta)
+                   FROM xp_events WHERE created_at >= ? GROUP BY 1, user_id
+               )
+               SELECT board, position, rank, user_id, score, ? FROM (
+                   SELECT board, user_id, score,
+                          ROW_NUMBER() OVER (PARTITION BY board ORDER BY score DESC, user_id) AS position,
+                          RANK() OVER (PARTITION BY board ORDER BY score DESC) AS rank
+                   FROM scores
+               ) WHERE position <= ?""",
+            (week_cutoff(self.weeks), now, self.k)
+        ).fetchall()
+        return [tuple(row) for row in rows]
+
+    def save_snapshot(self, conn: sqlite3.Connection, rows: List[Tuple]) -> int:
+        """集計したスナップショットでテーブルを置き換え、保存した行数を返す（書き込みトランザクション内で呼ぶ）"""
+        conn.execute("DELETE FROM leaderboard_snapshots")
+        conn.executemany(
+            """INSERT INTO leaderboard_snapshots (board, position, rank, user_id, score, taken_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            rows
+        )
+        with self._lock:
+            self._stats["snapshots"] += 1
+        return len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        """ボード数・参加者数・更新回数を返す"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["boards"] = len(self._boards) + len(self._week_boards)
+            stats["users"] = len(self._boards[OVERALL_BOARD])
+            return stats
+
+# 共有リーダーボード
+_leaderboard = None
+_leaderboard_lock = threading.Lock()
+
+# 共有リーダーボードの取得
+def get_leaderboard() -> Leaderboard:
+    """プロセス共通のリーダーボードを取得"""
+    global _leaderboard
+    if _leaderboard is None:
+        with _leaderboard_lock:
+            if _leaderboard is None:
+                _leaderboard = Leaderboard()
+    return _leaderboard
+
+# リーダーボードの統計
+def get_leaderboard_stats() -> Dict[str, Any]:
+    """ボード数・参加者数・更新回数・取り込み回数・スナップショット回数を取得"""
+    return get_leaderboard().stats()
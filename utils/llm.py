@@ -1,9 +1,60 @@
 import os
+import re
 import json
-import requests
+import asyncio
+import hashlib
+import httpx
 import logging
+import numpy as np
+import queue
+import random
+import sqlite3
+import threading
 import time
-from typing import Dict, Any, Optional
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Optional, Iterator, AsyncIterator, Callable
+
+from utils.database import get_connection, get_writer
+from utils.helpers import normalize_text
+
+# 定数
+LLM_MAX_TOKENS = 500
+LLM_TEMPERATURE = 0.7
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 60 * 60)))
+LLM_CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST", "0") == "1"
+LLM_CACHE_PURGE_EVERY = 256  # 永続層の期限切れ行を削除する書き込み間隔
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_STREAM_CHUNK_SIZE = 8  # スタブ応答をストリーミングする際の分割文字数
+LLM_STREAM_DELAY = float(os.getenv("LLM_STREAM_DELAY", "0.02"))
+LLM_PREFETCH_WORKERS = int(os.getenv("LLM_PREFETCH_WORKERS", "4"))
+LLM_PREFETCH_WAIT = float(os.getenv("LLM_PREFETCH_WAIT", "3"))  # 実行中の先読みを待つ最大秒数
+LLM_BATCH_WINDOW = float(os.getenv("LLM_BATCH_WINDOW", "0.05"))  # 0でバッチ送信しない
+LLM_BATCH_MAX = int(os.getenv("LLM_BATCH_MAX", "32"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))  # 連続失敗でブレーカーを開く回数
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))  # 開いてから試行を再開するまでの秒数
+LLM_RETRY_MAX = int(os.getenv("LLM_RETRY_MAX", "2"))  # 1回の呼び出しでのリトライ上限
+LLM_RETRY_RATIO = float(os.getenv("LLM_RETRY_RATIO", "0.1"))  # 呼び出し1回ごとに貯まるリトライ予算
+LLM_RETRY_BUDGET = float(os.getenv("LLM_RETRY_BUDGET", "10"))  # リトライ予算の上限
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.2"))  # バックオフの基準秒数
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"  # p95を超えたら2本目のリクエストを送る
+LLM_HEDGE_QUANTILE = 0.95
+LLM_HEDGE_MIN_SAMPLES = 20  # ヘッジの閾値を決めるのに必要なレイテンシのサンプル数
+LLM_LATENCY_WINDOW = 200  # 閾値の計算に使う直近のレイテンシ数
+LLM_SIMILARITY_THRESHOLD = float(os.getenv("LLM_SIMILARITY_THRESHOLD", "0.75"))  # 1を超えると無効
+LLM_SIMILARITY_NGRAMS = (1, 2, 3)  # 回答ベクトルに使う文字n-gramの長さ
+LLM_SIMILARITY_DIMS = 1024  # n-gramをハッシュする次元数
+LLM_ANSWER_CACHE_PROBLEMS = int(os.getenv("LLM_ANSWER_CACHE_PROBLEMS", "256"))
+LLM_ANSWER_CACHE_PER_PROBLEM = int(os.getenv("LLM_ANSWER_CACHE_PER_PROBLEM", "64"))
+LLM_QUESTION_MAX_TOKENS = 400  # プロンプトに埋め込む問題文の上限トークン数
+LLM_ANSWER_MAX_TOKENS = 300  # プロンプトに埋め込む回答の上限トークン数
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))  # プロセス全体の1分あたりの上限
+LLM_USER_TOKENS_PER_MINUTE = int(os.getenv("LLM_USER_TOKENS_PER_MINUTE", "4000"))  # ユーザーごとの1分あたりの上限
+LLM_BUDGET_MAX_WAIT = float(os.getenv("LLM_BUDGET_MAX_WAIT", "10"))  # 予算が空くまで待つ最大秒数
 
 # LLM APIレスポンス用のスタブデータ
 STUB_RESPONSES = {
@@ -13,11 +64,1014 @@ STUB_RESPONSES = {
     "follow_up": "この問題と関連して、実生活ではどのような場面でこの考え方が役立つでしょうか？"
 }
 
+# 非同期LLMクライアント
+class AsyncLLMClient:
+    """
+    専用スレッドのイベントループ上で動く非同期HTTPクライアント
+    keep-alive接続をプールし、同時リクエスト数をセマフォで制限する
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_connections: int = LLM_MAX_CONNECTIONS, timeout: float = LLM_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "in_flight": 0, "max_in_flight": 0, "timeouts": 0, "errors": 0,
+                       "hedged": 0, "hedge_wins": 0}
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        """イベントループのスレッドとHTTPクライアントを起動"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-client", daemon=True).start()
+
+                async def _init():
+                    self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                    self._client = httpx.AsyncClient(
+                        limits=httpx.Limits(
+                            max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_connections
+                        ),
+                        timeout=self.timeout
+                    )
+
+                asyncio.run_coroutine_threadsafe(_init(), loop).result()
+                self._loop = loop
+        return self._loop
+
+    async def post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                   timeout: Optional[float] = None) -> httpx.Response:
+        """
+        JSONをPOSTする（非同期）
+        timeoutはセマフォの待ち時間も含めた呼び出し全体の期限
+        """
+        timeout = self.timeout if timeout is None else timeout
+
+        async def _request():
+            async with self._semaphore:
+                with self._lock:
+                    self._stats["requests"] += 1
+                    self._stats["in_flight"] += 1
+                    self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._stats["in_flight"])
+                try:
+                    return await self._client.post(url, headers=headers, json=payload)
+                finally:
+                    with self._lock:
+                        self._stats["in_flight"] -= 1
+
+        try:
+            return await asyncio.wait_for(_request(), timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise TimeoutError(f"LLM API の期限 {timeout} 秒を超えました")
+        except httpx.HTTPError:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+
+    def post_sync(self, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                  timeout: Optional[float] = None) -> httpx.Response:
+        """postの同期版（Streamlitのコールバックなど同期コードから使用）"""
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(self.post(url, headers, payload, timeout), loop)
+        return future.result()
+
+    async def post_hedged(self, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                          timeout: Optional[float], hedge_after: float) -> httpx.Response:
+        """
+        hedge_after秒以内に応答がなければ同じリクエストをもう1本送り、先に成功した方を返す（非同期）
+        """
+        timeout = self.timeout if timeout is None else timeout
+        first = asyncio.ensure_future(self.post(url, headers, payload, timeout))
+        done, _ = await asyncio.wait({first}, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        with self._lock:
+            self._stats["hedged"] += 1
+        second = asyncio.ensure_future(self.post(url, headers, payload, timeout - hedge_after))
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code == 200:
+                        if task is second:
+                            with self._lock:
+                                self._stats["hedge_wins"] += 1
+                        return task.result()
+            # どちらも失敗した場合は最初のリクエストの結果（例外）を返す
+            return first.result()
+        finally:
+            for task in (first, second):
+                if not task.done():
+                    task.cancel()
+
+    def post_hedged_sync(self, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                         timeout: Optional[float], hedge_after: float) -> httpx.Response:
+        """post_hedgedの同期版"""
+        loop = self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(self.post_hedged(url, headers, payload, timeout, hedge_after), loop)
+        return future.result()
+
+    async def stream(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> AsyncIterator[str]:
+        """
+        ストリーミング応答を行単位で読み、テキストの断片を順に返す（非同期）
+        各行はJSON（{"text": ...}）またはプレーンテキスト、"data:" 接頭辞と "[DONE]" 終端にも対応
+        """
+        async with self._semaphore:
+            with self._lock:
+                self._stats["requests"] += 1
+                self._stats["in_flight"] += 1
+                self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._stats["in_flight"])
+            try:
+                async with self._client.stream("POST", url, headers=headers, json=payload) as response:
+                    if response.status_code != 200:
+                        raise RuntimeError(f"ステータスコード {response.status_code}")
+                    async for line in response.aiter_lines():
+                        line = line.strip()
+                        if line.startswith("data:"):
+                            line = line[5:].strip()
+                        if not line:
+                            continue
+                        if line == "[DONE]":
+                            break
+                        try:
+                            data = json.loads(line)
+                            chunk = data.get("text", "") if isinstance(data, dict) else str(data)
+                        except ValueError:
+                            chunk = line
+                        if chunk:
+                            yield chunk
+            finally:
+                with self._lock:
+                    self._stats["in_flight"] -= 1
+
+    def stream_sync(self, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+                    timeout: Optional[float] = None) -> Iterator[str]:
+        """streamの同期版（timeoutはストリーム全体の期限）"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        loop = self._ensure_started()
+        chunks = queue.Queue()
+
+        async def _pump():
+            try:
+                async for chunk in self.stream(url, headers, payload):
+                    chunks.put(("chunk", chunk))
+                chunks.put(("done", None))
+            except Exception as e:
+                chunks.put(("error", e))
+
+        future = asyncio.run_coroutine_threadsafe(_pump(), loop)
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    kind, value = chunks.get(timeout=max(0.0, remaining))
+                except queue.Empty:
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise TimeoutError(f"LLM API の期限 {timeout} 秒を超えました")
+                if kind == "done":
+                    return
+                if kind == "error":
+                    with self._lock:
+                        self._stats["errors"] += 1
+                    raise value
+                yield value
+        finally:
+            # 読み手が途中で離れた場合もリクエストを打ち切る
+            if not future.done():
+                future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """リクエスト数・同時実行数などの統計を取得"""
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self) -> None:
+        """HTTPクライアントとイベントループを停止"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+# 共有LLMクライアントの取得
+def get_llm_client() -> AsyncLLMClient:
+    """プロセス共通のLLMクライアントを取得"""
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                _llm_client = AsyncLLMClient()
+    return _llm_client
+
+# リクエストのバッチ化
+class RequestBatcher:
+    """
+    短い時間枠に集まったLLM呼び出しを1つのバッチリクエストにまとめて送信し、
+    結果をそれぞれの呼び出し元に返す
+    バッチAPIは {"batch": [ペイロード, ...]} を受け取り {"results": [{"text": ...}, ...]} を返すこと
+    バッチ送信に失敗した場合は、fallback_urlがあれば1件ずつ送り直す
+    """
+
+    def __init__(self, client: AsyncLLMClient, window: float = LLM_BATCH_WINDOW, max_batch: int = LLM_BATCH_MAX):
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "max_batch_size": 0, "failures": 0, "fallbacks": 0}
+
+    def call(self, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+             timeout: Optional[float] = None, fallback_url: Optional[str] = None) -> Optional[str]:
+        """ペイロードをバッチに加え、結果のテキストを待つ"""
+        timeout = self.client.timeout if timeout is None else timeout
+        future = self.submit(url, headers, payload, timeout, fallback_url)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"LLM API の期限 {timeout} 秒を超えました")
+
+    def submit(self, url: str, headers: Dict[str, str], payload: Dict[str, Any],
+               timeout: Optional[float] = None, fallback_url: Optional[str] = None) -> Future:
+        """ペイロードをバッチに加え、結果を受け取るFutureを返す"""
+        loop = self.client._ensure_started()
+        future = Future()
+        key = (url, fallback_url, tuple(sorted(headers.items())))
+        with self._lock:
+            batch = self._pending.setdefault(key, [])
+            batch.append((payload, future))
+            self._stats["requests"] += 1
+            size = len(batch)
+
+        if size >= self.max_batch:
+            loop.call_soon_threadsafe(self._flush, key, batch, headers, timeout)
+        elif size == 1:
+            # 最初の1件が時間枠の始まり
+            loop.call_soon_threadsafe(loop.call_later, self.window, self._flush, key, batch, headers, timeout)
+        return future
+
+    def _flush(self, key, batch, headers: Dict[str, str], timeout: Optional[float]) -> None:
+        """溜まったリクエストを送信（イベントループ上で実行、送信済みのバッチは無視）"""
+        with self._lock:
+            if self._pending.get(key) is not batch:
+                return
+            del self._pending[key]
+            self._stats["batches"] += 1
+            self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(batch))
+        url, fallback_url, _ = key
+        asyncio.ensure_future(self._send(batch, url, fallback_url, headers, timeout))
+
+    async def _send(self, batch, url: str, fallback_url: Optional[str],
+                    headers: Dict[str, str], timeout: Optional[float]) -> None:
+        try:
+            response = await self.client.post(url, headers, {"batch": [payload for payload, _ in batch]}, timeout)
+            if response.status_code != 200:
+                raise RuntimeError(f"ステータスコード {response.status_code}")
+            results = response.json().get("results")
+            if not isinstance(results, list) or len(results) != len(batch):
+                raise ValueError("バッチ応答の件数がリクエストと一致しません")
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result.get("text") if isinstance(result, dict) else result)
+        except Exception as e:
+            with self._lock:
+                self._stats["failures"] += 1
+            if fallback_url is None:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            logging.warning(f"LLM バッチ送信エラー、個別送信に切り替えます: {str(e)}")
+            await asyncio.gather(*(
+                self._send_single(payload, future, fallback_url, headers, timeout)
+                for payload, future in batch if not future.done()
+            ))
+
+    async def _send_single(self, payload: Dict[str, Any], future: Future, url: str,
+                           headers: Dict[str, str], timeout: Optional[float]) -> None:
+        """バッチに失敗したリクエストを単体のエンドポイントへ送信"""
+        with self._lock:
+            self._stats["fallbacks"] += 1
+        try:
+            response = await self.client.post(url, headers, payload, timeout)
+            if response.status_code != 200:
+                raise RuntimeError(f"ステータスコード {response.status_code}")
+            result = response.json().get("text")
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        """バッチ数と平均バッチサイズなどの統計を取得"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_batch_size"] = stats["requests"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+_batcher = None
+
+# 共有バッチャーの取得
+def get_batcher() -> RequestBatcher:
+    """プロセス共通のリクエストバッチャーを取得"""
+    global _batcher
+    if _batcher is None:
+        client = get_llm_client()
+        with _llm_client_lock:
+            if _batcher is None:
+                _batcher = RequestBatcher(client)
+    return _batcher
+
+# バッチAPIのエンドポイント取得
+def get_batch_endpoint() -> Optional[str]:
+    """バッチ送信が有効な場合はバッチAPIのURLを返す"""
+    batch_endpoint = os.getenv("LLM_BATCH_ENDPOINT")
+    if batch_endpoint and LLM_BATCH_WINDOW > 0 and os.getenv("LLM_API_KEY") and os.getenv("LLM_API_ENDPOINT"):
+        return batch_endpoint
+    return None
+
+# LLM APIのエラー
+class LLMStatusError(RuntimeError):
+    """LLM APIが200以外のステータスコードを返した"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"ステータスコード {status_code}")
+        self.status_code = status_code
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code >= 500 or self.status_code == 429
+
+class CircuitOpenError(RuntimeError):
+    """サーキットブレーカーが開いているため呼び出さなかった"""
+
+# サーキットブレーカー
+class CircuitBreaker:
+    """
+    連続失敗がfailure_threshold回に達したら開き、reset_timeout秒のあいだ呼び出しを即座に失敗させる
+    その後は1件だけ試行（半開）し、成功すれば閉じ、失敗すれば再び開く
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET,
+                 on_state_change: Optional[Callable[[str, str], None]] = None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """呼び出してよいか（半開のときは同時に1件だけ許可）"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                change = self._transition(self.HALF_OPEN)
+            else:
+                change = None
+            if self._probing:
+                allowed = False
+            else:
+                self._probing = allowed = True
+        self._notify(change)
+        return allowed
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            change = self._transition(self.CLOSED)
+        self._notify(change)
+
+    def release(self) -> None:
+        """結果が出ないまま終わった試行の許可を返す"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            change = None
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                change = self._transition(self.OPEN)
+        self._notify(change)
+
+    def _transition(self, state: str):
+        """状態を変更し、(変更前, 変更後) を返す（ロック内で呼ぶ）"""
+        if self._state == state:
+            return None
+        previous, self._state = self._state, state
+        return previous, state
+
+    def _notify(self, change) -> None:
+        if change and self.on_state_change:
+            self.on_state_change(*change)
+
+# リトライ予算
+class RetryBudget:
+    """
+    呼び出しごとにratio分の予算が貯まり、リトライ1回で1を使うトークンバケット
+    障害時にリトライが負荷を増幅しないよう、リトライの割合を呼び出し数の一定比率に抑える
+    """
+
+    def __init__(self, ratio: float = LLM_RETRY_RATIO, capacity: float = LLM_RETRY_BUDGET):
+        self.ratio = ratio
+        self.capacity = capacity
+        self._tokens = capacity
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """予算が残っていれば1回分を使ってTrueを返す"""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def remaining(self) -> float:
+        with self._lock:
+            return self._tokens
+
+# LLM呼び出しの耐障害性
+class LLMResilience:
+    """
+    サーキットブレーカー・リトライ予算付きのジッター入りバックオフ・ヘッジリクエストの閾値をまとめて管理する
+    状態の変化と呼び出し結果はメトリクスフック（fn(イベント名, データ)）に通知する
+    """
+
+    def __init__(self, max_retries: int = LLM_RETRY_MAX, backoff: float = LLM_RETRY_BACKOFF,
+                 hedge: bool = LLM_HEDGE, breaker: Optional[CircuitBreaker] = None,
+                 budget: Optional[RetryBudget] = None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.breaker.on_state_change = self._on_state_change
+        self.budget = budget or RetryBudget()
+        self.metrics_hook = None
+        self._latencies = deque(maxlen=LLM_LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "successes": 0, "failures": 0, "retries": 0,
+                       "budget_exhausted": 0, "short_circuited": 0}
+
+    def call(self, attempt: Callable[[float], Any], timeout: float) -> Any:
+        """
+        attempt(残り秒数) を期限内で実行し、失敗したらリトライする
+        ブレーカーが開いている場合はCircuitOpenError、リトライできない場合は最後の例外を送出する
+        """
+        deadline = time.monotonic() + timeout
+        self.budget.deposit()
+        self._count("calls")
+        retries = 0
+        while True:
+            if not self.breaker.allow():
+                self._count("short_circuited")
+                self._emit("short_circuit", {"state": self.breaker.state})
+                raise CircuitOpenError("LLM API のサーキットブレーカーが開いています")
+
+            started = time.monotonic()
+            try:
+                result = attempt(max(0.0, deadline - started))
+            except Exception as e:
+                retryable = not isinstance(e, LLMStatusError) or e.retryable
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    # 4xxはAPI自体は応答しているため障害として数えない
+                    self.breaker.release()
+                delay = random.uniform(0, self.backoff * (2 ** retries))  # フルジッター
+                if not retryable or retries >= self.max_retries or time.monotonic() + delay >= deadline:
+                    self._finish("failures", time.monotonic() - started, e)
+                    raise
+                if not self.budget.withdraw():
+                    self._count("budget_exhausted")
+                    self._finish("failures", time.monotonic() - started, e)
+                    raise
+                retries += 1
+                self._count("retries")
+                self._emit("retry", {"attempt": retries, "delay": delay, "error": str(e)})
+                time.sleep(delay)
+                continue
+
+            elapsed = time.monotonic() - started
+            self.breaker.record_success()
+            with self._lock:
+                self._latencies.append(elapsed)
+            self._finish("successes", elapsed, None)
+            return result
+
+    def record(self, success: bool) -> None:
+        """リトライしない呼び出し（ストリーミングなど）の結果をブレーカーと統計に反映"""
+        if success:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        self._count("calls")
+        self._finish("successes" if success else "failures", None, None)
+
+    def hedge_delay(self) -> Optional[float]:
+        """ヘッジリクエストを送るまでの待ち時間（無効またはサンプル不足の場合はNone）"""
+        if not self.hedge:
+            return None
+        with self._lock:
+            if len(self._latencies) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * LLM_HEDGE_QUANTILE))]
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def _finish(self, outcome: str, latency: Optional[float], error: Optional[Exception]) -> None:
+        self._count(outcome)
+        self._emit("call", {"outcome": outcome, "latency": latency, "error": str(error) if error else None})
+
+    def _on_state_change(self, previous: str, state: str) -> None:
+        if state == CircuitBreaker.OPEN:
+            logging.warning("LLM API のサーキットブレーカーが開きました")
+        self._emit("breaker", {"previous": previous, "state": state})
+
+    def _emit(self, event: str, data: Dict[str, Any]) -> None:
+        hook = self.metrics_hook
+        if hook is None:
+            return
+        try:
+            hook(event, data)
+        except Exception as e:
+            logging.warning(f"メトリクスフックのエラー: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """ブレーカーの状態・リトライ数・レイテンシ閾値などの統計を取得"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["latency_samples"] = len(self._latencies)
+        stats["breaker_state"] = self.breaker.state
+        stats["breaker_opened"] = self.breaker.opened
+        stats["retry_budget"] = self.budget.remaining
+        stats["hedge_after"] = self.hedge_delay()
+        return stats
+
+resilience = LLMResilience()
+
+# メトリクスフックの設定
+def set_metrics_hook(hook: Optional[Callable[[str, Dict[str, Any]], None]]) -> None:
+    """耐障害性のイベント（breaker / retry / short_circuit / call）を受け取る関数を設定"""
+    resilience.metrics_hook = hook
+
+# 耐障害性の統計の取得
+def get_resilience_stats() -> Dict[str, Any]:
+    """サーキットブレーカー・リトライ・ヘッジの統計を取得"""
+    stats = resilience.stats()
+    client_stats = get_llm_client().stats()
+    stats["hedged"] = client_stats["hedged"]
+    stats["hedge_wins"] = client_stats["hedge_wins"]
+    return stats
+
+# LLM応答キャッシュ
+class ResponseCache:
+    """
+    LLM応答のキャッシュ
+    メモリ上のLRU層と、任意でSQLite（llm_cacheテーブル）の永続層を持つ
+    有効期限は clock（既定は time.time）の時刻で判定する
+    """
+
+    def __init__(self, max_entries: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL,
+                 persistent: bool = LLM_CACHE_PERSIST, clock: Callable[[], float] = time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent = persistent
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._stats = {"hits": 0, "persistent_hits": 0, "misses": 0, "bypassed": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(prompt: str, context: Optional[Dict[str, Any]], params: Dict[str, Any]) -> str:
+        """正規化したプロンプト・コンテキスト・モデルパラメータからキーを生成"""
+        normalized = re.sub(r'\s+', ' ', prompt).strip()
+        material = json.dumps(
+            {"prompt": normalized, "context": context or {}, "params": params},
+            ensure_ascii=False, sort_keys=True, default=str
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """キャッシュから応答を取得（期限切れは破棄）"""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return response
+                del self._entries[key]
+
+        if self.persistent:
+            try:
+                with get_connection() as conn:
+                    row = conn.execute(
+                        "SELECT response, expires_at FROM llm_cache WHERE cache_key = ? AND expires_at > ?",
+                        (key, now)
+                    ).fetchone()
+            except sqlite3.Error as e:
+                logging.warning(f"LLMキャッシュ読み込みエラー: {str(e)}")
+                row = None
+            if row:
+                self._put_memory(key, row[0], row[1])
+                with self._lock:
+                    self._stats["persistent_hits"] += 1
+                return row[0]
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, response: str, ttl: Optional[float] = None) -> None:
+        """応答をキャッシュに保存"""
+        now = self.clock()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        self._put_memory(key, response, expires_at)
+
+        if self.persistent:
+            # 永続層への書き込みは完了を待たない
+            try:
+                get_writer().submit(lambda conn: conn.execute(
+                    """INSERT INTO llm_cache (cache_key, response, created_at, expires_at)
+                       VALUES (?, ?, ?, ?)
+                       ON CONFLICT (cache_key) DO UPDATE SET
+                           response = excluded.response,
+                           created_at = excluded.created_at,
+                           expires_at = excluded.expires_at""",
+                    (key, response, now, expires_at)
+                ))
+            except sqlite3.Error as e:
+                logging.warning(f"LLMキャッシュ書き込みエラー: {str(e)}")
+            
+            with self._lock:
+                self._puts += 1
+                purge = self._puts % LLM_CACHE_PURGE_EVERY == 0
+            if purge:
+                self.purge_expired()
+
+    def purge_expired(self) -> None:
+        """永続層から期限切れの応答を削除"""
+        now = self.clock()
+        try:
+            get_writer().submit(lambda conn: conn.execute(
+                "DELETE FROM llm_cache WHERE expires_at <= ?", (now,)
+            ))
+        except sqlite3.Error as e:
+            logging.warning(f"LLMキャッシュ削除エラー: {str(e)}")
+
+    def _put_memory(self, key: str, response: str, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (response, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def clear(self) -> None:
+        """メモリ上のキャッシュを破棄"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット/ミス数などの統計を取得"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["persistent_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["persistent_hits"]) / lookups if lookups else 0.0
+        return stats
+
+response_cache = ResponseCache()
+
+# キャッシュ統計の取得
+def get_cache_stats() -> Dict[str, Any]:
+    """LLM応答キャッシュの統計を取得"""
+    return response_cache.stats()
+
+# 回答の類似度インデックス
+class AnswerSimilarityCache:
+    """
+    問題ごとに、回答の文字n-gramベクトルと生成済みフィードバックを保持するキャッシュ
+    正規化した回答のコサイン類似度が閾値以上の既存回答があれば、そのフィードバックを再利用する
+    """
+
+    def __init__(self, threshold: float = LLM_SIMILARITY_THRESHOLD, max_problems: int = LLM_ANSWER_CACHE_PROBLEMS,
+                 max_answers: int = LLM_ANSWER_CACHE_PER_PROBLEM, dims: int = LLM_SIMILARITY_DIMS):
+        self.threshold = threshold
+        self.max_problems = max_problems
+        self.max_answers = max_answers
+        self.dims = dims
+        self._indexes = OrderedDict()  # キー -> (ベクトル行列, 回答一覧, フィードバック一覧)
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "hits": 0, "exact_hits": 0, "stored": 0}
+
+    def vectorize(self, answer: str) -> Optional[np.ndarray]:
+        """回答を正規化し、L2正規化した文字n-gramのハッシュベクトルに変換（空ならNone）"""
+        text = normalize_text(answer).replace(" ", "")
+        if not text:
+            return None
+        # プロセスごとに変わるhash()ではなくcrc32で、類似度を再現可能にする
+        grams = [zlib.crc32(text[i:i + n].encode("utf-8")) % self.dims
+                 for n in LLM_SIMILARITY_NGRAMS for i in range(len(text) - n + 1)]
+        if not grams:
+            return None
+        vector = np.bincount(grams, minlength=self.dims).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def lookup(self, key, answer: str) -> Optional[str]:
+        """類似した回答のフィードバックを取得（なければNone）"""
+        if self.threshold > 1:
+            return None
+        vector = self.vectorize(answer)
+        with self._lock:
+            self._stats["lookups"] += 1
+            entry = self._indexes.get(key)
+            if vector is None or entry is None:
+                return None
+            self._indexes.move_to_end(key)
+            matrix, _, feedbacks = entry
+            scores = matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            self._stats["hits"] += 1
+            if scores[best] >= 1 - 1e-6:
+                self._stats["exact_hits"] += 1
+            return feedbacks[best]
+
+    def add(self, key, answer: str, feedback: str) -> None:
+        """回答とフィードバックを登録（問題ごとの件数を超えたら古いものから破棄）"""
+        vector = self.vectorize(answer)
+        if vector is None:
+            return
+        with self._lock:
+            matrix, answers, feedbacks = self._indexes.pop(key, (np.empty((0, self.dims), np.float32), [], []))
+            matrix = np.vstack([matrix, vector])[-self.max_answers:]
+            answers = (answers + [answer])[-self.max_answers:]
+            feedbacks = (feedbacks + [feedback])[-self.max_answers:]
+            self._indexes[key] = (matrix, answers, feedbacks)
+            while len(self._indexes) > self.max_problems:
+                self._indexes.popitem(last=False)
+            self._stats["stored"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indexes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット率と節約できたLLM呼び出し数などの統計を取得"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["problems"] = len(self._indexes)
+            stats["answers"] = sum(len(answers) for _, answers, _ in self._indexes.values())
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["llm_calls_saved"] = stats["hits"]
+        return stats
+
+answer_cache = AnswerSimilarityCache()
+
+# 回答キャッシュ統計の取得
+def get_answer_cache_stats() -> Dict[str, Any]:
+    """類似回答キャッシュのヒット率と節約できたLLM呼び出し数を取得"""
+    return answer_cache.stats()
+
+# 回答キャッシュのキー
+def _answer_cache_key(problem: Dict[str, Any]):
+    """問題IDと正答の組（正答が修正されたら別のキーになる）"""
+    return problem.get("id"), str(problem.get("correct_answer"))
+
+# トークン数の見積もり
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数を概算する（トークナイザーに依存しない近似）
+    日本語などの非ASCII文字は1文字1トークン、ASCIIは4文字で1トークンとみなす
+    """
+    if not text:
+        return 0
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+# テキストの切り詰め
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = "…（中略）…") -> str:
+    """上限トークン数を超える場合は、先頭と末尾を残して中間を省略する"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 1文字1トークンを上限として二分探索で残す文字数を決める
+    low, high = 0, len(text)
+    while low < high:
+        keep = (low + high + 1) // 2
+        head, tail = keep * 2 // 3, keep - keep * 2 // 3
+        candidate = text[:head] + marker + (text[-tail:] if tail else "")
+        if estimate_tokens(candidate) <= max_tokens:
+            low = keep
+        else:
+            high = keep - 1
+    head, tail = low * 2 // 3, low - low * 2 // 3
+    return text[:head] + marker + (text[-tail:] if tail else "")
+
+# プロンプトに埋め込むテキストの圧縮
+def compact_text(text: Any, max_tokens: int, seen: Optional[set] = None) -> str:
+    """
+    空白を詰め、同じ文の繰り返し（seenに含まれる他の項目の文も）を除いてから上限トークン数に切り詰める
+    残した文の間の区切り（空白・改行）は元のまま保つ
+    """
+    text = re.sub(r' *\n *', '\n', re.sub(r'[ \t\u3000]+', ' ', str(text or ""))).strip()
+    seen = set() if seen is None else seen
+    parts = []
+    for piece in re.findall(r'\n+|[^。！？!?\n]+[。！？!?]?', text):
+        if piece.startswith("\n"):
+            # 除いた文の前後の改行が重ならないよう、直前が改行なら足さない
+            if parts and not parts[-1].startswith("\n"):
+                parts.append(piece)
+            continue
+        key = piece.strip()
+        if not key:
+            continue
+        if key in seen:
+            continue
+        seen.add(key)
+        parts.append(piece)
+    return truncate_to_tokens("".join(parts).strip() or text, max_tokens)
+
+# トークン予算
+class TokenBudget:
+    """
+    直近1分間の消費トークン数を、プロセス全体とユーザーごとに制限する
+    上限を超える呼び出しはエラーにせず、枠が空くまで待たせる
+    呼び出しのないユーザーの消費記録は window 秒ごとの一括掃除で破棄する
+    """
+
+    def __init__(self, per_minute: int = LLM_TOKENS_PER_MINUTE, per_user_minute: int = LLM_USER_TOKENS_PER_MINUTE,
+                 window: float = 60.0):
+        self.per_minute = per_minute
+        self.per_user_minute = per_user_minute
+        self.window = window
+        self._usage = {}  # キー（None=全体、それ以外はユーザーID） -> deque[(時刻, トークン数)]
+        self._totals = {}
+        self._cond = threading.Condition()
+        self._stats = {"acquired": 0, "waited": 0, "wait_time": 0.0, "gave_up": 0}
+        self._functions = {}
+        self._last_sweep = time.monotonic()
+
+    def _sweep(self, now: float, force: bool = False) -> None:
+        """前回の掃除から window 秒以上経っていれば、すべてのキーの期限切れの消費を破棄"""
+        if not force and now - self._last_sweep < self.window:
+            return
+        self._last_sweep = now
+        for key in list(self._usage):
+            self._expire(key, now)
+
+    def _expire(self, key, now: float) -> None:
+        usage = self._usage.get(key)
+        while usage and usage[0][0] <= now - self.window:
+            self._totals[key] -= usage.popleft()[1]
+        if usage is not None and not usage:
+            del self._usage[key]
+            del self._totals[key]
+
+    def _blocked_until(self, key, limit: int, tokens: int, now: float) -> Optional[float]:
+        """枠に収まらない場合に、最も古い消費が期限切れになる時刻を返す（収まればNone）"""
+        used = self._totals.get(key, 0)
+        # 枠が空なら上限を超える1件も通す（永久に待たないため）
+        if used == 0 or used + tokens <= limit:
+            return None
+        return self._usage[key][0][0] + self.window
+
+    def _add(self, key, tokens: int, now: float) -> None:
+        self._usage.setdefault(key, deque()).append((now, tokens))
+        self._totals[key] = self._totals.get(key, 0) + tokens
+
+    def acquire(self, user_id: Optional[str], tokens: int, timeout: float = LLM_BUDGET_MAX_WAIT) -> bool:
+        """予算の枠が空くまで待ってから消費する（timeout秒以内に空かなければFalse）"""
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._sweep(now)
+                self._expire(None, now)
+                blocked = [self._blocked_until(None, self.per_minute, tokens, now)]
+                if user_id is not None:
+                    self._expire(user_id, now)
+                    blocked.append(self._blocked_until(user_id, self.per_user_minute, tokens, now))
+                blocked = [t for t in blocked if t is not None]
+                if not blocked:
+                    self._add(None, tokens, now)
+                    if user_id is not None:
+                        self._add(user_id, tokens, now)
+                    self._stats["acquired"] += 1
+                    if waited:
+                        self._stats["wait_time"] += now - started
+                    return True
+                if now >= deadline:
+                    self._stats["gave_up"] += 1
+                    return False
+                if not waited:
+                    waited = True
+                    self._stats["waited"] += 1
+                self._cond.wait(min(max(blocked), deadline) - now)
+
+    def record(self, user_id: Optional[str], tokens: int) -> None:
+        """応答など事後に分かる消費を記録（待たない）"""
+        if tokens <= 0:
+            return
+        with self._cond:
+            now = time.monotonic()
+            self._sweep(now)
+            self._add(None, tokens, now)
+            if user_id is not None:
+                self._add(user_id, tokens, now)
+
+    def count(self, function: str, tokens_in: int, tokens_out: int) -> None:
+        """関数ごとの入出力トークン数を集計"""
+        with self._cond:
+            counters = self._functions.setdefault(function, {"calls": 0, "tokens_in": 0, "tokens_out": 0})
+            counters["calls"] += 1
+            counters["tokens_in"] += tokens_in
+            counters["tokens_out"] += tokens_out
+
+    def stats(self) -> Dict[str, Any]:
+        """予算の待ち状況と関数ごとのトークン数を取得"""
+        with self._cond:
+            now = time.monotonic()
+            self._sweep(now, force=True)
+            stats = dict(self._stats)
+            stats["tokens_last_minute"] = self._totals.get(None, 0)
+            stats["active_users"] = len(self._usage) - (None in self._usage)
+            stats["functions"] = {name: dict(counters) for name, counters in self._functions.items()}
+        return stats
+
+token_budget = TokenBudget()
+
+# トークン統計の取得
+def get_token_stats() -> Dict[str, Any]:
+    """関数ごとの入出力トークン数と、予算による待ちの統計を取得"""
+    return token_budget.stats()
+
 # LLM API呼び出し
-def call_llm_api(prompt: str, context: Optional[Dict[str, Any]] = None) -> str:
+def call_llm_api(prompt: str, context: Optional[Dict[str, Any]] = None,
+                 use_cache: bool = True, cache_ttl: Optional[float] = None,
+                 timeout: float = LLM_TIMEOUT, user_id: Optional[str] = None,
+                 purpose: str = "call_llm_api") -> str:
     """
     LLM API呼び出し関数
     将来的に実際のAPI（OpenAI, Anthropic, ローカルLlamaなど）に接続
+    use_cache=Falseで応答キャッシュを使わない（自由記述の回答を含むプロンプト向け）
+    timeoutは同時実行数の待ちを含めた呼び出し全体の期限（秒）
+    user_idごとのトークン予算を超える場合は枠が空くまで待ち、purposeごとにトークン数を集計する
     """
     api_key = os.getenv("LLM_API_KEY")
     api_endpoint = os.getenv("LLM_API_ENDPOINT")
@@ -26,12 +1080,34 @@ def call_llm_api(prompt: str, context: Optional[Dict[str, Any]] = None) -> str:
         # API設定がない場合はスタブレスポンスを返す
         return get_canned_response(prompt)
     
+    # キャッシュ確認
+    cache_key = None
+    if use_cache:
+        cache_key = ResponseCache.make_key(prompt, context, {
+            "endpoint": api_endpoint,
+            "max_tokens": LLM_MAX_TOKENS,
+            "temperature": LLM_TEMPERATURE
+        })
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    else:
+        response_cache.record_bypass()
+    
+    # トークン予算の確保（超過時は待ち、期限内に空かなければスタブ）
+    started = time.monotonic()
+    tokens_in = estimate_tokens(prompt) + estimate_tokens(json.dumps(context or {}, ensure_ascii=False))
+    if not token_budget.acquire(user_id, tokens_in, min(LLM_BUDGET_MAX_WAIT, timeout)):
+        logging.warning(f"トークン予算の待ちが上限を超えました: {purpose}")
+        return get_canned_response(prompt)
+    timeout = max(0.0, timeout - (time.monotonic() - started))
+    
     try:
         # API呼び出し用のペイロード作成
         payload = {
             "prompt": prompt,
-            "max_tokens": 500,
-            "temperature": 0.7,
+            "max_tokens": LLM_MAX_TOKENS,
+            "temperature": LLM_TEMPERATURE,
             "context": context or {}
         }
         
@@ -41,24 +1117,120 @@ def call_llm_api(prompt: str, context: Optional[Dict[str, Any]] = None) -> str:
             "Authorization": f"Bearer {api_key}"
         }
         
-        # APIリクエスト
-        response = requests.post(
-            api_endpoint,
-            headers=headers,
-            data=json.dumps(payload),
-            timeout=30
-        )
+        batch_endpoint = get_batch_endpoint()
         
-        if response.status_code == 200:
-            result = response.json()
-            return result.get("text", STUB_RESPONSES["default"])
-        else:
-            logging.error(f"LLM API エラー: ステータスコード {response.status_code}")
+        def _attempt(remaining):
+            if batch_endpoint:
+                # バッチAPIがある場合は同時期の呼び出しとまとめて送信
+                return get_batcher().call(batch_endpoint, headers, payload, remaining, fallback_url=api_endpoint)
+            
+            # APIリクエスト（共有クライアントの接続プールを使用、遅い場合はヘッジ）
+            client = get_llm_client()
+            hedge_after = resilience.hedge_delay()
+            if hedge_after is not None and hedge_after < remaining:
+                response = client.post_hedged_sync(api_endpoint, headers, payload, remaining, hedge_after)
+            else:
+                response = client.post_sync(api_endpoint, headers=headers, payload=payload, timeout=remaining)
+            if response.status_code != 200:
+                raise LLMStatusError(response.status_code)
+            return response.json().get("text")
+        
+        # ブレーカーが開いていれば即座に失敗し、失敗時は予算の範囲でリトライ
+        text = resilience.call(_attempt, timeout)
+        
+        tokens_out = estimate_tokens(text or "")
+        token_budget.record(user_id, tokens_out)
+        token_budget.count(purpose, tokens_in, tokens_out)
+        if text is None:
             return STUB_RESPONSES["default"]
+        if cache_key:
+            response_cache.put(cache_key, text, cache_ttl)
+        return text
+    except CircuitOpenError:
+        return get_canned_response(prompt)
     except Exception as e:
         logging.error(f"LLM API 呼び出しエラー: {str(e)}")
         return STUB_RESPONSES["default"]
 
+# ストリーミングLLM API呼び出し
+def stream_llm_api(prompt: str, context: Optional[Dict[str, Any]] = None,
+                   timeout: float = LLM_TIMEOUT, user_id: Optional[str] = None,
+                   purpose: str = "stream_llm_api") -> Iterator[str]:
+    """
+    LLM APIの応答を断片ごとに返すジェネレータ
+    API設定がない場合はスタブレスポンスを分割して返す
+    """
+    api_key = os.getenv("LLM_API_KEY")
+    api_endpoint = os.getenv("LLM_API_ENDPOINT")
+    
+    if not api_key or not api_endpoint:
+        yield from stream_canned_response(prompt)
+        return
+    
+    payload = {
+        "prompt": prompt,
+        "max_tokens": LLM_MAX_TOKENS,
+        "temperature": LLM_TEMPERATURE,
+        "context": context or {},
+        "stream": True
+    }
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+    
+    started = time.monotonic()
+    tokens_in = estimate_tokens(prompt) + estimate_tokens(json.dumps(context or {}, ensure_ascii=False))
+    if not token_budget.acquire(user_id, tokens_in, min(LLM_BUDGET_MAX_WAIT, timeout)):
+        logging.warning(f"トークン予算の待ちが上限を超えました: {purpose}")
+        yield from stream_canned_response(prompt)
+        return
+    timeout = max(0.0, timeout - (time.monotonic() - started))
+    
+    if not resilience.breaker.allow():
+        # ブレーカーが開いている間は待たずにスタブを返す
+        yield from stream_canned_response(prompt)
+        return
+    
+    received = False
+    recorded = False
+    tokens_out = 0
+    try:
+        for chunk in get_llm_client().stream_sync(api_endpoint, headers, payload, timeout):
+            if not recorded:
+                # 最初の断片が届いた時点で成功とみなす（ヘッジの閾値には使わない）
+                recorded = True
+                resilience.record(True)
+            received = True
+            tokens_out += estimate_tokens(chunk)
+            yield chunk
+    except Exception as e:
+        logging.error(f"LLM API ストリーミングエラー: {str(e)}")
+        if not recorded:
+            recorded = True
+            resilience.record(False)
+        if not received:
+            yield STUB_RESPONSES["default"]
+    finally:
+        if not recorded:
+            # 応答なしで完了した、または読み手が途中で離れた場合
+            resilience.breaker.release()
+        token_budget.record(user_id, tokens_out)
+        token_budget.count(purpose, tokens_in, tokens_out)
+
+# スタブレスポンスのストリーミング
+def stream_canned_response(prompt: str, chunk_size: int = LLM_STREAM_CHUNK_SIZE,
+                           delay: float = LLM_STREAM_DELAY) -> Iterator[str]:
+    """
+    スタブレスポンスを分割して返す
+    開発・テスト用にストリーミング表示を再現する
+    """
+    text = get_canned_response(prompt)
+    for i in range(0, len(text), chunk_size):
+        if delay:
+            time.sleep(delay)
+        yield text[i:i + chunk_size]
+
 # スタブレスポンスの取得
 def get_canned_response(prompt: str) -> str:
     """
@@ -77,26 +1249,93 @@ def get_canned_response(prompt: str) -> str:
         return STUB_RESPONSES["default"]
 
 # 問題に対するフィードバック生成
-def generate_problem_feedback(problem: Dict[str, Any], answer: str) -> str:
+def generate_problem_feedback(problem: Dict[str, Any], answer: str, user_id: Optional[str] = None) -> str:
     """
     問題と回答に基づいたフィードバックを生成
+    同じ問題に似た回答があれば、そのフィードバックを再利用する
     """
+    key = _answer_cache_key(problem)
+    cached = answer_cache.lookup(key, answer)
+    if cached is not None:
+        return cached
+    
+    # 自由記述の回答を含むため、完全一致の応答キャッシュは使わない
+    feedback = call_llm_api(*_feedback_request(problem, answer), use_cache=False,
+                            user_id=user_id, purpose="generate_problem_feedback")
+    if feedback not in STUB_RESPONSES.values():
+        answer_cache.add(key, answer, feedback)
+    return feedback
+
+# フィードバックのストリーミング生成
+def stream_problem_feedback(problem: Dict[str, Any], answer: str, user_id: Optional[str] = None) -> Iterator[str]:
+    """
+    問題と回答に基づいたフィードバックを断片ごとに生成
+    バッチ送信が有効な場合は同時期の回答とまとめて生成し、結果を分割して返す
+    """
+    if get_batch_endpoint():
+        return _chunked(generate_problem_feedback(problem, answer, user_id))
+    
+    key = _answer_cache_key(problem)
+    cached = answer_cache.lookup(key, answer)
+    if cached is not None:
+        return _chunked(cached)
+    return _remember_feedback(key, answer, stream_llm_api(
+        *_feedback_request(problem, answer), user_id=user_id, purpose="stream_problem_feedback"
+    ))
+
+# ストリーミングしたフィードバックの登録
+def _remember_feedback(key, answer: str, chunks: Iterator[str]) -> Iterator[str]:
+    """断片をそのまま返し、最後まで受信できたフィードバックを類似回答キャッシュに登録"""
+    received = []
+    for chunk in chunks:
+        received.append(chunk)
+        yield chunk
+    feedback = "".join(received)
+    if feedback and feedback not in STUB_RESPONSES.values():
+        answer_cache.add(key, answer, feedback)
+
+# テキストの分割
+def _chunked(text: str, chunk_size: int = LLM_STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """テキストを一定文字数ごとに分割して返す"""
+    for i in range(0, len(text), chunk_size):
+        yield text[i:i + chunk_size]
+
+# プロンプトの問題部分の作成
+def _problem_section(problem: Dict[str, Any], answer: Optional[str] = None) -> str:
+    """
+    状況・問題文・回答を上限トークン数まで圧縮して並べる
+    問題文に含まれる状況の文や、回答中の繰り返しは除く
+    """
+    seen = set()
+    question = compact_text(problem.get("question"), LLM_QUESTION_MAX_TOKENS, seen)
+    context = compact_text(problem.get("context"), LLM_QUESTION_MAX_TOKENS, seen)
+    lines = []
+    if context:
+        lines.append(f"状況: {context}")
+    lines.append(f"問題: {question}")
+    if answer is not None:
+        lines.append(f"ユーザーの回答: {compact_text(answer, LLM_ANSWER_MAX_TOKENS, seen)}")
+    return "\n    ".join(lines)
+
+# フィードバック用プロンプトの作成
+def _feedback_request(problem: Dict[str, Any], answer: str):
+    """フィードバック生成用の (プロンプト, コンテキスト) を作成"""
+    correct_answer = problem.get("correct_answer")
     prompt = f"""
-    問題: {problem.get('question')}
-    ユーザーの回答: {answer}
-    正答: {problem.get('correct_answer', '不明')}
+    {_problem_section(problem, answer)}
+    正答: {compact_text(correct_answer, LLM_ANSWER_MAX_TOKENS) if correct_answer is not None else '不明'}
     
     この回答に対する教育的なフィードバックと、さらに深く考えるためのポイントを提案してください。
     """
     
-    return call_llm_api(prompt, {
+    return prompt, {
         "problem_type": problem.get("category", ""),
         "difficulty": problem.get("difficulty", 1),
         "tags": problem.get("tags", [])
-    })
+    }
 
 # ヒント生成
-def generate_hint(problem: Dict[str, Any], hint_step: int) -> str:
+def generate_hint(problem: Dict[str, Any], hint_step: int, user_id: Optional[str] = None) -> str:
     """
     問題に対するヒントを生成
     既存のヒントがある場合はそれを使い、ない場合は生成
@@ -106,7 +1345,7 @@ def generate_hint(problem: Dict[str, Any], hint_step: int) -> str:
     
     # ヒントがない場合はAPIで生成
     prompt = f"""
-    問題: {problem.get('question')}
+    {_problem_section(problem)}
     
     この問題に対する{hint_step + 1}つ目のヒントを生成してください。
     直接的な答えは含めず、考え方のポイントを示唆するヒントにしてください。
@@ -116,12 +1355,14 @@ def generate_hint(problem: Dict[str, Any], hint_step: int) -> str:
         "problem_type": problem.get("category", ""),
         "difficulty": problem.get("difficulty", 1),
         "hint_level": hint_step + 1
-    })
+    }, user_id=user_id, purpose="generate_hint")
 
 # フォローアップ質問生成
-def generate_follow_up(problem: Dict[str, Any], answer: str) -> str:
+def generate_follow_up(problem: Dict[str, Any], answer: Optional[str] = None,
+                       user_id: Optional[str] = None) -> str:
     """
     問題と回答に基づいたフォローアップ質問を生成
+    answerを省略すると回答に依存しない質問を生成する（先読み・キャッシュ可能）
     """
     if "follow_up" in problem and problem["follow_up"]:
         # ランダムに選択
@@ -129,15 +1370,85 @@ def generate_follow_up(problem: Dict[str, Any], answer: str) -> str:
         return random.choice(problem["follow_up"])
     
     # フォローアップがない場合はAPIで生成
-    prompt = f"""
-    問題: {problem.get('question')}
-    ユーザーの回答: {answer}
+    if answer is None:
+        prompt = f"""
+    {_problem_section(problem)}
+    
+    この問題に関連して、さらに深く考えさせるフォローアップ質問を1つ生成してください。
+    実生活での応用や、別の視点からの考察を促す質問が望ましいです。
+    """
+    else:
+        prompt = f"""
+    {_problem_section(problem, answer)}
     
     この問題と回答に関連して、さらに深く考えさせるフォローアップ質問を1つ生成してください。
     実生活での応用や、別の視点からの考察を促す質問が望ましいです。
     """
     
+    # 自由記述の回答を含む場合はキャッシュしない
     return call_llm_api(prompt, {
         "problem_type": problem.get("category", ""),
         "tags": problem.get("tags", [])
-    })
\ No newline at end of file
+    }, use_cache=answer is None, user_id=user_id, purpose="generate_follow_up")
+
+# LLM呼び出しの先読み
+class LLMPrefetcher:
+    """
+    セッション単位の先読み
+    ヒントやフォローアップを表示前にスレッドプールで生成し、キーごとのFutureとして保持する
+    """
+
+    _executor = ThreadPoolExecutor(max_workers=LLM_PREFETCH_WORKERS, thread_name_prefix="llm-prefetch")
+    _stats_lock = threading.Lock()
+    _stats = {"started": 0, "hits": 0, "misses": 0, "timeouts": 0, "cancelled": 0, "wasted": 0}
+
+    def __init__(self):
+        self._futures = {}
+
+    @classmethod
+    def _count(cls, name: str) -> None:
+        with cls._stats_lock:
+            cls._stats[name] += 1
+
+    def prefetch(self, key, fn, *args) -> None:
+        """未着手であれば先読みを開始"""
+        if key in self._futures:
+            return
+        self._futures[key] = self._executor.submit(fn, *args)
+        self._count("started")
+
+    def take(self, key, fn, *args, timeout: float = LLM_PREFETCH_WAIT, default: Optional[str] = None):
+        """
+        先読み結果を取り出す（先読みしていなければその場で実行）
+        実行中の先読みはtimeout秒だけ待ち、間に合わなければdefault（省略時はスタブ応答）を返す
+        """
+        future = self._futures.pop(key, None)
+        if future is not None and not future.cancelled():
+            try:
+                result = future.result(timeout=timeout)
+                self._count("hits")
+                return result
+            except FutureTimeoutError:
+                # 同期で呼び直すとクリックが最大で期限の2倍待たされるため、スタブ応答で済ませる
+                self._count("cancelled" if future.cancel() else "wasted")
+                self._count("timeouts")
+                return STUB_RESPONSES["default"] if default is None else default
+            except Exception as e:
+                logging.warning(f"先読みエラー: {str(e)}")
+        self._count("misses")
+        return fn(*args)
+
+    def cancel_all(self) -> None:
+        """不要になった先読みをすべて取り消す（実行済み・実行中のものは無駄な呼び出しとして数える）"""
+        for future in self._futures.values():
+            self._count("cancelled" if future.cancel() else "wasted")
+        self._futures.clear()
+
+# 先読み統計の取得
+def get_prefetch_stats() -> Dict[str, Any]:
+    """先読みのヒット率と無駄になった呼び出し数を取得"""
+    with LLMPrefetcher._stats_lock:
+        stats = dict(LLMPrefetcher._stats)
+    taken = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / taken if taken else 0.0
+    return stats
\ No newline at end of file
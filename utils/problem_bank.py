@@ -0,0 +1,399 @@
+import os
+import json
+import mmap
+import struct
+import logging
+import threading
+import weakref
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Any, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+from models.data_models import Problem
+
+# 定数
+PROBLEM_JSON = "problems.json"
+PROBLEM_BIN = "problems.bin"
+
+# コンパイル済み問題バンクの形式
+# ヘッダー: マジック(4) + 形式バージョン(u32) + 問題数(u32) + 文字列領域の開始位置(u32)
+# オフセット表: 問題ごとに (id, カテゴリ, タグ, 本体JSON) の (開始位置, 長さ) と難易度
+# 文字列領域: UTF-8文字列を詰めて格納（同一文字列は共有）
+BIN_MAGIC = b"TMPB"
+BIN_FORMAT_VERSION = 1
+BIN_HEADER = struct.Struct("<4sIII")
+BIN_RECORD = struct.Struct("<8Ii")
+TAG_SEPARATOR = "\x1f"
+MATERIALIZE_CACHE_SIZE = 4096
+PROBLEM_WATCH_INTERVAL = float(os.getenv("PROBLEM_WATCH_INTERVAL", "5"))  # 0で監視しない
+
+# 問題カタログ
+class ProblemCatalog:
+    """
+    問題一覧と各種インデックスを保持する読み取り専用カタログ
+    プロセスで1度だけ構築し、全セッションで共有する
+    """
+
+    def __init__(self, problems: Iterable[Problem], version: int = 0):
+        self.version = version
+        problems = tuple(problems)
+        self._load = problems.__getitem__
+        self._build_indexes((p.id, p.category, p.tags or [], p.difficulty) for p in problems)
+
+    def _build_indexes(self, keys: Iterable[Tuple[str, str, List[str], int]]) -> None:
+        """(id, カテゴリ, タグ, 難易度) の並びから位置インデックスを構築"""
+        by_id = {}
+        by_category = {}
+        by_tag = {}
+        by_difficulty = {}
+        positions = {}
+        category_ids = {}
+        for pos, (problem_id, category, tags, difficulty) in enumerate(keys):
+            if problem_id in by_id:
+                logging.warning(f"問題IDが重複しています: {problem_id}")
+                continue
+            by_id[problem_id] = pos
+            category_positions = by_category.setdefault(category, [])
+            positions[problem_id] = len(category_positions)
+            category_positions.append(pos)
+            category_ids.setdefault(category, set()).add(problem_id)
+            for tag in tags:
+                by_tag.setdefault(tag, []).append(pos)
+            by_difficulty.setdefault(difficulty, []).append(pos)
+
+        self._order = tuple(by_id.values())
+        self._by_id = MappingProxyType(by_id)
+        self._by_category = MappingProxyType({k: tuple(v) for k, v in by_category.items()})
+        self._by_tag = MappingProxyType({k: tuple(v) for k, v in by_tag.items()})
+        self._by_difficulty = MappingProxyType({k: tuple(v) for k, v in by_difficulty.items()})
+        self._positions = MappingProxyType(positions)
+        self._category_ids = MappingProxyType({k: frozenset(v) for k, v in category_ids.items()})
+
+    def _materialize_all(self, positions: Tuple[int, ...]) -> Tuple[Problem, ...]:
+        return tuple(self._load(pos) for pos in positions)
+
+    @classmethod
+    def from_dicts(cls, items: Iterable[Dict[str, Any]], version: int = 0, strict: bool = False) -> 'ProblemCatalog':
+        """
+        辞書のリストからカタログを構築
+        strict=Trueの場合は不正な問題があればValueError、それ以外はスキップ
+        """
+        problems = []
+        for item in items:
+            try:
+                problems.append(Problem.from_dict(item))
+            except (KeyError, TypeError) as e:
+                if strict:
+                    raise ValueError(f"不正な問題データ: {item.get('id', '不明') if isinstance(item, dict) else item} - {str(e)}")
+                logging.warning(f"不正な問題データをスキップしました: {item.get('id', '不明') if isinstance(item, dict) else item} - {str(e)}")
+        return cls(problems, version)
+
+    @classmethod
+    def from_json(cls, path: str = PROBLEM_JSON, version: int = 0, strict: bool = False) -> 'ProblemCatalog':
+        """JSONファイルからカタログを構築"""
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f)
+        if not isinstance(items, list):
+            raise ValueError(f"問題データはリストである必要があります: {path}")
+        return cls.from_dicts(items, version, strict)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __iter__(self) -> Iterator[Problem]:
+        return (self._load(pos) for pos in self._order)
+
+    def get(self, problem_id: str) -> Optional[Problem]:
+        """IDから問題を取得"""
+        pos = self._by_id.get(problem_id)
+        return self._load(pos) if pos is not None else None
+
+    def categories(self) -> List[str]:
+        """カテゴリ一覧を取得"""
+        return list(self._by_category)
+
+    def by_category(self, category: str) -> Tuple[Problem, ...]:
+        """カテゴリ内の問題一覧を取得"""
+        return self._materialize_all(self._by_category.get(category, ()))
+
+    def by_tag(self, tag: str) -> Tuple[Problem, ...]:
+        """タグが付いた問題一覧を取得"""
+        return self._materialize_all(self._by_tag.get(tag, ()))
+
+    def by_difficulty(self, difficulty: int) -> Tuple[Problem, ...]:
+        """難易度ごとの問題一覧を取得"""
+        return self._materialize_all(self._by_difficulty.get(difficulty, ()))
+
+    def get_by_index(self, category: str, index: int) -> Optional[Problem]:
+        """カテゴリ内のインデックスから問題を取得"""
+        positions = self._by_category.get(category, ())
+        if 0 <= index < len(positions):
+            return self._load(positions[index])
+        return None
+
+    def index_of(self, problem_id: str) -> Optional[int]:
+        """カテゴリ内での問題の位置を取得"""
+        return self._positions.get(problem_id)
+
+    def count(self, category: str) -> int:
+        """カテゴリ内の問題数を取得"""
+        return len(self._by_category.get(category, ()))
+
+    def category_ids(self, category: str) -> FrozenSet[str]:
+        """カテゴリ内の問題IDの集合を取得（Problemは生成しない）"""
+        return self._category_ids.get(category, frozenset())
+
+# コンパイル済み問題カタログ
+class CompiledProblemCatalog(ProblemCatalog):
+    """
+    コンパイル済み問題バンクをmmapで読み込むカタログ
+    インデックスのみを起動時に構築し、Problemはアクセス時に生成する
+    どのセッションからも参照されなくなった時点でmmapを閉じる
+    """
+
+    def __init__(self, path: str = PROBLEM_BIN, version: int = 0):
+        self.version = version
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, format_version, count, _ = BIN_HEADER.unpack_from(self._mm, 0)
+        if magic != BIN_MAGIC or format_version != BIN_FORMAT_VERSION:
+            self._mm.close()
+            raise ValueError(f"問題バンクの形式が不正です: {path}")
+
+        table_end = BIN_HEADER.size + BIN_RECORD.size * count
+        self._records = list(BIN_RECORD.iter_unpack(self._mm[BIN_HEADER.size:table_end]))
+        # キャッシュがselfを参照すると循環参照になりmmapの解放がGC任せになるため、mmapと表だけを閉じ込める
+        self._load = _materializer(self._mm, self._records)
+        self._finalizer = weakref.finalize(self, self._mm.close)
+        self._build_indexes(
+            (
+                self._string(id_off, id_len),
+                self._string(cat_off, cat_len),
+                self._string(tags_off, tags_len).split(TAG_SEPARATOR) if tags_len else [],
+                difficulty
+            )
+            for id_off, id_len, cat_off, cat_len, tags_off, tags_len, _, _, difficulty in self._records
+        )
+
+    def _string(self, offset: int, length: int) -> str:
+        return _read_string(self._mm, offset, length)
+
+    @property
+    def closed(self) -> bool:
+        return not self._finalizer.alive
+
+    def close(self) -> None:
+        """mmapを解放"""
+        self._finalizer()
+
+# 文字列領域の読み出し
+def _read_string(mm: mmap.mmap, offset: int, length: int) -> str:
+    return mm[offset:offset + length].decode("utf-8")
+
+# Problem生成関数の作成
+def _materializer(mm: mmap.mmap, records: List[Tuple]):
+    """オフセット表の位置からProblemを生成する、LRUキャッシュ付きの関数を作成"""
+    @lru_cache(maxsize=MATERIALIZE_CACHE_SIZE)
+    def _materialize(pos: int) -> Problem:
+        id_off, id_len, cat_off, cat_len, tags_off, tags_len, body_off, body_len, _ = records[pos]
+        data = json.loads(_read_string(mm, body_off, body_len))
+        data["id"] = _read_string(mm, id_off, id_len)
+        data["category"] = _read_string(mm, cat_off, cat_len)
+        data["tags"] = _read_string(mm, tags_off, tags_len).split(TAG_SEPARATOR) if tags_len else []
+        return Problem.from_dict(data)
+    return _materialize
+
+# 問題バンクのコンパイル
+def compile_problem_bank(json_path: str = PROBLEM_JSON, out_path: str = PROBLEM_BIN) -> int:
+    """問題JSONをオフセット表＋文字列領域のバイナリ形式に変換し、問題数を返す"""
+    with open(json_path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+
+    pool = bytearray()
+    pooled = {}
+
+    def _intern(text: str) -> Tuple[int, int]:
+        data = text.encode("utf-8")
+        if data not in pooled:
+            pooled[data] = len(pool)
+            pool.extend(data)
+        return pooled[data], len(data)
+
+    records = []
+    for item in items:
+        try:
+            problem = Problem.from_dict(item)
+        except (KeyError, TypeError) as e:
+            logging.warning(f"不正な問題データをスキップしました: {item.get('id', '不明') if isinstance(item, dict) else item} - {str(e)}")
+            continue
+        try:
+            difficulty = int(problem.difficulty)
+            if not -2 ** 31 <= difficulty < 2 ** 31:
+                raise ValueError("範囲外です")
+        except (ValueError, TypeError) as e:
+            logging.warning(f"難易度が不正な問題をスキップしました: {problem.id} ({problem.difficulty!r}) - {str(e)}")
+            continue
+        problem.difficulty = difficulty
+        # id・カテゴリ・タグは別に格納するため、本体からは空の項目とともに除く
+        body = {
+            key: value for key, value in problem.to_dict().items()
+            if key not in ("id", "category", "tags") and value not in (None, [], "")
+        }
+        payload = json.dumps(body, ensure_ascii=False, separators=(",", ":"))
+        records.append((
+            _intern(problem.id),
+            _intern(problem.category),
+            _intern(TAG_SEPARATOR.join(problem.tags or [])),
+            _intern(payload),
+            difficulty
+        ))
+
+    pool_start = BIN_HEADER.size + BIN_RECORD.size * len(records)
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(BIN_HEADER.pack(BIN_MAGIC, BIN_FORMAT_VERSION, len(records), pool_start))
+        for (id_off, id_len), (cat_off, cat_len), (tags_off, tags_len), (body_off, body_len), difficulty in records:
+            f.write(BIN_RECORD.pack(
+                pool_start + id_off, id_len,
+                pool_start + cat_off, cat_len,
+                pool_start + tags_off, tags_len,
+                pool_start + body_off, body_len,
+                difficulty
+            ))
+        f.write(pool)
+    os.replace(tmp_path, out_path)
+    return len(records)
+
+# カタログの読み込み
+def load_catalog(json_path: str = PROBLEM_JSON, bin_path: str = PROBLEM_BIN, version: int = 0,
+                 strict: bool = False) -> ProblemCatalog:
+    """JSONより新しいコンパイル済みバンクがあればmmapで、なければJSONから読み込む"""
+    try:
+        if os.path.exists(bin_path) and (
+            not os.path.exists(json_path) or os.path.getmtime(bin_path) >= os.path.getmtime(json_path)
+        ):
+            return CompiledProblemCatalog(bin_path, version)
+    except (OSError, ValueError, struct.error) as e:
+        logging.warning(f"コンパイル済み問題バンクを読み込めませんでした: {str(e)}")
+    return ProblemCatalog.from_json(json_path, version, strict)
+
+# 問題バンクの監視
+class ProblemBankWatcher:
+    """
+    問題ファイルの更新日時とサイズをポーリングし、変更があれば
+    リクエスト処理とは別スレッドで読み込み・検証してカタログを差し替える
+    """
+
+    def __init__(self, json_path: str = PROBLEM_JSON, bin_path: str = PROBLEM_BIN,
+                 interval: float = PROBLEM_WATCH_INTERVAL):
+        self.json_path = json_path
+        self.bin_path = bin_path
+        self.interval = interval
+        self._signature = self._current_signature()
+        self._stop = threading.Event()
+        self._thread = None
+        self.reloads = 0
+        self.failures = 0
+
+    def _current_signature(self) -> Tuple:
+        """監視対象ファイルの (更新日時, サイズ) の組"""
+        signature = []
+        for path in (self.json_path, self.bin_path):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def start(self) -> None:
+        """監視スレッドを起動"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="problem-bank-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """監視スレッドを停止"""
+        self._stop.set()
+
+    def check_now(self) -> bool:
+        """変更を確認し、再読み込みした場合はTrueを返す"""
+        signature = self._current_signature()
+        if signature == self._signature:
+            return False
+
+        try:
+            catalog = load_catalog(self.json_path, self.bin_path, _next_version(), strict=True)
+        except (OSError, ValueError, struct.error) as e:
+            # 不正な更新は取り込まず、現在のカタログを使い続ける
+            self.failures += 1
+            self._signature = signature
+            logging.error(f"問題データ再読み込みエラー: {str(e)}")
+            return False
+
+        self._signature = signature
+        self.reloads += 1
+        _set_catalog(catalog)
+        logging.info(f"問題データを再読み込みしました: v{catalog.version} ({len(catalog)}問)")
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check_now()
+            except Exception as e:
+                logging.error(f"問題データ監視エラー: {str(e)}")
+
+_catalog = None
+_catalog_lock = threading.Lock()
+_catalog_version = 0
+_watcher = None
+
+# カタログバージョンの採番
+def _next_version() -> int:
+    global _catalog_version
+    with _catalog_lock:
+        _catalog_version += 1
+        return _catalog_version
+
+# カタログの差し替え
+def _set_catalog(catalog: ProblemCatalog) -> None:
+    """共有カタログを原子的に差し替える（取得済みのカタログは引き続き有効）"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None or catalog.version > _catalog.version:
+            _catalog = catalog
+
+# 共有カタログの取得
+def get_catalog() -> ProblemCatalog:
+    """プロセス共通の問題カタログを取得（初回のみ構築し、以降は監視スレッドが更新）"""
+    global _watcher
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None and _watcher is None and PROBLEM_WATCH_INTERVAL > 0:
+                _watcher = ProblemBankWatcher()
+                _watcher.start()
+        if _catalog is None:
+            try:
+                _set_catalog(load_catalog(version=_next_version()))
+            except (OSError, ValueError) as e:
+                logging.error(f"問題データロードエラー: {str(e)}")
+                return ProblemCatalog([])
+    return _catalog
+
+# コマンドラインからの実行
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="思考力マスター 問題バンク管理")
+    parser.add_argument("command", choices=["compile"], help="実行するコマンド")
+    parser.add_argument("--input", default=PROBLEM_JSON, help="問題JSONのパス")
+    parser.add_argument("--output", default=PROBLEM_BIN, help="出力先のパス")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "compile":
+        print(f"コンパイルした問題数: {compile_problem_bank(args.input, args.output)}")